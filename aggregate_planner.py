@@ -0,0 +1,354 @@
+"""
+Aggregate planner for the report tables
+Each report table declares the aggregates it needs (a group key, and a column and
+reduction per output column). On first use the planner computes every pending
+table together: aggregates are pooled by group key, each key is factorized and
+sorted once, and all reductions for that key run over the shared sort order in a
+single grouped scan. Factorized columns and sort orders are cached, so a column
+used as a group key in one table and counted (nunique) in another is encoded once,
+and tables declared later reuse them.
+
+Reductions: size, count, sum, mean, median, p90, p99, min, max and nunique. Nulls are skipped
+as in pandas. An aggregate can be restricted with where=, naming a boolean mask
+given to the planner, a boolean column, or any other column (rows where it is not
+null). Integer, timedelta and datetime sums and extremes are exact; tables without
+a group key (key=None) reduce with the same pairwise sums as pandas. Quantiles
+interpolate linearly like pandas, from one sort of (group, value) per column that
+all quantiles of that column share.
+"""
+
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+Aggregate = namedtuple('Aggregate', ['name', 'column', 'func', 'where'], defaults=[None])
+TableSpec = namedtuple('TableSpec', ['key', 'aggregates', 'sort'])
+Grouping = namedtuple('Grouping', ['codes', 'uniques', 'order', 'starts', 'counts'])
+
+QUANTILES = {'median': 0.5, 'p90': 0.9, 'p99': 0.99}
+REDUCTIONS = ['size', 'count', 'sum', 'mean', *QUANTILES, 'min', 'max', 'nunique']
+
+
+class AggregatePlanner:
+    """Computes declared report tables in the fewest grouped scans over a frame"""
+
+    def __init__(self, frame, masks=None):
+        self.frame = frame
+        self.masks = {name: np.asarray(mask, dtype=bool) for name, mask in (masks or {}).items()}
+        self.specs = {}
+        self.results = {}
+        self.scans = []
+        self._encodings = {}
+        self._groupings = {}
+        self._sorted_values = {}
+
+    def declare(self, name, key, aggregates, sort=True):
+        """Register a table: one row per value of key (or a single row for key=None)"""
+
+        for aggregate in aggregates:
+            if aggregate.func not in REDUCTIONS:
+                raise ValueError(f"Unknown reduction '{aggregate.func}' for {name}.{aggregate.name} "
+                                 f"(choose from: {', '.join(REDUCTIONS)})")
+        self.specs[name] = TableSpec(key, list(aggregates), sort)
+        self.results.pop(name, None)
+        return self
+
+    def table(self, name):
+        """A declared table, computing every pending table on first use"""
+
+        if name not in self.specs:
+            raise KeyError(f"Table '{name}' was not declared")
+        if name not in self.results:
+            self.run()
+        return self.results[name]
+
+    def run(self):
+        """Compute all pending tables with one grouped scan per distinct group key"""
+
+        pending = [name for name in self.specs if name not in self.results]
+        by_key = {}
+        for name in pending:
+            by_key.setdefault(self.specs[name].key, []).append(name)
+
+        for key, names in by_key.items():
+            grouping = self.grouping(key)
+            columns = {}
+            for name in names:
+                for aggregate in self.specs[name].aggregates:
+                    if aggregate not in columns:
+                        columns[aggregate] = self._reduce(grouping, aggregate)
+            self.scans.append((key, [(name, a.name) for name in names for a in self.specs[name].aggregates]))
+
+            for name in names:
+                spec = self.specs[name]
+                table = pd.DataFrame({a.name: columns[a] for a in spec.aggregates})
+                if key is None:
+                    # Object row, so counts stay ints and extremes of datetimes are Timestamps
+                    self.results[name] = table.astype(object).iloc[0]
+                    continue
+                table.index = pd.Index(grouping.uniques, name=key).infer_objects()
+                if spec.sort:
+                    table = table.sort_index(kind='stable')
+                self.results[name] = table
+
+    def encode(self, column):
+        """Integer codes (nulls as -1) and unique values in order of appearance, cached"""
+
+        if column not in self._encodings:
+            codes, uniques = pd.factorize(self.frame[column], sort=False)
+            self._encodings[column] = (codes, uniques)
+        return self._encodings[column]
+
+    def grouping(self, key):
+        """Codes, a stable sort order over non-null keys, and group boundaries, cached"""
+
+        if key not in self._groupings:
+            if key is None:
+                rows = len(self.frame)
+                codes = np.zeros(rows, dtype=np.intp)
+                self._groupings[key] = Grouping(codes, np.array([None]), None, np.zeros(1, dtype=np.intp),
+                                                np.array([rows], dtype=np.int64))
+                return self._groupings[key]
+
+            codes, uniques = self.encode(key)
+            # Events are already ordered by user and session, so those keys need no sort
+            if len(codes) and (codes[0] >= 0) and np.all(codes[1:] >= codes[:-1]):
+                order = np.arange(len(codes))
+            else:
+                order = np.argsort(codes, kind='stable')
+                order = order[codes[order] >= 0]
+            counts = np.bincount(codes[order], minlength=len(uniques)).astype(np.int64)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+            self._groupings[key] = Grouping(codes, uniques, order, starts, counts)
+        return self._groupings[key]
+
+    def _valid(self, aggregate, values=None):
+        """Rows an aggregate reads: non-null values, within its where= restriction"""
+
+        valid = np.ones(len(self.frame), dtype=bool)
+        if values is not None:
+            valid &= pd.notna(values)
+        if aggregate.where is not None:
+            if aggregate.where in self.masks:
+                valid &= self.masks[aggregate.where]
+            else:
+                condition = self.frame[aggregate.where]
+                valid &= condition.to_numpy(dtype=bool) if pd.api.types.is_bool_dtype(condition) \
+                    else condition.notna().to_numpy()
+        return valid
+
+    def _reduce(self, grouping, aggregate):
+        """One output column from the grouping's shared sort order"""
+
+        func = aggregate.func
+        if func == 'size':
+            valid = self._valid(aggregate)
+            return self._segment_sum(grouping, valid.astype(np.int64))
+
+        if func == 'nunique':
+            return self._nunique(grouping, aggregate)
+
+        column = self.frame[aggregate.column]
+        values = column.to_numpy()
+        valid = self._valid(aggregate, values)
+        if func == 'count':
+            return self._segment_sum(grouping, valid.astype(np.int64))
+
+        dtype = values.dtype
+        if dtype.kind in 'mM':
+            numbers = values.view(np.int64)
+        elif dtype.kind in 'iufb':
+            numbers = values
+        else:
+            raise ValueError(f"'{func}' needs a numeric or datetime column, not {aggregate.column} ({dtype})")
+        counts = self._segment_sum(grouping, valid.astype(np.int64))
+
+        if func in ('sum', 'mean'):
+            summed = self._segment_sum(grouping, np.where(valid, numbers, 0),
+                                       float if func == 'mean' or dtype.kind in 'fb' else None)
+            if func == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    return summed / counts
+            return summed.view(dtype) if dtype.kind == 'm' else summed
+
+        if func in QUANTILES:
+            result = self._quantile(grouping, aggregate, numbers, valid, counts, QUANTILES[func])
+        else:
+            if dtype.kind == 'f':
+                identity = np.inf if func == 'min' else -np.inf
+            else:
+                info = np.iinfo(np.int64) if dtype.kind in 'mM' else np.iinfo(numbers.dtype)
+                identity = info.max if func == 'min' else info.min
+            ufunc = np.minimum if func == 'min' else np.maximum
+            result = self._segment_reduce(grouping, ufunc, np.where(valid, numbers, identity))
+        result = np.asarray(result)
+        if dtype.kind in 'mM':
+            result = result.astype(np.int64)
+            result[counts == 0] = np.iinfo(np.int64).min  # NaT
+            return result.view(dtype)
+        if (counts == 0).any():
+            result = result.astype(float)
+            result[counts == 0] = np.nan
+        return result
+
+    def _segment_reduce(self, grouping, ufunc, values):
+        """ufunc over each group; pairwise over the whole frame when there is no key"""
+
+        if grouping.order is None:
+            return np.array([ufunc.reduce(values)])
+        if not len(grouping.order):
+            return values[:0]
+        return ufunc.reduceat(values[grouping.order], grouping.starts)
+
+    def _segment_sum(self, grouping, values, dtype=None):
+        """Sum per group (int64 stays exact, float matches pandas for key=None)"""
+
+        if dtype is float:
+            values = values.astype(np.float64)
+        elif values.dtype.kind in 'iub':
+            values = values.astype(np.int64)
+        return self._segment_reduce(grouping, np.add, values)
+
+    def _quantile(self, grouping, aggregate, numbers, valid, counts, q):
+        """Per-group quantile with linear interpolation, from a cached sort of (group, value)"""
+
+        cache_key = (id(grouping), aggregate.column, aggregate.where)
+        if cache_key not in self._sorted_values:
+            rows = valid & (grouping.codes >= 0)
+            values = numbers[rows].astype(np.float64)
+            self._sorted_values[cache_key] = values[np.lexsort((values, grouping.codes[rows]))]
+        values = self._sorted_values[cache_key]
+        if not len(values):
+            return np.full(len(counts), np.nan)
+
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.intp)
+        last = np.maximum(counts - 1, 0)
+        position = last * q
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, last)
+        low_values = values[np.minimum(starts + lower, len(values) - 1)]
+        high_values = values[np.minimum(starts + upper, len(values) - 1)]
+        if q == 0.5:
+            # pandas takes the mean of the two middle values for medians
+            result = np.where(counts % 2 == 1, low_values, (low_values + high_values) / 2)
+        else:
+            result = low_values + (high_values - low_values) * (position - lower)
+        return np.where(counts > 0, result, np.nan)
+
+    def _nunique(self, grouping, aggregate):
+        """Distinct non-null values per group from cached codes of both columns"""
+
+        value_codes, value_uniques = self.encode(aggregate.column)
+        valid = self._valid(aggregate) & (value_codes >= 0) & (grouping.codes >= 0)
+        n_groups = len(grouping.counts)
+        if grouping.order is None and aggregate.where is None and valid.all():
+            return np.array([len(value_uniques)], dtype=np.int64)
+        rows = grouping.order if grouping.order is not None else np.arange(len(valid))
+        rows = rows[valid[rows]]
+        pairs = grouping.codes[rows].astype(np.int64) * len(value_uniques) + value_codes[rows]
+        # In the group's sort order, values that are themselves ordered (sessions within a
+        # user) give sorted pairs, and distinct pairs are found without another sort
+        if len(pairs) and np.all(pairs[1:] >= pairs[:-1]):
+            pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        else:
+            pairs = np.unique(pairs)
+        return np.bincount(pairs // max(len(value_uniques), 1), minlength=n_groups).astype(np.int64)
+
+    def explain(self):
+        """One line per grouped scan run so far"""
+
+        return [f"scan {'(all rows)' if key is None else key}: {len(outputs)} aggregates for "
+                f"{', '.join(dict.fromkeys(name for name, _ in outputs))}" for key, outputs in self.scans]
+
+
+def _separate_scans(enriched):
+    """The report tables as the pipeline computed them before: one pass per statistic"""
+
+    users = enriched.groupby('UserId', sort=False).agg(
+        Total_Visits=('SessionId', 'nunique'),
+        Total_Pages_Viewed=('SessionId', 'size'),
+        Total_Time=('DwellTime', 'sum'),
+        First_Activity=('DateTime', 'min'),
+        Last_Activity=('DateTime', 'max'),
+        Sections_Visited=('Section', 'nunique')
+    )
+    sections = enriched.groupby('Section').agg(
+        Unique_Users=('UserId', 'nunique'), Total_Time=('DwellTime', 'sum'), Total_Views=('Page', 'count')
+    )
+    overview = {
+        'Users': enriched['UserId'].nunique(),
+        'Sessions': enriched['SessionId'].nunique(),
+        'First_Activity': enriched['DateTime'].min(),
+        'Last_Activity': enriched['DateTime'].max(),
+        'Views_With_Content': enriched['Title'].notna().sum(),
+        'Mean_Session_Seconds': enriched.groupby('SessionId')['DwellTimeSeconds'].sum().mean()
+    }
+    section_views = enriched.groupby('Section')['UserId'].nunique()
+    dwell = enriched[~(enriched['IsLastInSession'] & (enriched['DwellTimeSeconds'] == 0))].groupby('Page', sort=False)
+    pages = pd.DataFrame({
+        'Views': enriched.groupby('Page', sort=False).size(),
+        'Unique_Users': enriched.groupby('Page', sort=False)['UserId'].nunique(),
+        'Dwell_Views': dwell['DwellTimeSeconds'].count(),
+        'Mean_Dwell_Seconds': dwell['DwellTimeSeconds'].mean(),
+        'Median_Dwell_Seconds': dwell['DwellTimeSeconds'].median(),
+        'P90_Dwell_Seconds': dwell['DwellTimeSeconds'].quantile(0.9),
+        'P99_Dwell_Seconds': dwell['DwellTimeSeconds'].quantile(0.99)
+    })
+    return users, sections, overview, section_views, pages
+
+
+if __name__ == "__main__":
+    from datetime import timedelta
+    from benchmark_backends import replicate_page_views
+    from export_readers import read_page_views
+    from pipeline_backends import PandasBackend, report_planner
+
+    parser = argparse.ArgumentParser(description='Compare planned report aggregates with separate scans')
+    parser.add_argument('--page-views', default='Page_Views.xlsx')
+    parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    parser.add_argument('--scale', type=int, default=100, help='replicate the export N times with new user IDs')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("AGGREGATE PLANNER BENCHMARK")
+    print("=" * 80)
+
+    page_views = replicate_page_views(read_page_views(args.page_views), args.scale)
+    backend = PandasBackend()
+    events = backend.sessionize(backend.clean(page_views), timedelta(minutes=30))
+    enriched = backend.enrich(events, pd.read_csv(args.dictionary))
+    del page_views, events
+    print(f"Input: {len(enriched):,} enriched events (scale x{args.scale})\n")
+
+    start = time.perf_counter()
+    users, sections, overview, section_views, pages = _separate_scans(enriched)
+    separate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planner = report_planner(enriched)
+    planned = {name: planner.table(name) for name in planner.specs}
+    planned_seconds = time.perf_counter() - start
+
+    for line in planner.explain():
+        print(f"  {line}")
+    print(f"\n  Separate scans: {separate_seconds:8.3f}s")
+    print(f"  Planned:        {planned_seconds:8.3f}s ({separate_seconds / planned_seconds:.1f}x)")
+
+    ok = True
+    try:
+        pd.testing.assert_frame_equal(planned['users'].drop(columns='Total_Time_Seconds', errors='ignore'), users)
+        pd.testing.assert_frame_equal(planned['sections'], sections)
+        pd.testing.assert_series_equal(planned['sections']['Unique_Users'], section_views, check_names=False)
+        pd.testing.assert_frame_equal(planned['pages'], pages.reindex(planned['pages'].index), check_dtype=False,
+                                      check_index_type=False, check_exact=False)
+        for name in ('Users', 'Sessions', 'First_Activity', 'Last_Activity', 'Views_With_Content'):
+            assert planned['overview'][name] == overview[name], name
+        assert np.isclose(planned['sessions']['Duration_Seconds'].mean(), overview['Mean_Session_Seconds'])
+    except AssertionError as e:
+        print(f"  ✗ Planned tables differ: {e}")
+        ok = False
+    print(f"\n{'✓' if ok else '✗'} Planned tables {'match' if ok else 'DO NOT match'} the separate scans")
+    raise SystemExit(0 if ok else 1)
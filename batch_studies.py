@@ -0,0 +1,146 @@
+"""
+Batch analysis of several course deployments or sites
+Each study directory holds its own Page_Views.xlsx, Login_History.xlsx and config.js,
+and optionally Data_Dictionary_FINAL.csv (derived from config.js when absent). Studies
+run concurrently in a process pool, each writing to its own output directory, and are
+then compared side by side.
+"""
+
+import argparse
+import os
+import runpy
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+
+import pandas as pd
+
+from parse_config import CONFIG_FILE, COURSE_STRUCTURE_FILE, build_data_dictionary, parse_config_js
+
+PIPELINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_engagement_data_fixed.py')
+DICTIONARY_FILE = 'Data_Dictionary_FINAL.csv'
+METRICS_FILE = 'CRAFT_PTSD_Engagement_Metrics.xlsx'
+COMPARISON_FILE = 'study_comparison.csv'
+LOG_FILE = 'pipeline.log'
+
+StudyResult = namedtuple('StudyResult', ['name', 'output_dir', 'seconds', 'error'])
+
+
+def read_manifest(path):
+    """Read a CSV manifest with name and path columns; paths are relative to the manifest"""
+
+    manifest = pd.read_csv(path, dtype=str, skipinitialspace=True)
+    missing = {'name', 'path'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest {path} is missing columns: {', '.join(sorted(missing))}")
+    duplicated = manifest['name'][manifest['name'].duplicated()]
+    if len(duplicated):
+        raise ValueError(f"Duplicate study names in manifest: {', '.join(duplicated)}")
+
+    base = os.path.dirname(os.path.abspath(path))
+    manifest['path'] = [os.path.join(base, study_dir) for study_dir in manifest['path']]
+    return manifest[['name', 'path']]
+
+
+def run_study(name, study_dir, output_dir):
+    """Parse a study's config.js and run the pipeline on its exports, logging to its output directory"""
+
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        with open(os.path.join(output_dir, LOG_FILE), 'w') as log, redirect_stdout(log), redirect_stderr(log):
+            structure = parse_config_js(os.path.join(study_dir, CONFIG_FILE))
+            structure_path = os.path.join(output_dir, COURSE_STRUCTURE_FILE)
+            structure.to_csv(structure_path, index=False)
+
+            dictionary_path = os.path.join(study_dir, DICTIONARY_FILE)
+            if not os.path.exists(dictionary_path):
+                dictionary_path = os.path.join(output_dir, DICTIONARY_FILE)
+                build_data_dictionary(structure).to_csv(dictionary_path, index=False)
+                print(f"\nData dictionary derived from config.js: {dictionary_path}")
+
+            sys.argv = [
+                PIPELINE_SCRIPT, '--data-dir', study_dir, '--output-dir', output_dir,
+                '--dictionary', dictionary_path, '--course-structure', structure_path
+            ]
+            runpy.run_path(PIPELINE_SCRIPT, run_name='__main__')
+    except Exception as e:
+        return StudyResult(name, output_dir, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+    except SystemExit as e:
+        # parser.error() or an explicit exit inside the pipeline script ends this study, not the batch
+        if e.code:
+            return StudyResult(name, output_dir, time.perf_counter() - start,
+                               f"exited with status {e.code} (see {LOG_FILE})")
+    return StudyResult(name, output_dir, time.perf_counter() - start, None)
+
+
+def run_batch(manifest, output_root, workers=None):
+    """Run every study in the manifest in a process pool; returns results in manifest order"""
+
+    results = {}
+    # One fresh process per study: the pipeline script keeps its state at module level
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = {
+            pool.submit(run_study, study.name, study.path, os.path.join(output_root, study.name)): study.name
+            for study in manifest.itertuples()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.name] = result
+            status = 'ok' if result.error is None else f"FAILED ({result.error})"
+            print(f"  {result.name:<30} {result.seconds:>8.1f}s  {status}")
+    return [results[name] for name in manifest['name']]
+
+
+def compare_studies(results):
+    """Summary statistics of every completed study side by side, with run times"""
+
+    columns = {}
+    for result in results:
+        if result.error is None:
+            summary = pd.read_excel(os.path.join(result.output_dir, METRICS_FILE), sheet_name='Summary_Statistics')
+            columns[result.name] = summary.set_index('Metric')['Value']
+
+    comparison = pd.DataFrame(columns)
+    comparison.loc['Run Time (seconds)'] = [round(r.seconds, 1) for r in results if r.error is None]
+    comparison.index.name = 'Metric'
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the engagement analysis for several studies concurrently')
+    parser.add_argument('manifest', help='CSV with name,path columns (one study directory per row)')
+    parser.add_argument('--output-dir', default='batch_output')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("MULTI-STUDY BATCH ANALYSIS")
+    print("=" * 80)
+
+    manifest = read_manifest(args.manifest)
+    print(f"Studies: {len(manifest)}  workers: {args.workers or os.cpu_count()}\n")
+
+    start = time.perf_counter()
+    results = run_batch(manifest, args.output_dir, args.workers)
+    wall_time = time.perf_counter() - start
+
+    completed = [r for r in results if r.error is None]
+    print(f"\nWall time: {wall_time:.1f}s (sum of study run times: {sum(r.seconds for r in results):.1f}s, "
+          f"slowest study: {max(r.seconds for r in results):.1f}s)")
+
+    if completed:
+        comparison = compare_studies(results)
+        comparison_path = os.path.join(args.output_dir, COMPARISON_FILE)
+        comparison.to_csv(comparison_path)
+        print("\nCROSS-STUDY COMPARISON")
+        print("-" * 40)
+        print(comparison.to_string())
+        print(f"\n✓ Comparison saved to: {comparison_path}")
+
+    failed = [r for r in results if r.error is not None]
+    for result in failed:
+        print(f"✗ {result.name}: {result.error} (log: {os.path.join(result.output_dir, LOG_FILE)})")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,98 @@
+"""
+Benchmark the pandas and Polars pipeline backends on the same page-view input
+Checks that both produce identical per-user and per-section tables
+"""
+
+import argparse
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from export_readers import read_page_views
+from pipeline_backends import BACKENDS, get_backend
+
+SESSION_TIMEOUT = timedelta(minutes=30)
+
+
+def replicate_page_views(page_views, scale):
+    """Enlarge an export by repeating it with offset user IDs"""
+
+    if scale <= 1:
+        return page_views
+
+    real_rows = page_views[page_views['UserId'] != 'UserName']
+    user_numbers = pd.to_numeric(real_rows['UserId'])
+    offset = 10 ** len(str(int(user_numbers.max())))
+
+    copies = [page_views]
+    for i in range(1, scale):
+        copy = real_rows.copy()
+        copy['UserId'] = (user_numbers + i * offset).astype(object)
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def run_backend(name, page_views, data_dict):
+    """Run cleaning through aggregation on one backend, returning tables and wall time"""
+
+    start = time.perf_counter()
+    backend = get_backend(name)
+    events = backend.clean(page_views.copy())
+    events = backend.sessionize(events, SESSION_TIMEOUT)
+    events = backend.enrich(events, data_dict)
+    tables = backend.collect(events)
+    return tables, time.perf_counter() - start
+
+
+def tables_match(reference, other):
+    """True when user and section tables are identical"""
+
+    try:
+        pd.testing.assert_frame_equal(reference.users.reset_index(drop=True),
+                                      other.users.reset_index(drop=True), check_dtype=False)
+        pd.testing.assert_frame_equal(reference.sections.reset_index(drop=True),
+                                      other.sections.reset_index(drop=True), check_dtype=False)
+    except AssertionError as e:
+        print(f"  ✗ Tables differ: {e}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare pipeline backends on the same input')
+    parser.add_argument('--page-views', default='Page_Views.xlsx')
+    parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    parser.add_argument('--scale', type=int, default=1, help='replicate the export N times with new user IDs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("PIPELINE BACKEND BENCHMARK")
+    print("=" * 80)
+
+    page_views = replicate_page_views(read_page_views(args.page_views), args.scale)
+    data_dict = pd.read_csv(args.dictionary)
+    print(f"Input: {len(page_views):,} page views (scale x{args.scale})")
+
+    results = {}
+    for name in args.backends.split(','):
+        timings = []
+        for _ in range(args.repeat):
+            tables, elapsed = run_backend(name, page_views, data_dict)
+            timings.append(elapsed)
+        results[name] = (tables, min(timings))
+        print(f"  {name:<8} best of {args.repeat}: {min(timings):.3f}s")
+
+    names = list(results)
+    reference_tables, reference_time = results[names[0]]
+    all_match = True
+    for name in names[1:]:
+        tables, elapsed = results[name]
+        match = tables_match(reference_tables, tables)
+        all_match &= match
+        print(f"\n{name} vs {names[0]}: {reference_time / elapsed:.2f}x speedup, "
+              f"tables {'identical' if match else 'DIFFERENT'}")
+
+    raise SystemExit(0 if all_match else 1)
@@ -0,0 +1,209 @@
+"""
+Bootstrap confidence intervals for the engagement summary statistics
+Users are resampled with replacement as a (replicates, users) index matrix, and
+every statistic is computed for all replicates at once with NumPy reductions along
+the user axis, so 10,000 replicates take a fraction of a second. Intervals are
+percentile intervals of the replicate statistics.
+
+Replicates are generated in fixed-size chunks, each with its own seed spawned from
+the run seed, so the intervals are identical whether the chunks run in one process
+or are spread over several.
+"""
+
+import argparse
+import math
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from engagement_metrics import summary_value
+
+BOOTSTRAP_REPLICATES = 10000
+BOOTSTRAP_CHUNK = 2000  # replicates per index matrix (bounds memory at 2000 x users)
+CONFIDENCE = 0.95
+
+BootstrapIntervals = namedtuple('BootstrapIntervals', ['estimates', 'low', 'high', 'replicates'])
+
+# Per-user columns of metrics_df the statistics are computed from
+USER_COLUMNS = {
+    'hours': 'Total_Time_Hours',
+    'visits': 'Total_Visits',
+    'pages': 'Total_Pages_Viewed',
+    'pages_per_visit': 'Avg_Pages_Per_Visit',
+    'completion': 'Completion_Rate',
+    'lessons_completed': 'Lessons_Completed'
+}
+
+# Summary_Statistics metric -> (bootstrap statistic, decimals). Only the per-user
+# averages get intervals: totals and counts describe the whole, fixed user table
+SUMMARY_INTERVALS = {
+    'Average Time per User (hours)': ('Mean_Hours', 2),
+    'Average Visits per User': ('Mean_Visits', 1),
+    'Average Pages per User': ('Mean_Pages', 1),
+    'Average Completion Rate (%)': ('Mean_Completion', 1)
+}
+
+
+def user_columns(metrics_df):
+    """Per-user values and cohort indicators as float64 arrays"""
+
+    columns = {key: metrics_df[column].to_numpy(dtype=np.float64) for key, column in USER_COLUMNS.items()}
+    columns['completed_all'] = (metrics_df['Completion_Rate'] == 100).to_numpy(dtype=np.float64)
+    columns['started_not_completed'] = (
+        (metrics_df['Lessons_Started'] > 0) & (metrics_df['Completion_Rate'] < 100)
+    ).to_numpy(dtype=np.float64)
+    return columns
+
+
+def replicate_statistics(columns, idx):
+    """Every statistic for each row of a (replicates, users) resample index matrix"""
+
+    hours = columns['hours'][idx]
+    completion = columns['completion'][idx]
+    visits = columns['visits'][idx]
+    pages = columns['pages'][idx]
+
+    # Above-median cohort of each replicate, against that replicate's own median
+    median_hours = np.median(hours, axis=1)
+    high = hours > median_hours[:, None]
+    high_users = high.sum(axis=1)
+    low_users = idx.shape[1] - high_users
+    with np.errstate(invalid='ignore', divide='ignore'):
+        high_completion = np.where(high, completion, 0).sum(axis=1) / high_users
+        low_completion = np.where(high, 0, completion).sum(axis=1) / low_users
+        high_hours = np.where(high, hours, 0).sum(axis=1) / high_users
+        high_visits = np.where(high, visits, 0).sum(axis=1) / high_users
+
+    return {
+        'Total_Page_Views': pages.sum(axis=1),
+        'Total_Sessions': visits.sum(axis=1),
+        'Mean_Hours': hours.mean(axis=1),
+        'Median_Hours': median_hours,
+        'Mean_Visits': visits.mean(axis=1),
+        'Mean_Pages': pages.mean(axis=1),
+        'Mean_Pages_Per_Visit': columns['pages_per_visit'][idx].mean(axis=1),
+        'Mean_Completion': completion.mean(axis=1),
+        'Mean_Lessons_Completed': columns['lessons_completed'][idx].mean(axis=1),
+        'Completers': columns['completed_all'][idx].sum(axis=1),
+        'Started_Not_Completed': columns['started_not_completed'][idx].sum(axis=1),
+        'High_Users': high_users.astype(np.float64),
+        'High_Mean_Hours': high_hours,
+        'High_Mean_Completion': high_completion,
+        'High_Mean_Visits': high_visits,
+        'Low_Mean_Completion': low_completion,
+        'Completion_Gap': high_completion - low_completion
+    }
+
+
+def _bootstrap_chunk(columns, replicates, seed):
+    """Statistics of one chunk of resamples (worker)"""
+
+    users = len(columns['hours'])
+    idx = np.random.default_rng(seed).integers(0, users, size=(replicates, users), dtype=np.int32)
+    return pd.DataFrame(replicate_statistics(columns, idx))
+
+
+def bootstrap_intervals(metrics_df, replicates=BOOTSTRAP_REPLICATES, seed=0, workers=1,
+                        chunk_size=BOOTSTRAP_CHUNK, confidence=CONFIDENCE):
+    """Point estimates and percentile intervals of every statistic over user resamples"""
+
+    columns = user_columns(metrics_df)
+    sizes = [min(chunk_size, replicates - start) for start in range(0, replicates, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_bootstrap_chunk, [columns] * len(sizes), sizes, seeds))
+    else:
+        chunks = [_bootstrap_chunk(columns, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    table = pd.concat(chunks, ignore_index=True)
+
+    # The original sample is the identity resample
+    estimates = pd.DataFrame(replicate_statistics(columns, np.arange(len(metrics_df))[None, :])).iloc[0]
+    tail = (1 - confidence) / 2
+    low, high = table.quantile([tail, 1 - tail]).to_numpy()
+    return BootstrapIntervals(estimates, pd.Series(low, index=table.columns), pd.Series(high, index=table.columns),
+                              table)
+
+
+def add_summary_intervals(summary_stats, intervals):
+    """Summary_Statistics with CI_95_Low / CI_95_High columns from the bootstrap (blank for totals and counts)"""
+
+    low, high = [], []
+    for metric in summary_stats['Metric']:
+        statistic, decimals = SUMMARY_INTERVALS.get(metric, (None, 0))
+        low.append(np.nan if statistic is None else summary_value(intervals.low[statistic], decimals))
+        high.append(np.nan if statistic is None else summary_value(intervals.high[statistic], decimals))
+    return summary_stats.assign(CI_95_Low=low, CI_95_High=high)
+
+
+def interval_text(intervals, statistic, fmt='.1f'):
+    """Interval of a statistic for report text, e.g. '95% CI 1.9 to 3.1'"""
+
+    return f"95% CI {intervals.low[statistic]:{fmt}} to {intervals.high[statistic]:{fmt}}"
+
+
+def naive_bootstrap(metrics_df, idx):
+    """Reference implementation: one pandas resample per replicate"""
+
+    rows = []
+    for row in idx:
+        sample = metrics_df.iloc[row]
+        hours = sample['Total_Time_Hours']
+        high = hours > hours.median()
+        rows.append({
+            'Total_Page_Views': sample['Total_Pages_Viewed'].sum(),
+            'Mean_Hours': hours.mean(),
+            'Median_Hours': hours.median(),
+            'Mean_Completion': sample['Completion_Rate'].mean(),
+            'Completers': (sample['Completion_Rate'] == 100).sum(),
+            'High_Mean_Completion': sample.loc[high, 'Completion_Rate'].mean(),
+            'Completion_Gap': sample.loc[high, 'Completion_Rate'].mean() - sample.loc[~high, 'Completion_Rate'].mean()
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description='Bootstrap intervals for the summary statistics, with a benchmark')
+    parser.add_argument('--metrics', default='CRAFT_PTSD_Engagement_Metrics.xlsx')
+    parser.add_argument('--replicates', type=int, default=BOOTSTRAP_REPLICATES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--naive-replicates', type=int, default=200, help='replicates timed with the pandas loop')
+    args = parser.parse_args()
+
+    metrics_df = pd.read_excel(args.metrics, sheet_name='User_Metrics')
+
+    print("=" * 80)
+    print(f"BOOTSTRAP INTERVALS: {len(metrics_df)} users, {args.replicates:,} replicates")
+    print("=" * 80)
+
+    start = time.perf_counter()
+    intervals = bootstrap_intervals(metrics_df, args.replicates, args.seed)
+    vectorized_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel = bootstrap_intervals(metrics_df, args.replicates, args.seed, workers=args.workers)
+    parallel_seconds = time.perf_counter() - start
+
+    idx = np.random.default_rng(args.seed).integers(0, len(metrics_df), size=(args.naive_replicates, len(metrics_df)))
+    start = time.perf_counter()
+    naive = naive_bootstrap(metrics_df, idx)
+    naive_seconds = time.perf_counter() - start
+    vectorized = pd.DataFrame(replicate_statistics(user_columns(metrics_df), idx))[naive.columns]
+
+    print(f"\n{'Statistic':<26} {'Estimate':>10} {'CI low':>10} {'CI high':>10}")
+    for statistic in intervals.estimates.index:
+        print(f"{statistic:<26} {intervals.estimates[statistic]:>10.2f} {intervals.low[statistic]:>10.2f} "
+              f"{intervals.high[statistic]:>10.2f}")
+
+    naive_total = naive_seconds * args.replicates / args.naive_replicates
+    print(f"\nVectorized: {vectorized_seconds:.3f}s; {args.workers} workers: {parallel_seconds:.3f}s; "
+          f"pandas loop: {naive_seconds:.2f}s for {args.naive_replicates} "
+          f"(~{naive_total:.0f}s for {args.replicates:,}, {naive_total / vectorized_seconds:.0f}x slower)")
+    print(f"Matches pandas loop: {np.allclose(vectorized.to_numpy(), naive.to_numpy(dtype=np.float64), equal_nan=True)}")
+    print(f"Same intervals with {args.workers} workers: "
+          f"{intervals.low.equals(parallel.low) and intervals.high.equals(parallel.high)}")
+    assert math.isclose(intervals.estimates['Mean_Hours'], metrics_df['Total_Time_Hours'].mean())
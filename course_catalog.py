@@ -0,0 +1,344 @@
+"""
+Catalog of course structures from many config.js files in one SQLite database
+Config files are discovered under a directory tree and parsed in parallel with
+parse_config.parse_config_js. Each distinct config (by SHA-256 of its content) is
+stored once as a version of its course, keyed by course ID and config hash. Pages
+are indexed by page ID, so page lookups and cross-version diffs are SQL queries
+instead of reparsing.
+
+The course ID is the config's titleCourse, or the config's directory relative to
+the scanned root when it has none. Versions of a course are numbered in order of
+the config files' modification times. On rebuild, files whose size and
+modification time are unchanged are not read again, and changed files whose
+content hash is already cataloged are not parsed again.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from parse_config import CONFIG_FILE, parse_config_js
+
+CATALOG_FILE = 'course_catalog.sqlite'
+COURSE_TITLE_PATTERN = re.compile(r'''var\s+titleCourse\s*=\s*(['"])(.*?)\1''')
+PAGE_FIELDS = [
+    'Page_ID', 'Title', 'Section', 'Lesson', 'Lesson_Number', 'Page_in_Lesson',
+    'Total_Pages_in_Lesson', 'Is_First_Page', 'Is_Last_Page', 'Lesson_URL', 'Content_Type'
+]
+# Fields compared between versions of a page
+DIFF_FIELDS = ['Title', 'Section', 'Lesson', 'Content_Type']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    config_hash TEXT PRIMARY KEY,
+    course_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    first_path TEXT NOT NULL,
+    modified_at TEXT NOT NULL,
+    cataloged_at TEXT NOT NULL,
+    UNIQUE (course_id, version)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    config_hash TEXT NOT NULL REFERENCES configs (config_hash),
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    config_hash TEXT NOT NULL REFERENCES configs (config_hash),
+    position INTEGER NOT NULL,
+    Page_ID TEXT NOT NULL,
+    Title TEXT, Section TEXT, Lesson TEXT, Lesson_Number INTEGER, Page_in_Lesson INTEGER,
+    Total_Pages_in_Lesson INTEGER, Is_First_Page INTEGER, Is_Last_Page INTEGER,
+    Lesson_URL TEXT, Content_Type TEXT,
+    PRIMARY KEY (config_hash, position)
+);
+CREATE INDEX IF NOT EXISTS pages_by_id ON pages (Page_ID, config_hash);
+CREATE INDEX IF NOT EXISTS configs_by_course ON configs (course_id, version);
+"""
+
+
+def discover_configs(root, name=CONFIG_FILE):
+    """Paths of every config file with the given name under root, in sorted order"""
+
+    found = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        if name in files:
+            found.append(os.path.join(directory, name))
+    return found
+
+
+def course_id_for(content, path, root):
+    """The config's titleCourse, or its directory relative to the scanned root"""
+
+    match = COURSE_TITLE_PATTERN.search(content)
+    if match and match.group(2).strip():
+        return match.group(2).strip()
+    return os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(root))
+
+
+def parse_config_file(path, root):
+    """Hash and parse one config file (runs in a worker process)"""
+
+    with open(path, 'rb') as f:
+        raw = f.read()
+    config_hash = hashlib.sha256(raw).hexdigest()
+    content = raw.decode('utf-8', errors='replace')
+    structure = parse_config_js(path, verbose=False, content=content)
+    records = structure.reindex(columns=PAGE_FIELDS).astype(object)
+    records = records.where(records.notna(), None)
+    records['Page_ID'] = records['Page_ID'].astype(str)
+    for column in ['Lesson_Number', 'Page_in_Lesson', 'Total_Pages_in_Lesson']:
+        records[column] = [None if value is None else int(value) for value in records[column]]
+    return config_hash, course_id_for(content, path, root), list(records.itertuples(index=False, name=None))
+
+
+def _file_hash(path):
+    """SHA-256 of a file's content"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CourseCatalog:
+    """SQLite catalog of course structures keyed by course ID and config hash"""
+
+    def __init__(self, path=CATALOG_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database connection"""
+
+        self.connection.close()
+
+    def build(self, root, workers=None, name=CONFIG_FILE):
+        """Catalog every config under root; unchanged files are skipped. Returns counts"""
+
+        counts = {'found': 0, 'unchanged': 0, 'known_content': 0, 'parsed': 0, 'removed': 0}
+        paths = discover_configs(root, name)
+        counts['found'] = len(paths)
+        known_sources = {
+            path: (size, mtime_ns, config_hash) for path, size, mtime_ns, config_hash
+            in self.connection.execute('SELECT path, size, mtime_ns, config_hash FROM sources')
+        }
+        known_hashes = {row[0] for row in self.connection.execute('SELECT config_hash FROM configs')}
+
+        source_updates, to_parse = [], []
+        for path in paths:
+            key = os.path.abspath(path)
+            stat = os.stat(path)
+            known = known_sources.get(key)
+            if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+                counts['unchanged'] += 1
+                continue
+            config_hash = _file_hash(path)
+            if config_hash in known_hashes:
+                counts['known_content'] += 1
+                source_updates.append((key, config_hash, stat.st_size, stat.st_mtime_ns))
+            else:
+                to_parse.append((path, stat))
+
+        # Parse new content in parallel; files with identical content are stored once
+        parsed = {}
+        if to_parse:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(parse_config_file, [path for path, _ in to_parse],
+                                   [root] * len(to_parse), chunksize=max(len(to_parse) // 32, 1))
+                for (path, stat), (config_hash, course_id, records) in zip(to_parse, results):
+                    source_updates.append((os.path.abspath(path), config_hash, stat.st_size, stat.st_mtime_ns))
+                    first = parsed.get(config_hash)
+                    if first is None or stat.st_mtime_ns < first[1].st_mtime_ns:
+                        parsed[config_hash] = (path, stat, course_id, records)
+        counts['parsed'] = len(parsed)
+
+        with self.connection:
+            # New versions are numbered after the course's existing ones, oldest file first
+            for config_hash, (path, stat, course_id, records) in sorted(
+                    parsed.items(), key=lambda item: item[1][1].st_mtime_ns):
+                version = self.connection.execute(
+                    'SELECT COALESCE(MAX(version), 0) + 1 FROM configs WHERE course_id = ?', (course_id,)
+                ).fetchone()[0]
+                self.connection.execute(
+                    'INSERT INTO configs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (config_hash, course_id, version, len(records), os.path.abspath(path),
+                     datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+                     datetime.now().isoformat(timespec='seconds'))
+                )
+                self.connection.executemany(
+                    f'INSERT INTO pages VALUES (?, ?, {", ".join("?" * len(PAGE_FIELDS))})',
+                    [(config_hash, position, *record) for position, record in enumerate(records)]
+                )
+            self.connection.executemany('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)', source_updates)
+
+            # Files that disappeared from this tree; their versions stay in the history
+            root_prefix = os.path.join(os.path.abspath(root), '')
+            current = {os.path.abspath(path) for path in paths}
+            gone = [(path,) for path in known_sources if path.startswith(root_prefix) and path not in current]
+            self.connection.executemany('DELETE FROM sources WHERE path = ?', gone)
+            counts['removed'] = len(gone)
+        return counts
+
+    def courses(self):
+        """One row per course version"""
+
+        return pd.read_sql_query(
+            'SELECT course_id, version, config_hash, pages, modified_at, first_path '
+            'FROM configs ORDER BY course_id, version', self.connection
+        )
+
+    def lookup(self, page_id, course_id=None, version=None):
+        """Courses, lessons and titles for a page ID (optionally one course or version)"""
+
+        query = ('SELECT c.course_id, c.version, c.config_hash, p.Page_ID, p.Lesson, p.Section, p.Title, '
+                 'p.Content_Type FROM pages p JOIN configs c USING (config_hash) WHERE p.Page_ID = ?')
+        parameters = [str(page_id)]
+        if course_id is not None:
+            query += ' AND c.course_id = ?'
+            parameters.append(course_id)
+        if version is not None:
+            query += ' AND c.version = ?'
+            parameters.append(int(version))
+        return pd.read_sql_query(query + ' ORDER BY c.course_id, c.version, p.position', self.connection,
+                                 params=parameters)
+
+    def structure(self, course_id, version=None):
+        """Pages of one course version (latest by default) in course order"""
+
+        config_hash = self.version_hash(course_id, version)
+        structure = pd.read_sql_query(
+            f'SELECT {", ".join(PAGE_FIELDS)} FROM pages WHERE config_hash = ? ORDER BY position',
+            self.connection, params=[config_hash]
+        )
+        return structure.astype({'Is_First_Page': bool, 'Is_Last_Page': bool})
+
+    def version_hash(self, course_id, version=None):
+        """Config hash of a course version (latest by default)"""
+
+        if version is None:
+            row = self.connection.execute(
+                'SELECT config_hash FROM configs WHERE course_id = ? ORDER BY version DESC LIMIT 1', (course_id,)
+            ).fetchone()
+        else:
+            row = self.connection.execute(
+                'SELECT config_hash FROM configs WHERE course_id = ? AND version = ?', (course_id, int(version))
+            ).fetchone()
+        if row is None:
+            which = 'versions' if version is None else f'version {version}'
+            raise KeyError(f"No {which} of course '{course_id}' in {self.path}")
+        return row[0]
+
+    def diff(self, course_id, old_version=None, new_version=None):
+        """Pages added, removed or changed between two versions (default: the last two)"""
+
+        if old_version is None and new_version is None:
+            versions = [row[0] for row in self.connection.execute(
+                'SELECT version FROM configs WHERE course_id = ? ORDER BY version DESC LIMIT 2', (course_id,))]
+            if len(versions) < 2:
+                raise KeyError(f"Course '{course_id}' has fewer than two versions")
+            new_version, old_version = versions
+        old_hash = self.version_hash(course_id, old_version)
+        new_hash = self.version_hash(course_id, new_version)
+
+        # First occurrence of each page ID per version, matched on page ID
+        first_pages = ('SELECT * FROM pages WHERE config_hash = ? AND position IN '
+                       '(SELECT MIN(position) FROM pages WHERE config_hash = ? GROUP BY Page_ID)')
+        old_fields = ', '.join(f'o.{field} AS Old_{field}' for field in DIFF_FIELDS)
+        new_fields = ', '.join(f'n.{field} AS New_{field}' for field in DIFF_FIELDS)
+        changed = ' OR '.join(f'o.{field} IS NOT n.{field}' for field in DIFF_FIELDS)
+        # Removed and changed pages, then added ones (a LEFT JOIN each way rather than
+        # FULL OUTER JOIN, which needs SQLite 3.39)
+        query = f"""
+            WITH o AS ({first_pages}), n AS ({first_pages})
+            SELECT Page_ID, Change, {', '.join(f'Old_{field}' for field in DIFF_FIELDS)},
+                   {', '.join(f'New_{field}' for field in DIFF_FIELDS)}
+            FROM (
+                SELECT o.Page_ID AS Page_ID,
+                       CASE WHEN n.Page_ID IS NULL THEN 'removed' ELSE 'changed' END AS Change,
+                       {old_fields}, {new_fields}, COALESCE(n.position, o.position) AS position
+                FROM o LEFT JOIN n ON o.Page_ID = n.Page_ID
+                WHERE n.Page_ID IS NULL OR {changed}
+                UNION ALL
+                SELECT n.Page_ID, 'added', {old_fields}, {new_fields}, n.position
+                FROM n LEFT JOIN o ON o.Page_ID = n.Page_ID
+                WHERE o.Page_ID IS NULL
+            )
+            ORDER BY position, Page_ID
+        """
+        return pd.read_sql_query(query, self.connection, params=[old_hash, old_hash, new_hash, new_hash])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Catalog course structures from many config.js files')
+    parser.add_argument('--catalog', default=CATALOG_FILE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='discover and catalog config files under a directory')
+    build_parser.add_argument('root')
+    build_parser.add_argument('--name', default=CONFIG_FILE, help='config file name to look for')
+    build_parser.add_argument('--workers', type=int, default=None)
+
+    commands.add_parser('courses', help='list cataloged course versions')
+
+    lookup_parser = commands.add_parser('lookup', help='courses, lessons and titles for a page ID')
+    lookup_parser.add_argument('page_id')
+    lookup_parser.add_argument('--course')
+    lookup_parser.add_argument('--version', type=int)
+
+    diff_parser = commands.add_parser('diff', help='pages changed between two versions of a course')
+    diff_parser.add_argument('course')
+    diff_parser.add_argument('--old', type=int, help='old version (default: second latest)')
+    diff_parser.add_argument('--new', type=int, help='new version (default: latest)')
+
+    export_parser = commands.add_parser('export', help='write one course version as a course structure CSV')
+    export_parser.add_argument('course')
+    export_parser.add_argument('--version', type=int)
+    export_parser.add_argument('--output', default='course_structure_complete.csv')
+    args = parser.parse_args()
+
+    catalog = CourseCatalog(args.catalog)
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_colwidth', 60)
+    try:
+        if args.command == 'build':
+            print("=" * 80)
+            print("COURSE CATALOG BUILD")
+            print("=" * 80)
+            start = time.perf_counter()
+            counts = catalog.build(args.root, workers=args.workers, name=args.name)
+            print(f"Config files found: {counts['found']:,} under {args.root}")
+            print(f"  Unchanged (skipped):            {counts['unchanged']:,}")
+            print(f"  Changed, content already known: {counts['known_content']:,}")
+            print(f"  New configs parsed:             {counts['parsed']:,}")
+            print(f"  Sources no longer present:      {counts['removed']:,}")
+            print(f"✓ Catalog {args.catalog} updated in {time.perf_counter() - start:.2f}s")
+        elif args.command == 'courses':
+            print(catalog.courses().to_string(index=False))
+        elif args.command == 'lookup':
+            matches = catalog.lookup(args.page_id, args.course, args.version)
+            print(matches.to_string(index=False) if len(matches) else f"Page '{args.page_id}' is not cataloged")
+        elif args.command == 'diff':
+            changes = catalog.diff(args.course, args.old, args.new)
+            print(changes.to_string(index=False) if len(changes) else 'No page changes')
+        else:
+            structure = catalog.structure(args.course, args.version)
+            structure.to_csv(args.output, index=False)
+            print(f"✓ {len(structure)} pages written to {args.output}")
+    except KeyError as e:
+        print(f"✗ {e.args[0]}")
+        raise SystemExit(1)
+    finally:
+        catalog.close()
@@ -0,0 +1,83 @@
+"""
+Course-order-aware progression metrics for VA CRAFT PTSD engagement data
+Furthest page, furthest lesson and percent of course reached, computed for all users at once
+"""
+
+import numpy as np
+import pandas as pd
+
+COURSE_STRUCTURE_FILE = 'course_structure_complete.csv'
+
+
+def load_course_order(path=COURSE_STRUCTURE_FILE):
+    """Load the course structure as a page-keyed table in course order"""
+
+    structure = pd.read_csv(path, dtype={'Page_ID': str})
+    structure = structure[structure['Page_ID'] != 'menu'].reset_index(drop=True)
+
+    # Section introductions and the welcome page are not part of a lesson and
+    # carry the folder number of their URL (lesson06/, lesson10/, ...), which runs
+    # ahead of the lesson numbering. Place them at the start of the next lesson.
+    in_lesson = structure['Lesson'].notna()
+    next_lesson = structure['Lesson_Number'].where(in_lesson).bfill()
+    lesson_key = structure['Lesson_Number'].where(
+        in_lesson,
+        np.fmin(structure['Lesson_Number'], next_lesson)
+    ).astype(int)
+    page_key = structure['Page_in_Lesson'].where(in_lesson, 0).astype(int)
+
+    order = pd.DataFrame({
+        'Page_ID': structure['Page_ID'],
+        'Lesson_Key': lesson_key,
+        'Page_Key': page_key,
+        'Page_Number': structure['Page_ID'].astype(int)
+    })
+    order = order.sort_values(['Lesson_Key', 'Page_Key', 'Page_Number']).reset_index(drop=True)
+
+    # Pages at the same (lesson, page-in-lesson) position share a course position
+    position = order[['Lesson_Key', 'Page_Key']].drop_duplicates()
+    position_ids = pd.Series(np.arange(len(position)), index=pd.MultiIndex.from_frame(position))
+    order['Course_Position'] = position_ids.reindex(
+        pd.MultiIndex.from_frame(order[['Lesson_Key', 'Page_Key']])
+    ).to_numpy()
+    order.attrs['total_positions'] = len(position)
+
+    return order.set_index('Page_ID')
+
+
+def furthest_progression(user_ids, pages, course_order, titles):
+    """Compute furthest page, lesson, content and percent of course reached per user"""
+
+    user_codes, users = pd.factorize(pd.Series(user_ids).to_numpy())
+
+    # Resolve each distinct page once; works for object and categorical page columns
+    page_codes, page_labels = pd.factorize(pd.Series(pages), use_na_sentinel=False)
+    page_labels = pd.Index(page_labels).astype(str)
+
+    # Row rank in course order for every event; -1 for menu and unmapped pages
+    order_rank = course_order.index.get_indexer(page_labels)[page_codes]
+    furthest_rank = np.full(len(users), -1, dtype=np.int64)
+    np.maximum.at(furthest_rank, user_codes, order_rank)
+
+    has_content_page = np.zeros(len(users), dtype=bool)
+    has_content_page[user_codes[(page_labels != 'menu')[page_codes]]] = True
+
+    reached = furthest_rank >= 0
+    reached_rows = course_order.iloc[furthest_rank[reached]]
+    total_positions = course_order.attrs['total_positions']
+
+    progression = pd.DataFrame({
+        'Furthest_Page': 0,
+        'Furthest_Lesson': 0,
+        'Course_Percent_Reached': 0.0,
+        'Furthest_Content': np.where(has_content_page, 'Unknown', 'Menu only').astype(object)
+    }, index=users)
+    progression.loc[reached, 'Furthest_Page'] = reached_rows['Page_Number'].to_numpy()
+    progression.loc[reached, 'Furthest_Lesson'] = reached_rows['Lesson_Key'].to_numpy()
+    progression.loc[reached, 'Course_Percent_Reached'] = np.round(
+        (reached_rows['Course_Position'].to_numpy() + 1) / total_positions * 100, 1
+    )
+    content = titles.reindex(reached_rows.index).fillna('Unknown').astype(str).str[:50]
+    progression.loc[reached, 'Furthest_Content'] = content.to_numpy()
+
+    return progression
@@ -0,0 +1,130 @@
+"""
+Per-user engagement metrics and cohort statistics for VA CRAFT PTSD engagement data
+Builds the User_Metrics and Summary_Statistics tables from the backend's user table
+and enriched events. Shared by process_engagement_data_fixed.py and the staged
+runner in pipeline_dag.py.
+"""
+
+import pandas as pd
+
+from aggregate_planner import Aggregate, AggregatePlanner
+from course_progress import furthest_progression
+from lesson_bitsets import LessonBitsets
+
+TOTAL_LESSONS = 12
+
+
+def user_metrics_table(users, df_enriched, course_order, data_dict):
+    """User_Metrics rows ranked by time spent, and the furthest progression per user
+
+    users: the backend's per-user table indexed by UserId
+    """
+
+    # Furthest progression for all users in course order (handles 'menu' pages)
+    page_titles = data_dict.set_index('Page_ID')['Title']
+    progression = furthest_progression(df_enriched['UserId'], df_enriched['Page'], course_order, page_titles)
+    progression = progression.reindex(users.index)
+
+    # Started and completed lessons as bitmasks (completion = seeing lesson summary pages)
+    lesson_sets = LessonBitsets.from_events(df_enriched['UserId'], df_enriched['Lesson'], df_enriched['Is_Last_Page'])
+    lesson_masks = lesson_sets.to_frame().reindex(users.index)
+
+    total_time_minutes = users['Total_Time_Seconds'] / 60
+    metrics_df = pd.DataFrame({
+        'Invite_Code': users.index,  # Using UserId as Invite_Code
+        'Total_Visits': users['Total_Visits'].to_numpy(),
+        'Total_Pages_Viewed': users['Total_Pages_Viewed'].to_numpy(),
+        'Total_Time_Minutes': total_time_minutes.round(1).to_numpy(),
+        'Total_Time_Hours': (total_time_minutes / 60).round(2).to_numpy(),
+        'First_Activity': users['First_Activity'].dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+        'Last_Activity': users['Last_Activity'].dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+        'Days_Active': ((users['Last_Activity'] - users['First_Activity']).dt.days + 1).to_numpy(),
+        'Sections_Visited': users['Sections_Visited'].to_numpy(),
+        'Lessons_Started': lesson_masks['Lessons_Started'].to_numpy(),
+        'Lessons_Completed': lesson_masks['Lessons_Completed'].to_numpy(),
+        'Completion_Rate': (lesson_masks['Lessons_Completed'] / TOTAL_LESSONS * 100).round(1).to_numpy(),
+        'Furthest_Page': progression['Furthest_Page'].to_numpy(),
+        'Furthest_Lesson': progression['Furthest_Lesson'].to_numpy(),
+        'Course_Percent_Reached': progression['Course_Percent_Reached'].to_numpy(),
+        'Furthest_Content': progression['Furthest_Content'].to_numpy(),
+        'Avg_Pages_Per_Visit': (users['Total_Pages_Viewed'] / users['Total_Visits']).round(1).to_numpy(),
+        'Avg_Minutes_Per_Visit': (total_time_minutes / users['Total_Visits']).round(1).to_numpy(),
+        'Lessons_Started_Mask': lesson_masks['Lessons_Started_Mask'].to_numpy(),
+        'Lessons_Completed_Mask': lesson_masks['Lessons_Completed_Mask'].to_numpy()
+    })
+    return metrics_df.sort_values('Total_Time_Minutes', ascending=False), progression
+
+
+def cohort_statistics(metrics_df):
+    """All-user and above-median cohort statistics, and the median hours per user
+
+    Planned as one pass over the user table (cohorts are masks rather than filtered
+    copies of metrics_df)
+    """
+
+    median_hours = metrics_df['Total_Time_Hours'].median()
+    cohorts = AggregatePlanner(metrics_df, masks={
+        'completed_all': metrics_df['Completion_Rate'] == 100,
+        'started': metrics_df['Lessons_Started'] > 0,
+        'started_not_completed': (metrics_df['Lessons_Started'] > 0) & (metrics_df['Completion_Rate'] < 100),
+        'intro_only': metrics_df['Furthest_Page'] <= 10,
+        'high_engagement': metrics_df['Total_Time_Hours'] > median_hours
+    })
+    cohorts.declare('all', None, [
+        Aggregate('Users', None, 'size'),
+        Aggregate('Mean_Hours', 'Total_Time_Hours', 'mean'),
+        Aggregate('Min_Hours', 'Total_Time_Hours', 'min'),
+        Aggregate('Max_Hours', 'Total_Time_Hours', 'max'),
+        Aggregate('Total_Hours', 'Total_Time_Hours', 'sum'),
+        Aggregate('Mean_Visits', 'Total_Visits', 'mean'),
+        Aggregate('Mean_Pages', 'Total_Pages_Viewed', 'mean'),
+        Aggregate('Mean_Pages_Per_Visit', 'Avg_Pages_Per_Visit', 'mean'),
+        Aggregate('Mean_Completion', 'Completion_Rate', 'mean'),
+        Aggregate('Mean_Lessons_Completed', 'Lessons_Completed', 'mean'),
+        Aggregate('Completers', None, 'size', where='completed_all'),
+        Aggregate('Started', None, 'size', where='started'),
+        Aggregate('Started_Not_Completed', None, 'size', where='started_not_completed'),
+        Aggregate('Intro_Only', None, 'size', where='intro_only')
+    ])
+    cohorts.declare('high_engagement', None, [
+        Aggregate('Users', None, 'size', where='high_engagement'),
+        Aggregate('Mean_Hours', 'Total_Time_Hours', 'mean', where='high_engagement'),
+        Aggregate('Mean_Completion', 'Completion_Rate', 'mean', where='high_engagement'),
+        Aggregate('Mean_Visits', 'Total_Visits', 'mean', where='high_engagement')
+    ])
+    return cohorts.table('all'), cohorts.table('high_engagement'), median_hours
+
+
+def summary_value(value, decimals):
+    """Round like the Summary_Statistics values (whole numbers as ints)"""
+
+    return int(round(value)) if decimals == 0 else round(value, decimals)
+
+
+def summary_statistics(metrics_df, user_stats, total_page_views, total_sessions):
+    """The Summary_Statistics sheet (Metric, Value)"""
+
+    return pd.DataFrame({
+        'Metric': [
+            'Total Users',
+            'Total Page Views',
+            'Total Sessions',
+            'Average Time per User (hours)',
+            'Average Visits per User',
+            'Average Pages per User',
+            'Average Completion Rate (%)',
+            'Users Who Completed All Lessons',
+            'Users Who Started But Didn\'t Complete'
+        ],
+        'Value': [
+            len(metrics_df),
+            total_page_views,
+            total_sessions,
+            round(user_stats['Mean_Hours'], 2),
+            round(user_stats['Mean_Visits'], 1),
+            round(user_stats['Mean_Pages'], 1),
+            round(user_stats['Mean_Completion'], 1),
+            int(user_stats['Completers']),
+            int(user_stats['Started_Not_Completed'])
+        ]
+    })
@@ -0,0 +1,302 @@
+"""
+Partitioned Parquet archive of cleaned, sessionized page-view events
+Events are written once, after cleaning and sessionization, as Hive-style
+partitions year=YYYY/month=MM/part-0.parquet. Rows in each file are sorted by
+UserId (then time) and split into row groups, so the Parquet statistics of UserId
+and Session_Start let the reader skip row groups as well as whole files.
+
+A session is stored in the month it started in, with every event of the session,
+even when it runs past midnight at the end of the month. Windows select sessions by
+their start time: --since/--until read only the partitions whose months overlap the
+window, and no session is cut at a partition boundary, so dwell times and session
+counts for the selected sessions are exactly those of a full run. Each event keeps
+its position in the full sorted table (Event_Index), which restores the original
+order of events with equal timestamps.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ARCHIVE_META = '_archive.json'
+ARCHIVE_ROW_GROUP_ROWS = 65536
+ARCHIVE_VERSION = 1
+
+# Columns kept from sessionization (Hits/LastDateTime are kept when events are compacted)
+EVENT_COLUMNS = ['UserId', 'Page', 'DateTime', 'SessionId', 'DwellTime', 'DwellTimeSeconds']
+COMPACTED_COLUMNS = ['Hits', 'LastDateTime']
+
+ArchiveScan = namedtuple('ArchiveScan', ['files', 'files_read', 'row_groups', 'row_groups_read', 'rows'])
+
+
+def session_starts(events):
+    """Start time of each event's session, for events sorted by user and time"""
+
+    session_ids = events['SessionId'].to_numpy()
+    first = np.r_[True, session_ids[1:] != session_ids[:-1]] if len(session_ids) else np.zeros(0, dtype=bool)
+    first_row = np.maximum.accumulate(np.where(first, np.arange(len(session_ids)), 0))
+    return events['DateTime'].to_numpy()[first_row]
+
+
+def _user_array(user_ids):
+    """UserId as int64 when every ID is an integer, otherwise as strings"""
+
+    try:
+        return pa.array(user_ids, type=pa.int64())
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        return pa.array(pd.Series(user_ids).astype(str).to_numpy(dtype=object), type=pa.string())
+
+
+def write_archive(events, root, session_timeout, row_group_rows=ARCHIVE_ROW_GROUP_ROWS):
+    """Write sessionized events (sorted by user and time) as a year/month partitioned archive
+
+    Replaces any archive already in root. Returns the archive metadata.
+    """
+
+    columns = EVENT_COLUMNS + [column for column in COMPACTED_COLUMNS if column in events]
+    starts = session_starts(events)
+    table = pa.table({
+        'Event_Index': np.arange(len(events), dtype=np.int64),
+        'UserId': _user_array(events['UserId'].to_numpy()),
+        'Page': pa.array(events['Page'].astype(str).to_numpy(dtype=object), type=pa.string()),
+        **{column: events[column].to_numpy() for column in columns if column not in ('UserId', 'Page')},
+        'Session_Start': starts
+    })
+
+    if os.path.isdir(root):
+        for entry in os.listdir(root):
+            if entry.startswith('year=') or entry == ARCHIVE_META:
+                path = os.path.join(root, entry)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    os.makedirs(root, exist_ok=True)
+
+    # Partition by session start month; rows keep the user-sorted order within each month
+    months = starts.astype('datetime64[M]')
+    order = np.argsort(months, kind='stable')
+    bounds = np.flatnonzero(np.r_[True, months[order][1:] != months[order][:-1]]) if len(order) else []
+    partitions = []
+    for start, end in zip(bounds, np.r_[bounds[1:], len(order)].astype(np.int64)):
+        month = pd.Timestamp(months[order[start]])
+        directory = os.path.join(root, f'year={month.year}', f'month={month.month:02d}')
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(table.take(order[start:end]), os.path.join(directory, 'part-0.parquet'),
+                       row_group_size=row_group_rows)
+        partitions.append({'month': month.strftime('%Y-%m'), 'rows': int(end - start)})
+
+    meta = {
+        'version': ARCHIVE_VERSION,
+        'session_timeout_seconds': session_timeout.total_seconds(),
+        'rows': len(events),
+        'sessions': int(events['SessionId'].nunique()),
+        'user_type': str(table.schema.field('UserId').type),
+        'compacted': 'Hits' in events,
+        'partitions': partitions
+    }
+    with open(os.path.join(root, ARCHIVE_META), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+def read_meta(root):
+    """Archive metadata (session timeout, rows, partitions)"""
+
+    with open(os.path.join(root, ARCHIVE_META)) as f:
+        meta = json.load(f)
+    if meta.get('version') != ARCHIVE_VERSION:
+        raise ValueError(f"{root} holds event archive version {meta.get('version')}, expected {ARCHIVE_VERSION}")
+    return meta
+
+
+def _month_key(timestamp):
+    """(year, month) of a timestamp"""
+
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.year, timestamp.month
+
+
+def archive_user_ids(users, user_type='int64'):
+    """User IDs converted to the archive's UserId type (ValueError for IDs it cannot hold)"""
+
+    if user_type != 'int64':
+        return [str(user) for user in users]
+    invalid = [str(user) for user in users if not str(user).strip().lstrip('-').isdigit()]
+    if invalid:
+        raise ValueError(f"User IDs in this archive are integers, not {', '.join(repr(user) for user in invalid)}")
+    return [int(user) for user in users]
+
+
+def archive_filter(since=None, until=None, users=None, user_type='int64'):
+    """Filter expression for sessions starting in [since, until) of the given users
+
+    The year/month conditions prune partitions without opening their files; the
+    Session_Start and UserId conditions prune row groups by their statistics.
+    """
+
+    year, month = ds.field('year'), ds.field('month')
+    conditions = []
+    if since is not None:
+        since_year, since_month = _month_key(since)
+        conditions.append((year > since_year) | ((year == since_year) & (month >= since_month)))
+        conditions.append(ds.field('Session_Start') >= pa.scalar(pd.Timestamp(since).to_datetime64(),
+                                                                 pa.timestamp('us')))
+    if until is not None:
+        # until is exclusive: a window ending at the first of a month does not read that month
+        last = pd.Timestamp(until) - pd.Timedelta(microseconds=1)
+        until_year, until_month = _month_key(last)
+        conditions.append((year < until_year) | ((year == until_year) & (month <= until_month)))
+        conditions.append(ds.field('Session_Start') < pa.scalar(pd.Timestamp(until).to_datetime64(),
+                                                                pa.timestamp('us')))
+    if users is not None:
+        conditions.append(ds.field('UserId').isin(pa.array(archive_user_ids(users, user_type), type=user_type)))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def open_archive(root):
+    """The archive as a pyarrow dataset with year/month partition fields"""
+
+    partitioning = ds.partitioning(pa.schema([('year', pa.int32()), ('month', pa.int32())]), flavor='hive')
+    return ds.dataset(root, format='parquet', partitioning=partitioning)
+
+
+def scan_plan(root, expression=None):
+    """Files and row groups the reader would touch for a filter"""
+
+    dataset = open_archive(root)
+    files = dataset.files
+    fragments = list(dataset.get_fragments(filter=expression))
+    row_groups = sum(fragment.num_row_groups for fragment in dataset.get_fragments())
+    kept = [group for fragment in fragments
+            for group in fragment.split_by_row_group(expression, schema=dataset.schema)]
+    return ArchiveScan(len(files), len(fragments), row_groups, len(kept), None)
+
+
+def read_archive(root, since=None, until=None, users=None, session_timeout=None):
+    """Sessionized events of the sessions starting in [since, until) for the given users
+
+    Returns (events, scan). Events come back in the order of a full run; pass the
+    pipeline's session_timeout to check it matches the one the archive was built with.
+    """
+
+    meta = read_meta(root)
+    if session_timeout is not None and session_timeout.total_seconds() != meta['session_timeout_seconds']:
+        raise ValueError(f"{root} was sessionized with a {meta['session_timeout_seconds'] / 60:g}-minute timeout, "
+                         f"not {session_timeout.total_seconds() / 60:g}; rebuild it")
+
+    expression = archive_filter(since, until, users, meta['user_type'])
+    plan = scan_plan(root, expression)
+    columns = ['Event_Index'] + EVENT_COLUMNS + (COMPACTED_COLUMNS if meta['compacted'] else [])
+    table = open_archive(root).to_table(columns=columns, filter=expression)
+    table = table.sort_by('Event_Index')
+
+    # Object columns, as the export readers produce them
+    events = table.drop_columns(['Event_Index']).to_pandas()
+    events['UserId'] = events['UserId'].astype(object)
+    events['Page'] = events['Page'].astype(object)
+    return events, plan._replace(rows=len(events))
+
+
+def select_sessions(events, since=None, until=None, users=None):
+    """Reference selection on a full sessionized table: sessions starting in [since, until) of the given users"""
+
+    starts = pd.Series(session_starts(events), index=events.index)
+    keep = pd.Series(True, index=events.index)
+    if since is not None:
+        keep &= starts >= pd.Timestamp(since)
+    if until is not None:
+        keep &= starts < pd.Timestamp(until)
+    if users is not None:
+        keep &= events['UserId'].astype(str).isin([str(user) for user in users])
+    return events[keep]
+
+
+def print_scan(scan, since=None, until=None, users=None):
+    """Which part of the archive a filtered read touched"""
+
+    window = f"{since or 'start'} to {until or 'end'}"
+    subset = f", {len(users)} users" if users is not None else ''
+    print(f"  Archive read: sessions from {window}{subset}")
+    print(f"  Files read: {scan.files_read} of {scan.files}; row groups: {scan.row_groups_read} of {scan.row_groups}; "
+          f"events: {scan.rows:,}")
+
+
+if __name__ == "__main__":
+    from export_readers import find_export, read_page_views
+    from perf_regression import synthetic_page_views
+    from pipeline_backends import get_backend
+
+    parser = argparse.ArgumentParser(description='Build a partitioned event archive, or check and benchmark reads')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='clean and sessionize an export into an archive')
+    build.add_argument('--data-dir', default='.')
+    build.add_argument('--page-views', default=None)
+    build.add_argument('--archive', default='event_archive')
+    build.add_argument('--session-timeout', type=float, default=30, help='minutes')
+    build.add_argument('--row-group-rows', type=int, default=ARCHIVE_ROW_GROUP_ROWS)
+    check = subparsers.add_parser('check', help='compare filtered reads with the full table on a synthetic export')
+    check.add_argument('--rows', type=int, default=1000000)
+    check.add_argument('--archive', default='event_archive_check')
+    check.add_argument('--row-group-rows', type=int, default=8192, help='small groups make UserId pruning visible')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("EVENT ARCHIVE")
+    print("=" * 80)
+
+    backend = get_backend('pandas')
+    if args.command == 'build':
+        timeout = timedelta(minutes=args.session_timeout)
+        start = time.perf_counter()
+        events = backend.sessionize(backend.clean(read_page_views(args.page_views or
+                                                                  find_export(args.data_dir, 'Page_Views'))), timeout)
+        meta = write_archive(events, args.archive, timeout, args.row_group_rows)
+        print(f"✓ {meta['rows']:,} events in {meta['sessions']:,} sessions archived to {args.archive}/ "
+              f"({len(meta['partitions'])} monthly partitions, {time.perf_counter() - start:.2f}s)")
+    else:
+        timeout = timedelta(minutes=30)
+        page_views = synthetic_page_views(args.rows)
+        start = time.perf_counter()
+        events = backend.sessionize(backend.clean(page_views), timeout)
+        full_seconds = time.perf_counter() - start
+        meta = write_archive(events, args.archive, timeout, args.row_group_rows)
+        print(f"{meta['rows']:,} synthetic events, {meta['sessions']:,} sessions, "
+              f"{len(meta['partitions'])} partitions; clean + sessionize: {full_seconds:.2f}s")
+
+        # Sessions that run past a month boundary stay whole in their start month
+        crossing = events.groupby('SessionId')['DateTime'].max().dt.to_period('M') != \
+            events.groupby('SessionId')['DateTime'].min().dt.to_period('M')
+        print(f"Sessions crossing a month boundary: {int(crossing.sum())}")
+
+        user_ids = events['UserId'].drop_duplicates()
+        cases = [
+            ('full archive', None, None, None),
+            ('one quarter', '2022-01-01', '2022-04-01', None),
+            ('one month', '2023-06-01', '2023-07-01', None),
+            ('since a date', '2023-10-15', None, None),
+            ('50 users', None, None, user_ids.sample(50, random_state=0).tolist()),
+            ('quarter, 50 users', '2022-01-01', '2022-04-01', user_ids.sample(50, random_state=1).tolist())
+        ]
+        for name, since, until, users in cases:
+            start = time.perf_counter()
+            subset, scan = read_archive(args.archive, since, until, users, timeout)
+            seconds = time.perf_counter() - start
+            expected = select_sessions(events, since, until, users)[EVENT_COLUMNS].reset_index(drop=True)
+            actual = subset[EVENT_COLUMNS].astype({'Page': object}).reset_index(drop=True)
+            expected = expected.assign(Page=expected['Page'].astype(str).astype(object))
+            matches = actual.equals(expected) if len(expected) else len(actual) == 0
+            print(f"  {name:<18} {seconds:>6.2f}s  files {scan.files_read:>3}/{scan.files:<3} "
+                  f"row groups {scan.row_groups_read:>3}/{scan.row_groups:<3} {scan.rows:>9,} events  "
+                  f"matches full table: {matches}")
+        shutil.rmtree(args.archive)
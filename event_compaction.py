@@ -0,0 +1,111 @@
+"""
+Event compaction: collapse consecutive repeated hits on the same page
+Reloads and frame re-navigation produce runs of hits by one user on one page
+within seconds. Each run becomes a single event that keeps the first timestamp,
+the number of hits and the run's total dwell time, so later phases process far
+fewer rows while dwell totals and page-view counts stay unchanged.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Sessionization columns describing the end of a run are taken from its last hit
+RUN_END_COLUMNS = ['NextDateTime', 'IsLastInSession']
+
+CompactionStats = namedtuple('CompactionStats', ['rows_before', 'rows_after', 'dwell_before', 'dwell_after'])
+
+
+def _codes(column):
+    """Comparable array for a column (category codes when categorical)"""
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.array.codes
+    return column.to_numpy()
+
+
+def run_starts(events, window):
+    """Boolean mask marking the first event of each run of repeated hits
+
+    A run continues while the user, session and page are unchanged and each hit
+    follows the previous one within the window. Events must be sorted by user and time.
+    """
+
+    starts = np.ones(len(events), dtype=bool)
+    if len(events) < 2:
+        return starts
+
+    users = _codes(events['UserId'])
+    sessions = events['SessionId'].to_numpy()
+    pages = _codes(events['Page'])
+    gaps = np.diff(events['DateTime'].to_numpy())
+
+    starts[1:] = (
+        (users[1:] != users[:-1]) |
+        (sessions[1:] != sessions[:-1]) |
+        (pages[1:] != pages[:-1]) |
+        (gaps > np.timedelta64(window))
+    )
+    return starts
+
+
+def compact_events(events, window):
+    """Collapse runs of repeated hits into one event each; returns (events, stats)"""
+
+    start_mask = run_starts(events, window)
+    starts = np.flatnonzero(start_mask)
+    ends = np.append(starts[1:], len(events))
+
+    compacted = events.iloc[starts].reset_index(drop=True)
+    compacted['Hits'] = ends - starts
+    compacted['LastDateTime'] = events['DateTime'].to_numpy()[ends - 1]
+    for column in RUN_END_COLUMNS:
+        if column in events:
+            compacted[column] = events[column].to_numpy()[ends - 1]
+
+    if len(starts):
+        if 'DwellTime' in events:
+            # Exact duration sums; seconds derived as in sessionization
+            dwell = events['DwellTime'].to_numpy()
+            compacted['DwellTime'] = np.add.reduceat(dwell.view(np.int64), starts).view(dwell.dtype)
+            compacted['DwellTimeSeconds'] = compacted['DwellTime'].dt.total_seconds()
+        else:
+            compacted['DwellTimeSeconds'] = np.add.reduceat(
+                events['DwellTimeSeconds'].to_numpy(dtype=np.float64), starts
+            )
+
+    stats = CompactionStats(
+        rows_before=len(events),
+        rows_after=len(compacted),
+        dwell_before=_total_dwell_seconds(events),
+        dwell_after=_total_dwell_seconds(compacted)
+    )
+    return compacted, stats
+
+
+def _total_dwell_seconds(events):
+    """Total dwell time in seconds, exact when durations are available"""
+
+    if 'DwellTime' in events:
+        return events['DwellTime'].sum().total_seconds()
+    return float(events['DwellTimeSeconds'].to_numpy(dtype=np.float64).sum())
+
+
+def dwell_unchanged(stats):
+    """True when compaction preserved the dwell total (to float64 rounding for float dwell)"""
+
+    return bool(np.isclose(stats.dwell_before, stats.dwell_after, rtol=1e-12, atol=1e-6))
+
+
+def print_compaction_report(stats, window):
+    """Print the compaction ratio and dwell total check"""
+
+    ratio = stats.rows_before / stats.rows_after if stats.rows_after else float('nan')
+    print(f"\nEvent compaction (window: {pd.Timedelta(window).total_seconds():g} seconds):")
+    print(f"  Events before: {stats.rows_before:,}")
+    print(f"  Events after: {stats.rows_after:,} ({ratio:.2f}x fewer rows)")
+    if dwell_unchanged(stats):
+        print(f"  ✓ Dwell total unchanged: {stats.dwell_after:,.3f} seconds")
+    else:
+        print(f"  ✗ Dwell total changed: {stats.dwell_before:,.3f} -> {stats.dwell_after:,.3f} seconds")
@@ -0,0 +1,191 @@
+"""
+Readers for page-view and login exports in xlsx, CSV or JSONL format
+The format is chosen by file extension. Workbooks are decoded in parallel shards by
+xlsx_shards.read_xlsx, which matches pd.read_excel; legacy .xls workbooks go to
+pd.read_excel itself. CSV and JSONL are read by Arrow's multi-threaded columnar
+readers with an explicit all-string schema (no type inference), then shaped like
+pd.read_excel output: integer-looking user and page IDs become ints, other values
+('UserName', 'menu') stay strings. Cleaning and sessionization therefore behave
+identically for every format. pyarrow is imported only when a CSV or JSONL export
+is read, so xlsx-only runs do not need it.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from xlsx_shards import read_xlsx
+
+try:
+    import polars as pl
+except ImportError:  # only needed for JSONL files that mix numbers and strings in a column
+    pl = None
+
+# Lookup order when a data directory holds the same export in several formats
+EXPORT_EXTENSIONS = ['.xlsx', '.csv', '.jsonl', '.ndjson']
+
+PAGE_VIEWS_COLUMNS = ['UserId', 'Page', 'Date / Time']
+LOGIN_HISTORY_COLUMNS = ['UserId', 'Date / Time', 'Session Length', 'User Agent']
+# Columns Excel stores as numbers where the value is numeric
+EXCEL_NUMBER_COLUMNS = ['UserId', 'Page']
+
+
+def find_export(data_dir, stem):
+    """Path of an export in the data directory, trying each supported extension"""
+
+    for extension in EXPORT_EXTENSIONS:
+        path = os.path.join(data_dir, stem + extension)
+        if os.path.exists(path):
+            return path
+    return os.path.join(data_dir, stem + EXPORT_EXTENSIONS[0])
+
+
+def export_format(path):
+    """'xlsx', 'xls', 'csv' or 'jsonl' from the file extension"""
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.xlsx':
+        return 'xlsx'
+    if extension == '.xls':
+        return 'xls'
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Unsupported export format '{extension}' for {path} (use xlsx, csv or jsonl)")
+
+
+def _read_jsonl(path, schema):
+    """JSONL into an Arrow table with the given schema"""
+
+    import pyarrow as pa
+    from pyarrow import json as pa_json
+
+    try:
+        return pa_json.read_json(path, parse_options=pa_json.ParseOptions(
+            explicit_schema=schema, unexpected_field_behavior='ignore'
+        ))
+    except pa.ArrowInvalid:
+        # Arrow's JSON reader cannot cast numbers into a string column ("UserId": 1103
+        # next to "UserId": "UserName"); Polars' NDJSON reader can, into Arrow memory
+        if pl is None:
+            raise
+        string_schema = {field.name: pl.String for field in schema}
+        return pl.read_ndjson(path, schema=string_schema).to_arrow()
+
+
+def _excel_values(column):
+    """Object column with integer-looking strings as ints, as pd.read_excel returns them"""
+
+    values = column.to_numpy(dtype=object, na_value=np.nan)
+    numbers = pd.to_numeric(column, errors='coerce')
+    integral = (numbers.notna() & (numbers % 1 == 0)).to_numpy()
+    values[integral] = numbers[integral].astype(np.int64).tolist()
+    return values
+
+
+def read_export(path, columns):
+    """Read an xlsx, xls, CSV or JSONL export into a frame with the given columns"""
+
+    file_format = export_format(path)
+    if file_format == 'xlsx':
+        return read_xlsx(path)
+    if file_format == 'xls':
+        # BIFF workbooks are not zip archives; pandas reads them through xlrd
+        return pd.read_excel(path)
+
+    import pyarrow as pa
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    if file_format == 'csv':
+        from pyarrow import csv as pa_csv
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(use_threads=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=schema, include_columns=columns, strings_can_be_null=False
+            )
+        )
+    else:
+        table = _read_jsonl(path, schema)
+
+    frame = table.select(columns).to_pandas()
+    for column in EXCEL_NUMBER_COLUMNS:
+        if column in frame:
+            frame[column] = _excel_values(frame[column])
+    return frame
+
+
+def read_page_views(path):
+    """Read a page-view export (UserId, Page, Date / Time)"""
+
+    return read_export(path, PAGE_VIEWS_COLUMNS)
+
+
+def read_login_history(path):
+    """Read a login export (UserId, Date / Time, Session Length, User Agent)"""
+
+    return read_export(path, LOGIN_HISTORY_COLUMNS)
+
+
+def _best_time(read, repeat):
+    """Fastest of `repeat` reads, with the frame from the last one"""
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = read()
+        timings.append(time.perf_counter() - start)
+    return frame, min(timings)
+
+
+if __name__ == "__main__":
+    from datetime import timedelta
+    import pyarrow as pa
+    from benchmark_backends import replicate_page_views
+    from pipeline_backends import PandasBackend
+
+    parser = argparse.ArgumentParser(description='Compare xlsx, CSV and JSONL ingestion of the same page views')
+    parser.add_argument('--page-views', default='Page_Views.xlsx')
+    parser.add_argument('--scale', type=int, default=10, help='replicate the export N times with new user IDs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--work-dir', default='ingestion_benchmark')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("EXPORT INGESTION BENCHMARK")
+    print("=" * 80)
+
+    # The same rows in every format
+    page_views = replicate_page_views(read_page_views(args.page_views), args.scale)
+    os.makedirs(args.work_dir, exist_ok=True)
+    paths = {extension: os.path.join(args.work_dir, 'Page_Views' + extension) for extension in ('.xlsx', '.csv', '.jsonl')}
+    page_views.to_excel(paths['.xlsx'], index=False, engine='xlsxwriter')
+    page_views.to_csv(paths['.csv'], index=False)
+    page_views.to_json(paths['.jsonl'], orient='records', lines=True, force_ascii=False)
+    print(f"Input: {len(page_views):,} page views (scale x{args.scale}), {pa.io_thread_count()} Arrow I/O threads\n")
+
+    frames, timings = {}, {}
+    for extension, path in paths.items():
+        frames[extension], timings[extension] = _best_time(lambda: read_page_views(path), args.repeat)
+        print(f"  {extension:<7} {timings[extension]:8.3f}s  "
+              f"({timings['.xlsx'] / timings[extension]:5.1f}x vs xlsx, {os.path.getsize(path) / 1e6:6.1f} MB)")
+
+    # Same frames, and the same cleaned and sessionized events
+    reference = PandasBackend()
+    reference_events = reference.sessionize(reference.clean(frames['.xlsx'].copy()), timedelta(minutes=30))
+    ok = True
+    for extension in ('.csv', '.jsonl'):
+        backend = PandasBackend()
+        events = backend.sessionize(backend.clean(frames[extension].copy()), timedelta(minutes=30))
+        try:
+            pd.testing.assert_frame_equal(frames[extension], frames['.xlsx'])
+            pd.testing.assert_frame_equal(events, reference_events)
+        except AssertionError as e:
+            print(f"  ✗ {extension} differs from xlsx: {e}")
+            ok = False
+    print(f"\n{'✓' if ok else '✗'} CSV and JSONL {'match' if ok else 'DO NOT match'} the xlsx path "
+          f"through cleaning and sessionization")
+    raise SystemExit(0 if ok else 1)
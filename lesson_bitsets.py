@@ -0,0 +1,184 @@
+"""
+Lesson started/completed sets stored as per-user integer bitmasks
+Bit k-1 is set when lesson k was started (any page viewed) or completed (summary page viewed)
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+MASK_DTYPE = np.uint32
+
+
+def lesson_numbers(lessons):
+    """Convert 'Lesson N' labels to integer lesson numbers (0 for no lesson)"""
+
+    codes, labels = pd.factorize(pd.Series(lessons), use_na_sentinel=True)
+    label_numbers = pd.Series(labels, dtype=object).astype(str).str.extract(r'(\d+)')[0]
+    label_numbers = label_numbers.fillna(0).astype(int).to_numpy()
+    return np.where(codes >= 0, label_numbers[codes], 0)
+
+
+def lessons_to_mask(lessons):
+    """Build a bitmask from an iterable of lesson numbers"""
+
+    mask = 0
+    for lesson in lessons:
+        mask |= 1 << (int(lesson) - 1)
+    return MASK_DTYPE(mask)
+
+
+def mask_to_lessons(mask):
+    """Expand a bitmask back into a sorted list of lesson numbers"""
+
+    mask = int(mask)
+    return [bit + 1 for bit in range(mask.bit_length()) if mask >> bit & 1]
+
+
+def popcount(masks):
+    """Count set bits for every mask in an array"""
+
+    as_bytes = np.ascontiguousarray(masks, dtype='<u4').view(np.uint8).reshape(-1, 4)
+    return np.unpackbits(as_bytes, axis=1).sum(axis=1)
+
+
+def parse_lesson_range(text):
+    """Parse '1-4,7' style lesson lists"""
+
+    lessons = []
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        if '-' in part:
+            start, end = part.split('-', 1)
+            lessons.extend(range(int(start), int(end) + 1))
+        else:
+            lessons.append(int(part))
+    return lessons
+
+
+class LessonBitsets:
+    """Per-user started and completed lesson bitmasks with cohort set queries"""
+
+    def __init__(self, users, started, completed):
+        self.users = pd.Index(users)
+        self.started = np.asarray(started, dtype=MASK_DTYPE)
+        self.completed = np.asarray(completed, dtype=MASK_DTYPE)
+
+    @classmethod
+    def from_events(cls, user_ids, lessons, is_last_page):
+        """Build bitmasks from enriched page-view events in one vectorized pass"""
+
+        user_codes, users = pd.factorize(pd.Series(user_ids).to_numpy())
+        numbers = lesson_numbers(lessons)
+        in_lesson = numbers > 0
+        bits = np.zeros(len(numbers), dtype=MASK_DTYPE)
+        bits[in_lesson] = MASK_DTYPE(1) << (numbers[in_lesson] - 1).astype(MASK_DTYPE)
+
+        started = np.zeros(len(users), dtype=MASK_DTYPE)
+        np.bitwise_or.at(started, user_codes, bits)
+
+        finished = pd.Series(is_last_page).eq(True).fillna(False).to_numpy(dtype=bool) & in_lesson
+        completed = np.zeros(len(users), dtype=MASK_DTYPE)
+        np.bitwise_or.at(completed, user_codes[finished], bits[finished])
+
+        return cls(users, started, completed)
+
+    @classmethod
+    def from_metrics(cls, metrics_df):
+        """Load bitmasks back from the User_Metrics table"""
+
+        return cls(
+            metrics_df['Invite_Code'],
+            metrics_df['Lessons_Started_Mask'].to_numpy(),
+            metrics_df['Lessons_Completed_Mask'].to_numpy()
+        )
+
+    def to_frame(self):
+        """Per-user masks and counts indexed by user"""
+
+        return pd.DataFrame({
+            'Lessons_Started_Mask': self.started,
+            'Lessons_Completed_Mask': self.completed,
+            'Lessons_Started': popcount(self.started),
+            'Lessons_Completed': popcount(self.completed)
+        }, index=self.users)
+
+    def _positions(self, users):
+        """Row positions for a cohort of users (all users when None)"""
+
+        if users is None:
+            return np.arange(len(self.users))
+        positions = self.users.get_indexer(pd.Index(users))
+        return positions[positions >= 0]
+
+    def select(self, completed=(), not_completed=(), started=(), not_started=(), users=None):
+        """Users matching all of the given lesson set conditions"""
+
+        positions = self._positions(users)
+        done = self.completed[positions]
+        seen = self.started[positions]
+        keep = np.ones(len(positions), dtype=bool)
+
+        for masks, lessons, present in (
+            (done, completed, True), (done, not_completed, False),
+            (seen, started, True), (seen, not_started, False)
+        ):
+            if lessons:
+                mask = lessons_to_mask(lessons)
+                keep &= (masks & mask) == (mask if present else 0)
+
+        return self.users[positions[keep]]
+
+    def completed_by_all(self, users=None):
+        """Lessons completed by every user in the cohort"""
+
+        positions = self._positions(users)
+        if len(positions) == 0:
+            return []
+        return mask_to_lessons(np.bitwise_and.reduce(self.completed[positions]))
+
+    def completed_by_any(self, users=None):
+        """Lessons completed by at least one user in the cohort"""
+
+        positions = self._positions(users)
+        return mask_to_lessons(np.bitwise_or.reduce(self.completed[positions]))
+
+    def completion_counts(self, users=None, total_lessons=12):
+        """Number of users in the cohort completing each lesson"""
+
+        positions = self._positions(users)
+        bits = (self.completed[positions, None] >> np.arange(total_lessons, dtype=MASK_DTYPE)) & 1
+        return pd.Series(bits.sum(axis=0), index=pd.RangeIndex(1, total_lessons + 1, name='Lesson'))
+
+    def completion_overlap(self, users_a, users_b, total_lessons=12):
+        """Per-lesson completion counts for two cohorts and the users they share"""
+
+        shared = pd.Index(users_a).intersection(pd.Index(users_b))
+        return pd.DataFrame({
+            'Cohort_A_Completed': self.completion_counts(users_a, total_lessons),
+            'Cohort_B_Completed': self.completion_counts(users_b, total_lessons),
+            'Shared_Users_Completed': self.completion_counts(shared, total_lessons)
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query lesson completion sets from the metrics workbook')
+    parser.add_argument('--metrics', default='CRAFT_PTSD_Engagement_Metrics.xlsx')
+    parser.add_argument('--completed', default='', help="lessons completed, e.g. '1-4'")
+    parser.add_argument('--not-completed', default='', help="lessons not completed, e.g. '5'")
+    parser.add_argument('--started', default='', help='lessons started')
+    parser.add_argument('--not-started', default='', help='lessons not started')
+    args = parser.parse_args()
+
+    metrics = pd.read_excel(args.metrics, sheet_name='User_Metrics')
+    lesson_sets = LessonBitsets.from_metrics(metrics)
+    matches = lesson_sets.select(
+        completed=parse_lesson_range(args.completed),
+        not_completed=parse_lesson_range(args.not_completed),
+        started=parse_lesson_range(args.started),
+        not_started=parse_lesson_range(args.not_started)
+    )
+
+    print(f"Matching users: {len(matches)}/{len(lesson_sets.users)}")
+    for user in matches:
+        print(f"  {user}")
+    print(f"\nLessons completed by all matching users: {lesson_sets.completed_by_all(matches)}")
@@ -0,0 +1,174 @@
+"""
+Peak resident memory (RSS) and wall time tracking per pipeline phase
+On Linux the kernel's high-water mark is reset between phases, so each phase
+reports its own peak; elsewhere the process-wide peak from getrusage is used.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STATUS_FILE = '/proc/self/status'
+CLEAR_REFS_FILE = '/proc/self/clear_refs'
+
+
+def _status_mb(field):
+    """Read a memory field (VmHWM, VmRSS) from /proc in MB, or None"""
+
+    if os.path.exists(STATUS_FILE):
+        with open(STATUS_FILE) as f:
+            match = re.search(field + r':\s+(\d+) kB', f.read())
+        if match:
+            return int(match.group(1)) / 1024
+    return None
+
+
+def current_rss_mb():
+    """Resident memory right now in MB (NaN where /proc is unavailable)"""
+
+    rss = _status_mb('VmRSS')
+    return float('nan') if rss is None else rss
+
+
+def current_peak_mb():
+    """Peak RSS in MB since the last reset (or process start)"""
+
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kB elsewhere
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    return float('nan')
+
+
+def reset_peak():
+    """Reset the kernel high-water mark; returns False where that is unsupported"""
+
+    try:
+        with open(CLEAR_REFS_FILE, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class PhaseMemory:
+    """Records the peak RSS reached and wall time taken during each phase of a run"""
+
+    def __init__(self):
+        self.phases = []
+        self.per_phase = reset_peak()
+        self._phase_start = time.perf_counter()
+
+    def checkpoint(self, phase):
+        """Close the current phase, recording its peak RSS and wall time"""
+
+        peak = current_peak_mb()
+        now = time.perf_counter()
+        self.phases.append((phase, peak, now - self._phase_start))
+        reset_peak()
+        self._phase_start = time.perf_counter()
+        return peak
+
+    def overall_peak(self, skip=0):
+        """Highest phase peak, optionally ignoring the first phases"""
+
+        return max((peak for _, peak, _ in self.phases[skip:]), default=current_peak_mb())
+
+    def report(self):
+        """Print per-phase peaks and wall times"""
+
+        scope = 'per phase' if self.per_phase else 'cumulative, process-wide'
+        print(f"\nPeak memory ({scope}) and wall time:")
+        for phase, peak, seconds in self.phases:
+            print(f"  {phase:<40} {peak:>10,.1f} MB {seconds:>9.2f} s")
+
+
+def _profile_run(rows, lean, backend_name):
+    """Run phases 2A-3A on a synthetic export and print per-phase peaks"""
+
+    from datetime import timedelta
+    import numpy as np
+    import pandas as pd
+    from pipeline_backends import get_backend
+
+    memory = PhaseMemory()
+
+    # Synthetic export shaped like Page_Views.xlsx: object columns, string timestamps
+    rng = np.random.default_rng(0)
+    users = rng.integers(1000, 1000 + max(rows // 2000, 1), rows)
+    stamps = pd.Timestamp('2021-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 10 ** 8, rows)), unit='s')
+    page_views = pd.DataFrame({
+        'UserId': users.astype(object),
+        'Page': np.where(rng.random(rows) < 0.1, 'menu', rng.integers(1, 192, rows).astype(str)).astype(object),
+        'Date / Time': stamps.strftime('%Y-%m-%d %H:%M:%S.%f')
+    })
+    data_dict = pd.read_csv('Data_Dictionary_FINAL.csv')
+    del users, stamps
+    memory.checkpoint('PHASE 2A: load (synthetic)')
+    loaded_rss = current_rss_mb()
+
+    backend = get_backend(backend_name, lean=lean)
+    events = backend.clean(page_views)
+    if lean:
+        del page_views
+    memory.checkpoint('PHASE 2A: clean')
+
+    events = backend.sessionize(events, timedelta(minutes=30))
+    memory.checkpoint('PHASE 2B: sessionize')
+
+    events = backend.enrich(events, data_dict)
+    memory.checkpoint('PHASE 2C: enrich')
+
+    tables = backend.collect(events)
+    del events
+    memory.checkpoint('PHASE 3A: aggregate')
+
+    print(f"Rows: {len(tables.events):,}  users: {len(tables.users):,}  mode: {'lean' if lean else 'standard'}")
+    memory.report()
+    # The first phase only builds the synthetic sheet and is the same in both modes,
+    # so the comparison is the working memory used on top of the loaded sheet
+    print(f"Resident after load: {loaded_rss:,.1f} MB")
+    print(f"OVERALL_PEAK_MB={memory.overall_peak(skip=1):.1f}")
+    print(f"WORKING_PEAK_MB={memory.overall_peak(skip=1) - loaded_rss:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare peak memory of standard and lean pipeline modes')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--backend', default='pandas')
+    parser.add_argument('--mode', choices=['standard', 'lean'], default=None,
+                        help='profile one mode in this process (default: both, in subprocesses)')
+    args = parser.parse_args()
+
+    if args.mode:
+        _profile_run(args.rows, args.mode == 'lean', args.backend)
+        raise SystemExit(0)
+
+    peaks, working = {}, {}
+    for mode in ('standard', 'lean'):
+        print("=" * 80)
+        print(f"{mode.upper()} MODE")
+        print("=" * 80)
+        output = subprocess.run(
+            [sys.executable, __file__, '--rows', str(args.rows), '--backend', args.backend, '--mode', mode],
+            capture_output=True, text=True, check=True
+        ).stdout
+        print(output)
+        peaks[mode] = float(re.search(r'OVERALL_PEAK_MB=([\d.]+)', output).group(1))
+        working[mode] = float(re.search(r'WORKING_PEAK_MB=([\d.]+)', output).group(1))
+
+    print(f"Pipeline peak RSS: {peaks['standard']:,.0f} MB -> {peaks['lean']:,.0f} MB "
+          f"({peaks['standard'] / peaks['lean']:.2f}x less)")
+    print(f"Peak working memory above the loaded sheet: {working['standard']:,.0f} MB -> "
+          f"{working['lean']:,.0f} MB ({working['standard'] / working['lean']:.2f}x less)")
@@ -0,0 +1,297 @@
+"""
+Long-running metrics service for dashboards
+Runs the pipeline stages of pipeline_dag.py once, keeps User_Metrics,
+Section_Engagement and the summary statistics in memory as pre-encoded JSON, and
+serves them on a local HTTP port. The input directory is polled for new exports, which are processed in the
+background and swapped in when ready.
+
+Endpoints:
+  GET /health                      service status
+  GET /summary                     summary statistics
+  GET /sections                    section engagement
+  GET /users?page=1&per_page=50    users ranked by Total_Time_Hours, paginated
+  GET /users/<invite_code>         one user's metrics
+  GET /top?k=10                    top-K users by Total_Time_Hours
+  GET /timeline/<invite_code>      one user's sessions and pages (timeline index)
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+from batch_studies import DICTIONARY_FILE
+from export_readers import EXPORT_EXTENSIONS
+from parse_config import COURSE_STRUCTURE_FILE
+from pipeline_dag import build_parser, pipeline_config, run_stages
+from timeline_index import TimelineIndex
+
+WATCHED_FILES = [stem + extension for stem in ('Page_Views', 'Login_History') for extension in EXPORT_EXTENSIONS] + [
+    DICTIONARY_FILE, COURSE_STRUCTURE_FILE
+]
+DEFAULT_PORT = 8765
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+def _encode(value):
+    """Compact UTF-8 JSON"""
+
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def _records(frame):
+    """JSON-ready records (ISO timestamps, plain Python numbers)"""
+
+    return json.loads(frame.to_json(orient='records', date_format='iso'))
+
+
+class MetricsState:
+    """Immutable snapshot of the pipeline outputs, indexed for constant-time responses"""
+
+    def __init__(self, metrics_df, section_stats, summary_stats, source, loaded_at=None, timeline_index=None):
+        ranked = metrics_df.sort_values('Total_Time_Hours', ascending=False, kind='stable')
+        records = [_encode(record) for record in _records(ranked)]
+
+        self.ranked = records
+        self.users = dict(zip(ranked['Invite_Code'].astype(str), records))
+        self.sections = _encode(_records(section_stats))
+        self.summary = _encode(dict(zip(summary_stats['Metric'], summary_stats['Value'].tolist())))
+        self.timeline_index = timeline_index
+        self.source = source
+        self.loaded_at = loaded_at or datetime.now().isoformat(timespec='seconds')
+
+    def page(self, start, stop):
+        """JSON array of ranked users in [start, stop)"""
+
+        return b'[' + b','.join(self.ranked[start:stop]) + b']'
+
+
+def input_signature(data_dir):
+    """Modification times and sizes of the watched exports"""
+
+    signature = []
+    for name in WATCHED_FILES:
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def run_pipeline(data_dir, work_dir):
+    """Run the pipeline stages in this process and return their results as a MetricsState
+
+    The stages are called with an explicit configuration (the staged runner's defaults),
+    so a reload in the watcher thread leaves sys.argv and sys.stdout alone for the
+    request handlers. Exported files are written to work_dir.
+    """
+
+    signature = input_signature(data_dir)
+    config = pipeline_config(build_parser().parse_args(['--data-dir', data_dir, '--output-dir', work_dir]))
+    outputs = run_stages(config, until='export')
+    metrics, enrich = outputs['metrics'], outputs['enrich']
+    return MetricsState(metrics['metrics_df'], enrich['section_stats'], metrics['summary_stats'], signature,
+                        timeline_index=TimelineIndex.from_events(enrich['df_enriched']))
+
+
+class MetricsService:
+    """Holds the current state and refreshes it when the exports change"""
+
+    def __init__(self, data_dir, work_dir, poll_seconds=5.0):
+        self.data_dir = data_dir
+        self.work_dir = work_dir
+        self.poll_seconds = poll_seconds
+        self.state = run_pipeline(data_dir, work_dir)
+        self.reloads = 0
+        self.last_error = None
+        self._stop = threading.Event()
+
+    def watch(self):
+        """Poll the input directory; reload once a changed signature has been stable for one poll"""
+
+        pending = None
+        while not self._stop.wait(self.poll_seconds):
+            signature = input_signature(self.data_dir)
+            if signature == self.state.source:
+                pending = None
+            elif signature != pending:
+                pending = signature  # still being written, or just appeared
+            else:
+                self.reload()
+                pending = None
+
+    def reload(self):
+        """Re-run the pipeline and swap in the new state (the old one is served meanwhile)"""
+
+        try:
+            self.state = run_pipeline(self.data_dir, self.work_dir)
+            self.reloads += 1
+            self.last_error = None
+            print(f"Reloaded metrics at {self.state.loaded_at}")
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"✗ Reload failed, keeping previous metrics: {self.last_error}")
+
+    def start_watching(self):
+        """Start the background watcher thread"""
+
+        thread = threading.Thread(target=self.watch, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop the watcher thread"""
+
+        self._stop.set()
+
+
+def _positive_int(query, name, default):
+    """Positive integer query parameter"""
+
+    value = int(query.get(name, [default])[0])
+    if value < 1:
+        raise ValueError(f"'{name}' must be at least 1")
+    return value
+
+
+def respond(service, path):
+    """Status code and JSON body for a request path"""
+
+    url = urlsplit(path)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split('/') if part]
+    state = service.state  # one snapshot per request
+
+    try:
+        if parts == ['health']:
+            return 200, _encode({
+                'status': 'ok', 'loaded_at': state.loaded_at, 'users': len(state.ranked),
+                'reloads': service.reloads, 'last_error': service.last_error
+            })
+        if parts == ['summary']:
+            return 200, state.summary
+        if parts == ['sections']:
+            return 200, state.sections
+        if parts == ['top']:
+            return 200, state.page(0, _positive_int(query, 'k', 10))
+        if parts == ['users']:
+            page = _positive_int(query, 'page', 1)
+            per_page = min(_positive_int(query, 'per_page', DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+            start = (page - 1) * per_page
+            return 200, (b'{"page":%d,"per_page":%d,"total":%d,"users":' % (page, per_page, len(state.ranked))
+                         + state.page(start, start + per_page) + b'}')
+        if len(parts) == 2 and parts[0] == 'users':
+            body = state.users.get(parts[1])
+            if body is None:
+                return 404, _encode({'error': f"Unknown user '{parts[1]}'"})
+            return 200, body
+        if len(parts) == 2 and parts[0] == 'timeline' and state.timeline_index is not None:
+            try:
+                return 200, _encode(state.timeline_index.timeline(parts[1]))
+            except KeyError:
+                return 404, _encode({'error': f"Unknown user '{parts[1]}'"})
+    except ValueError as e:
+        return 400, _encode({'error': str(e)})
+    return 404, _encode({'error': f"Unknown endpoint '{url.path}'"})
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves respond() results for GET requests"""
+
+    service = None
+
+    def do_GET(self):
+        status, body = respond(self.service, self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Requests are not logged"""
+
+
+def serve(service, host='127.0.0.1', port=DEFAULT_PORT):
+    """Create an HTTP server bound to the service (port 0 picks a free port)"""
+
+    handler = type('BoundMetricsHandler', (MetricsHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def self_test(service, requests=200):
+    """Serve on a free localhost port, call every endpoint and report response times"""
+
+    server = serve(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    some_user = next(iter(service.state.users))
+
+    print(f"Self-test against {base} ({requests} requests per endpoint)")
+    ok = True
+    for path in ['/health', '/summary', '/sections', '/top?k=10', '/users?page=2&per_page=20', f'/users/{some_user}',
+                 f'/timeline/{some_user}']:
+        with urlopen(base + path) as response:
+            payload = json.loads(response.read())
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            with urlopen(base + path) as response:
+                response.read()
+            timings.append(time.perf_counter() - start)
+        # Server-side response time, without HTTP and socket overhead
+        handler_start = time.perf_counter()
+        for _ in range(requests):
+            respond(service, path)
+        lookup_us = (time.perf_counter() - handler_start) / requests * 1e6
+        timings.sort()
+        print(f"  {path:<32} median {timings[len(timings) // 2] * 1000:6.2f} ms round trip, "
+              f"{lookup_us:6.2f} µs to build the response")
+        ok &= bool(payload)
+
+    try:
+        urlopen(base + '/users/no-such-user')
+        ok = False
+    except Exception as e:
+        ok &= getattr(e, 'code', None) == 404
+    server.shutdown()
+    print(f"{'✓' if ok else '✗'} Self-test {'passed' if ok else 'FAILED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve engagement metrics as JSON on a local HTTP port')
+    parser.add_argument('--data-dir', default='.', help='directory with the exports (watched for changes)')
+    parser.add_argument('--work-dir', default='metrics_service', help='directory for pipeline outputs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--poll-seconds', type=float, default=5.0)
+    parser.add_argument('--self-test', action='store_true', help='check all endpoints on localhost and exit')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("ENGAGEMENT METRICS SERVICE")
+    print("=" * 80)
+    start = time.perf_counter()
+    service = MetricsService(args.data_dir, args.work_dir, args.poll_seconds)
+    print(f"Loaded {len(service.state.ranked)} users in {time.perf_counter() - start:.1f}s")
+
+    if args.self_test:
+        raise SystemExit(0 if self_test(service) else 1)
+
+    service.start_watching()
+    server = serve(service, args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]} (watching {os.path.abspath(args.data_dir)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping")
+    finally:
+        service.stop()
+        server.server_close()
@@ -0,0 +1,403 @@
+"""
+Sparse user x page matrix and cosine nearest-neighbour search over navigation
+Each user's row holds, for every page they viewed, the number of views and the total
+dwell seconds. The matrix is built in one pass over the sessionized events: user
+and page codes are combined into one integer per (user, page) pair and the pairs
+are counted with bincount, giving CSR arrays in the layout of scipy.sparse.csr_matrix
+(indptr, indices, data; to_scipy() converts when scipy is installed).
+
+Similarity is cosine similarity of log-damped views (or dwell minutes), so heavy
+users are compared by which pages they use rather than by how much. The course
+has a few hundred pages at most, so the search keeps the L2-normalised rows as a
+dense float32 array and answers top-k queries exactly with one matrix-vector
+product; all-pairs neighbour tables are computed in blocks of rows. An optional
+spherical k-means groups users into navigation clusters with a short summary.
+
+The matrix is saved as a directory of .npy arrays with a JSON file of user IDs
+and page labels, like the timeline index, and memory-mapped on load.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+MATRIX_VERSION = 1
+META_FILE = 'user_pages.json'
+ARRAYS = ['indptr', 'indices', 'views', 'dwell_seconds']
+WEIGHTS = ('views', 'dwell')
+DEFAULT_K = 10
+BLOCK_ROWS = 1024
+CLUSTER_ITERATIONS = 100
+
+
+class UserPageMatrix:
+    """CSR user x page matrix of view counts and dwell seconds"""
+
+    def __init__(self, user_ids, pages, arrays):
+        self.user_ids = [str(user) for user in user_ids]
+        self.pages = pages  # one dict per page column: Page, Title
+        self.indptr = arrays['indptr']
+        self.indices = arrays['indices']
+        self.views = arrays['views']
+        self.dwell_seconds = arrays['dwell_seconds']
+        self._users = {user: code for code, user in enumerate(self.user_ids)}
+
+    @classmethod
+    def from_events(cls, events):
+        """Count views and sum dwell per (user, page) pair of sessionized events
+
+        Views are summed from Hits when events are compacted.
+        """
+
+        user_codes, user_ids = pd.factorize(np.asarray(events['UserId'], dtype=object), sort=False)
+        page_codes, page_labels = pd.factorize(events['Page'].astype(str), sort=False)
+        page_count = len(page_labels)
+
+        # Pairs coded user-major, so the sorted distinct pairs are the CSR entries in row order
+        pairs, entries = np.unique(user_codes.astype(np.int64) * page_count + page_codes, return_inverse=True)
+        hits = events['Hits'].to_numpy(dtype=np.float64) if 'Hits' in events else None
+        views = np.bincount(entries, weights=hits, minlength=len(pairs)).astype(np.int64)
+        dwell = np.bincount(entries, weights=events['DwellTimeSeconds'].to_numpy(dtype=np.float64),
+                            minlength=len(pairs))
+        rows, columns = np.divmod(pairs, page_count)
+
+        titles = events['Title'].to_numpy(dtype=object) if 'Title' in events else np.full(len(events), None)
+        first_rows = np.unique(page_codes, return_index=True)[1]
+        pages = [{'Page': str(page), 'Title': None if pd.isna(titles[row]) else str(titles[row])}
+                 for page, row in zip(page_labels, first_rows)]
+        arrays = {
+            'indptr': np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(user_ids)))]).astype(np.int64),
+            'indices': columns.astype(np.int32),
+            'views': views,
+            'dwell_seconds': dwell
+        }
+        return cls(pd.Series(user_ids, dtype=object).tolist(), pages, arrays)
+
+    def save(self, directory):
+        """Write the CSR arrays as .npy files and the labels as JSON"""
+
+        os.makedirs(directory, exist_ok=True)
+        for name, values in zip(ARRAYS, [self.indptr, self.indices, self.views, self.dwell_seconds]):
+            np.save(os.path.join(directory, name + '.npy'), np.asarray(values))
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({'version': MATRIX_VERSION, 'shape': list(self.shape), 'users': self.user_ids,
+                       'pages': self.pages}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Open a saved matrix; arrays are memory-mapped unless mmap=False"""
+
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != MATRIX_VERSION:
+            raise ValueError(f"{directory} holds user-page matrix version {meta.get('version')}, "
+                             f"expected {MATRIX_VERSION}; rebuild it")
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in ARRAYS}
+        return cls(meta['users'], meta['pages'], arrays)
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.pages)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def user_code(self, user):
+        """Row of a user (KeyError for unknown users)"""
+
+        try:
+            return self._users[str(user)]
+        except KeyError:
+            raise KeyError(f"Unknown user '{user}'") from None
+
+    def row_codes(self):
+        """Row code of every stored entry"""
+
+        return np.repeat(np.arange(len(self.user_ids)), np.diff(self.indptr))
+
+    def to_dense(self, values='views'):
+        """Dense users x pages array of views or dwell seconds"""
+
+        dense = np.zeros(self.shape, dtype=np.float64)
+        dense[self.row_codes(), self.indices] = self.views if values == 'views' else self.dwell_seconds
+        return dense
+
+    def to_scipy(self, values='views'):
+        """scipy.sparse.csr_matrix of views or dwell seconds (requires scipy)"""
+
+        from scipy.sparse import csr_matrix
+
+        data = self.views if values == 'views' else self.dwell_seconds
+        return csr_matrix((np.asarray(data), np.asarray(self.indices), np.asarray(self.indptr)), shape=self.shape)
+
+
+def similarity_vectors(matrix, weight='views'):
+    """L2-normalised float32 rows of log(1 + views) or log(1 + dwell minutes)"""
+
+    if weight not in WEIGHTS:
+        raise ValueError(f"weight must be one of {WEIGHTS}, not '{weight}'")
+    values = np.log1p(np.asarray(matrix.views, dtype=np.float64) if weight == 'views'
+                      else np.asarray(matrix.dwell_seconds) / 60)
+    vectors = np.zeros(matrix.shape, dtype=np.float32)
+    vectors[matrix.row_codes(), matrix.indices] = values
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _top_k(scores, k):
+    """Positions of the k highest scores per row, best first (ties by position)"""
+
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class SimilarityIndex:
+    """Exact cosine top-k search over users' page vectors"""
+
+    def __init__(self, matrix, weight='views'):
+        self.matrix = matrix
+        self.weight = weight
+        self.vectors = similarity_vectors(matrix, weight)
+
+    def similar(self, user, k=DEFAULT_K):
+        """The k users most similar to one user, most similar first"""
+
+        code = self.matrix.user_code(user)
+        scores = (self.vectors @ self.vectors[code])[None, :]
+        scores[0, code] = -np.inf
+        top = _top_k(scores, min(k, len(self.vectors) - 1))[0]
+        return pd.DataFrame({
+            'UserId': [self.matrix.user_ids[i] for i in top],
+            'Similarity': scores[0, top].astype(np.float64).round(4)
+        })
+
+    def all_similar(self, k=DEFAULT_K, block_rows=BLOCK_ROWS):
+        """Neighbour codes and similarities (users x k) for every user, one block of rows at a time"""
+
+        users = len(self.vectors)
+        k = min(k, users - 1)
+        neighbours = np.zeros((users, k), dtype=np.int64)
+        similarities = np.zeros((users, k), dtype=np.float32)
+        for start in range(0, users, block_rows):
+            end = min(start + block_rows, users)
+            scores = self.vectors[start:end] @ self.vectors.T
+            scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+            top = _top_k(scores, k)
+            neighbours[start:end] = top
+            similarities[start:end] = np.take_along_axis(scores, top, axis=1)
+        return neighbours, similarities
+
+
+def spherical_kmeans(vectors, clusters, seed=0, iterations=CLUSTER_ITERATIONS):
+    """Cluster labels and unit centroids for unit vectors, k-means++ seeding on cosine distance"""
+
+    rng = np.random.default_rng(seed)
+    clusters = min(clusters, len(vectors))
+    centroids = [vectors[rng.integers(len(vectors))]]
+    distance = 1 - vectors @ centroids[0]
+    for _ in range(1, clusters):
+        weights = np.clip(distance, 0, None)
+        total = weights.sum()
+        pick = rng.choice(len(vectors), p=weights / total) if total > 0 else rng.integers(len(vectors))
+        centroids.append(vectors[pick])
+        distance = np.minimum(distance, 1 - vectors @ vectors[pick])
+    centroids = np.array(centroids)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmax(vectors @ centroids.T, axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # An emptied cluster keeps its previous centroid
+        centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+    return labels, centroids
+
+
+def cluster_summary(matrix, labels, top_pages=3, min_share=0.005):
+    """Per cluster: users, mean views and dwell hours, and its top and most distinctive pages
+
+    Distinctive pages have the highest lift (the cluster's share of views over all
+    users' share) among pages with at least min_share of the cluster's views.
+    """
+
+    labels = np.asarray(labels)
+    clusters = labels.max() + 1
+    entry_labels = labels[matrix.row_codes()]
+    views = np.asarray(matrix.views, dtype=np.float64)
+    users = np.bincount(labels, minlength=clusters)
+    cluster_views = np.bincount(entry_labels, weights=views, minlength=clusters)
+    cluster_dwell = np.bincount(entry_labels, weights=np.asarray(matrix.dwell_seconds), minlength=clusters)
+    page_views = np.bincount(entry_labels * matrix.shape[1] + matrix.indices, weights=views,
+                             minlength=clusters * matrix.shape[1]).reshape(clusters, -1)
+
+    def page_label(column):
+        page = matrix.pages[column]
+        return f"{page['Page']} {page['Title']}" if page['Title'] else page['Page']
+
+    shares = page_views / np.maximum(cluster_views, 1)[:, None]
+    overall = page_views.sum(axis=0) / max(cluster_views.sum(), 1)
+    lift = np.where(shares >= min_share, shares / np.where(overall > 0, overall, 1), 0)
+    top = np.argsort(-shares, axis=1, kind='stable')[:, :top_pages]
+    distinctive = np.argsort(-lift, axis=1, kind='stable')[:, :top_pages]
+    return pd.DataFrame({
+        'Cluster': np.arange(clusters),
+        'Users': users,
+        'Mean_Views': (cluster_views / np.maximum(users, 1)).round(1),
+        'Mean_Dwell_Hours': (cluster_dwell / 3600 / np.maximum(users, 1)).round(2),
+        'Top_Pages': ['; '.join(f"{page_label(column)} ({shares[c, column]:.0%})" for column in top[c])
+                      for c in range(clusters)],
+        'Distinctive_Pages': ['; '.join(f"{page_label(column)} (x{lift[c, column]:.1f})" for column in distinctive[c])
+                              for c in range(clusters)]
+    }).sort_values('Users', ascending=False, ignore_index=True)
+
+
+def naive_user_pages(events):
+    """Reference implementation: views and dwell per (user, page) with a groupby"""
+
+    frame = pd.DataFrame({'UserId': np.asarray(events['UserId'], dtype=object).astype(str),
+                          'Page': events['Page'].astype(str).to_numpy(),
+                          'Views': events['Hits'].to_numpy() if 'Hits' in events else 1,
+                          'Dwell': events['DwellTimeSeconds'].to_numpy(dtype=np.float64)})
+    return frame.groupby(['UserId', 'Page']).agg(Views=('Views', 'sum'), Dwell=('Dwell', 'sum'))
+
+
+def naive_similar(pairs, user, k=DEFAULT_K):
+    """Reference implementation: cosine of log-damped views against every other user in a loop"""
+
+    vectors = {other: np.log1p(rows['Views'].droplevel('UserId'))
+               for other, rows in pairs.groupby(level='UserId')}
+    query = vectors[str(user)]
+    scores = []
+    for other, vector in vectors.items():
+        if other != str(user):
+            dot = (query * vector).reindex(query.index.intersection(vector.index)).sum()
+            scores.append((other, dot / np.sqrt((query ** 2).sum() * (vector ** 2).sum())))
+    return sorted((score for _, score in scores), reverse=True)[:k]
+
+
+def print_matrix(matrix):
+    """Shape, stored entries and density"""
+
+    users, pages = matrix.shape
+    print(f"  {users:,} users x {pages} pages, {matrix.nnz:,} stored entries "
+          f"({matrix.nnz / max(users * pages, 1):.1%} dense), {int(np.sum(matrix.views)):,} views")
+
+
+def build_from_exports(page_views_path, dictionary_path, session_timeout_minutes=30, scale=1):
+    """Clean, sessionize and enrich an export with the pandas backend, then build the matrix"""
+
+    from datetime import timedelta
+    from benchmark_backends import replicate_page_views
+    from export_readers import read_page_views
+    from pipeline_backends import PandasBackend
+
+    backend = PandasBackend()
+    page_views = replicate_page_views(read_page_views(page_views_path), scale)
+    events = backend.sessionize(backend.clean(page_views), timedelta(minutes=session_timeout_minutes))
+    events = backend.enrich(events, pd.read_csv(dictionary_path))
+    return UserPageMatrix.from_events(events), events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='User x page matrix: build, find similar users, cluster, check')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='build and save the matrix from a page-view export')
+    build_parser.add_argument('--page-views', default='Page_Views.xlsx')
+    build_parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    build_parser.add_argument('--matrix', default='CRAFT_PTSD_User_Pages')
+
+    similar_parser = commands.add_parser('similar', help='users whose navigation is most like one user')
+    similar_parser.add_argument('user')
+    similar_parser.add_argument('--matrix', default='CRAFT_PTSD_User_Pages')
+    similar_parser.add_argument('--k', type=int, default=DEFAULT_K)
+    similar_parser.add_argument('--weight', choices=WEIGHTS, default='views')
+
+    cluster_parser = commands.add_parser('clusters', help='spherical k-means summary of navigation patterns')
+    cluster_parser.add_argument('--matrix', default='CRAFT_PTSD_User_Pages')
+    cluster_parser.add_argument('--clusters', type=int, default=5)
+    cluster_parser.add_argument('--weight', choices=WEIGHTS, default='views')
+    cluster_parser.add_argument('--seed', type=int, default=0)
+
+    check_parser = commands.add_parser('check', help='compare with groupby/loop references and benchmark')
+    check_parser.add_argument('--page-views', default='Page_Views.xlsx')
+    check_parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    check_parser.add_argument('--scale', type=int, default=200, help='replicate the export N times with new user IDs')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print(f"USER-PAGE SIMILARITY: {args.command.upper()}")
+    print("=" * 80)
+
+    if args.command == 'build':
+        matrix, events = build_from_exports(args.page_views, args.dictionary)
+        matrix.save(args.matrix)
+        print_matrix(matrix)
+        print(f"✓ Saved to {args.matrix}/")
+
+    elif args.command == 'similar':
+        start = time.perf_counter()
+        matrix = UserPageMatrix.load(args.matrix)
+        neighbours = SimilarityIndex(matrix, args.weight).similar(args.user, args.k)
+        elapsed = time.perf_counter() - start
+        print(f"Users most similar to {args.user} (cosine of log-damped {args.weight}):")
+        print(neighbours.to_string(index=False))
+        print(f"\n(loaded and searched {matrix.shape[0]:,} users in {elapsed * 1000:.1f} ms)")
+
+    elif args.command == 'clusters':
+        matrix = UserPageMatrix.load(args.matrix)
+        labels, _ = spherical_kmeans(similarity_vectors(matrix, args.weight), args.clusters, seed=args.seed)
+        with pd.option_context('display.max_colwidth', 120, 'display.width', 200):
+            print(cluster_summary(matrix, labels).to_string(index=False))
+
+    else:
+        matrix, events = build_from_exports(args.page_views, args.dictionary)
+        pairs = naive_user_pages(events)
+        dense = matrix.to_dense()
+        rows = [matrix.user_code(user) for user in pairs.index.get_level_values('UserId')]
+        columns = pd.Index([page['Page'] for page in matrix.pages]).get_indexer(pairs.index.get_level_values('Page'))
+        print(f"Matrix matches groupby reference: "
+              f"{matrix.nnz == len(pairs) and np.array_equal(dense[rows, columns], pairs['Views'].to_numpy())} "
+              f"(views), {np.allclose(matrix.to_dense('dwell')[rows, columns], pairs['Dwell'])} (dwell)")
+        index = SimilarityIndex(matrix)
+        neighbours, similarities = index.all_similar(DEFAULT_K)
+        matches = all(np.allclose(similarities[matrix.user_code(user)], naive_similar(pairs, user), atol=1e-5)
+                      for user in matrix.user_ids)
+        print(f"Top-{DEFAULT_K} similarities match per-user loop for all {matrix.shape[0]} users: {matches}")
+
+        start = time.perf_counter()
+        matrix, events = build_from_exports(args.page_views, args.dictionary, scale=args.scale)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        matrix = UserPageMatrix.from_events(events)
+        matrix_seconds = time.perf_counter() - start
+        print(f"\n{len(events):,} events (export x {args.scale}):")
+        print_matrix(matrix)
+        print(f"  Matrix: {matrix_seconds:.2f}s (clean + sessionize + enrich: {build_seconds - matrix_seconds:.2f}s)")
+        index = SimilarityIndex(matrix)
+        start = time.perf_counter()
+        for user in matrix.user_ids[:100]:
+            index.similar(user)
+        print(f"  One user's top-{DEFAULT_K}: {(time.perf_counter() - start) * 10:.2f} ms")
+        start = time.perf_counter()
+        index.all_similar(DEFAULT_K)
+        print(f"  Top-{DEFAULT_K} for every user: {time.perf_counter() - start:.2f}s")
+        pairs = naive_user_pages(events)
+        start = time.perf_counter()
+        naive_similar(pairs, matrix.user_ids[0])
+        print(f"  Per-user loop for one user: {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -2,15 +2,21 @@
 Parse the config.js file to extract the complete course structure
 """
 
+import argparse
 import re
 import pandas as pd
 import json
 
-def parse_config_js():
-    """Parse config.js to extract course structure"""
+CONFIG_FILE = 'config.js'
+COURSE_STRUCTURE_FILE = 'course_structure_complete.csv'
+DICTIONARY_COLUMNS = ['Page_ID', 'Title', 'Section', 'Lesson', 'Content_Type', 'Is_First_Page', 'Is_Last_Page']
 
-    with open('config.js', 'r') as f:
-        content = f.read()
+def parse_config_js(config_path=CONFIG_FILE, verbose=True, content=None):
+    """Parse config.js to extract course structure (content= parses text already read)"""
+
+    if content is None:
+        with open(config_path, 'r') as f:
+            content = f.read()
 
     # Extract all lesson.push lines
     lesson_pattern = r'lesson\.push\(\{\s*menuEntryData:\s*\[(.*?)\]\s*\}\);'
@@ -19,9 +25,10 @@ def parse_config_js():
     lessons = []
     page_counter = 1  # Start from page 1
 
-    print("=" * 80)
-    print("PARSING CONFIG.JS - COMPLETE COURSE STRUCTURE")
-    print("=" * 80)
+    if verbose:
+        print("=" * 80)
+        print("PARSING CONFIG.JS - COMPLETE COURSE STRUCTURE")
+        print("=" * 80)
 
     for i, match in enumerate(matches, 1):
         # Clean up the match
@@ -80,13 +87,14 @@ def parse_config_js():
         else:
             section_num = None
 
-        print(f"\nEntry {i}:")
-        print(f"  Title: {title}")
-        print(f"  Page count: {page_count}")
-        print(f"  Page numbers in array: {page_numbers}")
-        print(f"  Lesson URL: {lesson_url}")
-        print(f"  Section: {section_num}, Lesson: {lesson_in_title.group(1) if lesson_in_title else 'N/A'}")
-        print(f"  Maps to pages: {page_counter} to {page_counter + page_count - 1}")
+        if verbose:
+            print(f"\nEntry {i}:")
+            print(f"  Title: {title}")
+            print(f"  Page count: {page_count}")
+            print(f"  Page numbers in array: {page_numbers}")
+            print(f"  Lesson URL: {lesson_url}")
+            print(f"  Section: {section_num}, Lesson: {lesson_in_title.group(1) if lesson_in_title else 'N/A'}")
+            print(f"  Maps to pages: {page_counter} to {page_counter + page_count - 1}")
 
         # Create entries for each page in this section
         for j in range(page_count):
@@ -136,6 +144,12 @@ def parse_config_js():
 
     return pd.DataFrame(lessons)
 
+def build_data_dictionary(structure):
+    """Derive a data dictionary (one row per page ID) from a parsed course structure"""
+
+    dictionary = structure[DICTIONARY_COLUMNS].astype({'Page_ID': str})
+    return dictionary.drop_duplicates('Page_ID', keep='first').reset_index(drop=True)
+
 def determine_content_type(title, page_num, total_pages):
     """Determine content type based on title and position"""
 
@@ -171,8 +185,13 @@ def determine_content_type(title, page_num, total_pages):
             return 'Educational Content'
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the course structure from a config.js file')
+    parser.add_argument('--config', default=CONFIG_FILE)
+    parser.add_argument('--output', default=COURSE_STRUCTURE_FILE)
+    args = parser.parse_args()
+
     # Parse the config file
-    df = parse_config_js()
+    df = parse_config_js(args.config)
 
     print("\n" + "=" * 80)
     print("PARSING COMPLETE - SUMMARY")
@@ -197,8 +216,8 @@ if __name__ == "__main__":
     print(df['Content_Type'].value_counts())
 
     # Save the complete mapping
-    df.to_csv('course_structure_complete.csv', index=False)
-    print(f"\nComplete course structure saved to: course_structure_complete.csv")
+    df.to_csv(args.output, index=False)
+    print(f"\nComplete course structure saved to: {args.output}")
 
     # Verify coverage
     print("\n" + "=" * 80)
@@ -0,0 +1,274 @@
+"""
+Performance regression harness
+Runs the full pipeline on the reference exports and on fixed-seed synthetic exports,
+checks the golden outputs, and compares each phase's wall time and peak memory with
+stored baselines. Every run is appended to a history file. Exits non-zero on a
+numeric or performance regression.
+
+  python perf_regression.py --update-baseline   # record baselines on a known-good tree
+  python perf_regression.py                     # check against them
+"""
+
+import argparse
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from batch_studies import DICTIONARY_FILE, PIPELINE_SCRIPT
+from parse_config import COURSE_STRUCTURE_FILE
+
+BASELINE_FILE = 'perf_baselines.json'
+HISTORY_FILE = 'perf_history.csv'
+WORK_DIR = 'perf_runs'
+REFERENCE_DATASET = 'reference'
+SYNTHETIC_ROWS = [50_000]
+SYNTHETIC_SEED = 0
+
+# Published results for the reference exports (see REPRODUCIBILITY_GUIDE.md)
+REFERENCE_OUTPUTS = {
+    'users': 62, 'page_views': 13253, 'sessions': 464, 'avg_completion_rate': 44.0,
+    'top_user': '1160', 'top_user_hours': 21.79
+}
+
+TIME_TOLERANCE = 0.25      # relative slowdown allowed per phase
+MIN_SLOWDOWN_SECONDS = 0.25  # slowdowns smaller than this are timer noise
+MEMORY_TOLERANCE = 0.15    # relative growth of peak RSS allowed per phase
+MIN_GROWTH_MB = 25.0
+
+
+def synthetic_page_views(rows, seed=SYNTHETIC_SEED, pages=range(1, 192)):
+    """Page_Views-shaped export with realistic sessions (placeholder row included)"""
+
+    rng = np.random.default_rng(seed)
+    users = np.sort(rng.integers(1000, 1000 + max(rows // 200, 1), rows))
+    # Seconds between views: mostly short reads, some long pauses and return visits
+    gaps = rng.exponential(45, rows)
+    breaks = rng.random(rows) < 0.03
+    gaps[breaks] = rng.uniform(1800, 30 * 86400, breaks.sum())
+    first = np.r_[True, users[1:] != users[:-1]]
+    starts = rng.integers(0, 3 * 365 * 86400, rows)
+    offsets = pd.Series(np.where(first, starts, gaps)).groupby(users).cumsum().to_numpy()
+    stamps = pd.Timestamp('2021-01-01') + pd.to_timedelta(np.round(offsets, 6), unit='s')
+
+    page_ids = np.asarray(list(pages), dtype=object)
+    page = np.where(rng.random(rows) < 0.09, 'menu', page_ids[rng.integers(0, len(page_ids), rows)])
+    placeholder = pd.DataFrame({'UserId': ['UserName'], 'Page': ['Page'], 'Date / Time': ['0000-00-00 00:00:00.000000']})
+    return pd.concat([placeholder, pd.DataFrame({
+        'UserId': users.astype(object), 'Page': page.astype(object),
+        'Date / Time': stamps.strftime('%Y-%m-%d %H:%M:%S.%f')
+    })], ignore_index=True)
+
+
+def prepare_synthetic(reference_dir, work_dir, rows, seed=SYNTHETIC_SEED):
+    """Write a synthetic data directory once (same seed, same files); returns its path"""
+
+    data_dir = os.path.join(work_dir, f"synthetic-{rows}-seed{seed}", 'data')
+    if os.path.exists(os.path.join(data_dir, 'Page_Views.xlsx')):
+        return data_dir
+    os.makedirs(data_dir, exist_ok=True)
+    for name in (DICTIONARY_FILE, COURSE_STRUCTURE_FILE):
+        shutil.copy(os.path.join(reference_dir, name), data_dir)
+
+    page_ids = pd.read_csv(os.path.join(data_dir, DICTIONARY_FILE))['Page_ID']
+    page_views = synthetic_page_views(rows, seed, pd.to_numeric(page_ids, errors='coerce').dropna().astype(int))
+    page_views.to_excel(os.path.join(data_dir, 'Page_Views.xlsx'), index=False, engine='xlsxwriter')
+    pd.DataFrame({'UserId': ['UserName'], 'Date / Time': ['0000-00-00 00:00:00.000000'],
+                  'Session Length': ['SessionLength'], 'User Agent': ['UserAgent']}
+                 ).to_excel(os.path.join(data_dir, 'Login_History.xlsx'), index=False, engine='xlsxwriter')
+    return data_dir
+
+
+def profile_pipeline(data_dir, output_dir):
+    """Run the pipeline once in this process; returns per-phase timings/peaks and key outputs"""
+
+    os.makedirs(output_dir, exist_ok=True)
+    sys.argv = [PIPELINE_SCRIPT, '--data-dir', data_dir, '--output-dir', output_dir]
+    with open(os.path.join(output_dir, 'pipeline.log'), 'w') as log, redirect_stdout(log):
+        results = runpy.run_path(PIPELINE_SCRIPT, run_name='__main__')
+
+    metrics_df = results['metrics_df']
+    top = metrics_df.iloc[0]
+    outputs = {
+        'users': len(metrics_df),
+        'page_views': int(results['total_page_views']),
+        'sessions': int(results['df_enriched']['SessionId'].nunique()),
+        'avg_completion_rate': round(float(metrics_df['Completion_Rate'].mean()), 1),
+        'top_user': str(top['Invite_Code']),
+        'top_user_hours': float(top['Total_Time_Hours']),
+        'total_hours': round(float(metrics_df['Total_Time_Hours'].sum()), 2)
+    }
+    phases = {phase: {'seconds': seconds, 'peak_mb': peak} for phase, peak, seconds in results['memory'].phases}
+    return {'outputs': outputs, 'phases': phases}
+
+
+def run_dataset(data_dir, output_dir, repeat):
+    """Profile a dataset `repeat` times, each in a fresh process; medians per phase"""
+
+    runs = []
+    for _ in range(repeat):
+        # A fresh process per run: the pipeline keeps module-level state, and peak RSS must not carry over
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            runs.append(pool.submit(profile_pipeline, data_dir, output_dir).result())
+
+    phases = {
+        phase: {key: float(np.median([run['phases'][phase][key] for run in runs])) for key in ('seconds', 'peak_mb')}
+        for phase in runs[0]['phases']
+    }
+    return {'outputs': runs[0]['outputs'], 'phases': phases, 'consistent': all(r['outputs'] == runs[0]['outputs'] for r in runs)}
+
+
+def check_outputs(outputs, expected):
+    """Names of outputs that differ from the expected values"""
+
+    failed = []
+    for name, value in expected.items():
+        actual = outputs.get(name)
+        if isinstance(value, float):
+            if actual is None or not np.isclose(actual, value, rtol=0, atol=1e-9):
+                failed.append(name)
+        elif actual != value:
+            failed.append(name)
+    return failed
+
+
+def compare_phases(phases, baseline, tolerances):
+    """Per-phase rows with baseline values and a status: ok, SLOWER, MORE MEMORY, new"""
+
+    rows = []
+    for phase, current in phases.items():
+        base = baseline.get(phase)
+        status = []
+        if base is None:
+            status.append('new')
+        else:
+            slowdown = current['seconds'] - base['seconds']
+            if slowdown > tolerances['min_seconds'] and current['seconds'] > base['seconds'] * (1 + tolerances['time']):
+                status.append('SLOWER')
+            growth = current['peak_mb'] - base['peak_mb']
+            if growth > tolerances['min_mb'] and current['peak_mb'] > base['peak_mb'] * (1 + tolerances['memory']):
+                status.append('MORE MEMORY')
+        rows.append({
+            'phase': phase, 'seconds': round(current['seconds'], 3), 'peak_mb': round(current['peak_mb'], 1),
+            'baseline_seconds': None if base is None else round(base['seconds'], 3),
+            'baseline_peak_mb': None if base is None else round(base['peak_mb'], 1),
+            'status': ', '.join(status) or 'ok'
+        })
+    return pd.DataFrame(rows)
+
+
+def current_commit():
+    """Short git commit of the working tree, or '' outside a repository"""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(PIPELINE_SCRIPT)).stdout.strip()
+    except OSError:
+        return ''
+
+
+def append_history(path, dataset, comparison, outputs_ok, commit):
+    """Append one row per phase (and one for the outputs check) to the history CSV"""
+
+    history = comparison.copy()
+    history.loc[len(history)] = {'phase': 'golden outputs', 'status': 'ok' if outputs_ok else 'MISMATCH'}
+    history.insert(0, 'dataset', dataset)
+    history.insert(0, 'commit', commit)
+    history.insert(0, 'run_at', datetime.now().isoformat(timespec='seconds'))
+    history.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check pipeline outputs and per-phase performance against baselines')
+    parser.add_argument('--data-dir', default='.', help='directory with the reference exports')
+    parser.add_argument('--work-dir', default=WORK_DIR, help='synthetic datasets and pipeline outputs')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--synthetic-rows', type=int, nargs='*', default=SYNTHETIC_ROWS,
+                        help='sizes of the synthetic exports (none to skip)')
+    parser.add_argument('--seed', type=int, default=SYNTHETIC_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per dataset (medians are compared)')
+    parser.add_argument('--time-tolerance', type=float, default=TIME_TOLERANCE)
+    parser.add_argument('--min-slowdown-seconds', type=float, default=MIN_SLOWDOWN_SECONDS)
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument('--min-growth-mb', type=float, default=MIN_GROWTH_MB)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the new baseline (golden outputs are still checked)')
+    args = parser.parse_args()
+
+    tolerances = {'time': args.time_tolerance, 'min_seconds': args.min_slowdown_seconds,
+                  'memory': args.memory_tolerance, 'min_mb': args.min_growth_mb}
+    # Baselines are machine-specific and not versioned; a fresh checkout records them first
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    elif not args.update_baseline:
+        parser.error(f'no baselines in {args.baseline}; run with --update-baseline on a known-good tree first')
+
+    print("=" * 80)
+    print("PERFORMANCE REGRESSION CHECK")
+    print("=" * 80)
+    print(f"Tolerances: time +{args.time_tolerance:.0%} (and >{args.min_slowdown_seconds}s), "
+          f"memory +{args.memory_tolerance:.0%} (and >{args.min_growth_mb:.0f} MB); {args.repeat} run(s) per dataset")
+
+    datasets = {REFERENCE_DATASET: os.path.abspath(args.data_dir)}
+    for rows in args.synthetic_rows:
+        data_dir = prepare_synthetic(args.data_dir, args.work_dir, rows, args.seed)
+        datasets[f"synthetic-{rows}-seed{args.seed}"] = os.path.abspath(data_dir)
+
+    commit = current_commit()
+    regressions = []
+    for name, data_dir in datasets.items():
+        print(f"\n{name}")
+        print("-" * 40)
+        result = run_dataset(data_dir, os.path.abspath(os.path.join(args.work_dir, name, 'output')), args.repeat)
+        baseline = baselines.get(name, {})
+
+        # Golden outputs: published values for the reference exports, recorded values for synthetic ones
+        expected = REFERENCE_OUTPUTS if name == REFERENCE_DATASET else baseline.get('outputs', {})
+        mismatched = check_outputs(result['outputs'], expected)
+        if not result['consistent']:
+            mismatched.append('repeat runs disagree')
+        outputs_ok = not mismatched
+        for key, value in result['outputs'].items():
+            flag = ' ✗' if key in mismatched else ''
+            print(f"  {key:<22} {value}{'' if key not in expected else f' (expected {expected[key]})'}{flag}")
+        if not expected:
+            print("  (no recorded outputs yet)")
+
+        comparison = compare_phases(result['phases'], baseline.get('phases', {}), tolerances)
+        print()
+        print(comparison.to_string(index=False))
+        append_history(args.history, name, comparison, outputs_ok, commit)
+
+        if not outputs_ok:
+            regressions.append(f"{name}: outputs differ ({', '.join(mismatched)})")
+        if not args.update_baseline:
+            slow = comparison[~comparison['status'].isin(['ok', 'new'])]
+            regressions += [f"{name}: {row.phase} {row.status}" for row in slow.itertuples()]
+
+        if args.update_baseline and outputs_ok:
+            baselines[name] = {'outputs': result['outputs'], 'phases': result['phases'],
+                               'commit': commit, 'recorded_at': datetime.now().isoformat(timespec='seconds')}
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"\n✓ Baselines saved to: {args.baseline}")
+    print(f"✓ History appended to: {args.history}")
+
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  - {regression}")
+        raise SystemExit(1)
+    print("\n✓ No regressions")
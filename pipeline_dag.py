@@ -0,0 +1,512 @@
+"""
+Staged runner for the engagement pipeline with content-addressed caching
+The phases of process_engagement_data_fixed.py are declared as a DAG of stages:
+
+    parse-config -> ingest -> clean -> sessionize -> enrich -> metrics -> export -> synthesis -> verify
+
+Each stage's key is a SHA-256 over its parameters (session timeout, top-N, ...),
+the content of its input files, the source of its code and the keys of the stages
+it depends on. Outputs are pickled under .pipeline_cache/<stage>/<key>.pkl as soon
+as the stage finishes, so a re-run executes only stages whose key changed, and a
+run that failed resumes after the last completed stage. Files a stage writes
+(workbook, synthesis, retention JSON, timeline index, feature and user-page matrices) are kept in the cache entry
+and restored when they are missing or were modified. --dry-run lists what would be
+recomputed and why.
+
+Stages run on the pandas backend (optionally in lean memory mode); the polars
+backend fuses phases 2A-3A into one lazy plan and has no stage boundaries to cache.
+"""
+
+import argparse
+import hashlib
+import inspect
+import io
+import json
+import os
+import pickle
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import pandas as pd
+
+from bootstrap_ci import BOOTSTRAP_REPLICATES, add_summary_intervals, bootstrap_intervals
+from course_progress import load_course_order
+from engagement_metrics import cohort_statistics, summary_statistics, user_metrics_table
+from export_readers import find_export, read_login_history, read_page_views
+from page_similarity import UserPageMatrix
+from parse_config import CONFIG_FILE, COURSE_STRUCTURE_FILE, parse_config_js
+from pipeline_backends import finish_page_stats, get_backend
+from retention import retention_tables, to_compact
+from synthesis_report import aggregate_summary_text, write_synthesis_report
+from timeline_index import TimelineIndex
+from user_features import FeatureMatrix, dictionary_sections
+
+CACHE_DIR = '.pipeline_cache'
+MANIFEST_FILE = 'manifest.json'
+FILE_HASHES = 'file_hashes.json'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+METRICS_FILE = 'CRAFT_PTSD_Engagement_Metrics.xlsx'
+SYNTHESIS_FILE = 'CRAFT_PTSD_Synthesis.txt'
+RETENTION_FILE = 'CRAFT_PTSD_Retention.json'
+TIMELINE_INDEX_DIR = 'CRAFT_PTSD_Timeline_Index'
+FEATURES_DIR = 'CRAFT_PTSD_Features'
+USER_PAGES_DIR = 'CRAFT_PTSD_User_Pages'
+
+# name: upstream stages, input-file config keys, parameter config keys, repo modules the stage runs
+Stage = namedtuple('Stage', ['name', 'inputs', 'files', 'params', 'code', 'run'])
+
+
+# =====================================================================
+# STAGES: each takes the run configuration and its upstream outputs by stage name
+# and returns a dict of outputs; '_written' lists files created in the output dir
+# =====================================================================
+
+def run_parse_config(config, upstream):
+    """Course structure from config.js (or the parsed CSV) and the data dictionary"""
+
+    if os.path.exists(config['config_js']):
+        structure = parse_config_js(config['config_js'], verbose=False)
+        structure_csv = structure.to_csv(index=False)
+    else:
+        with open(config['course_structure']) as f:
+            structure_csv = f.read()
+        structure = pd.read_csv(io.StringIO(structure_csv))
+    if not os.path.exists(config['dictionary']):
+        raise FileNotFoundError(f"No data dictionary at {config['dictionary']} (pass --dictionary)")
+    data_dict = pd.read_csv(config['dictionary'])
+    data_dict['Page_ID'] = data_dict['Page_ID'].astype(str)
+    return {'structure_csv': structure_csv, 'data_dict': data_dict}
+
+
+def run_ingest(config, upstream):
+    """Read the page-view and login exports"""
+
+    return {'page_views': read_page_views(config['page_views']),
+            'login_history': read_login_history(config['login_history'])}
+
+
+def run_clean(config, upstream):
+    """Remove placeholder rows, parse timestamps and sort"""
+
+    backend = get_backend('pandas', lean=config['lean'])
+    events = backend.clean(upstream['ingest']['page_views'])
+    return {'events': events, 'timestamps': backend.timestamps}
+
+
+def run_sessionize(config, upstream):
+    """Sessions, dwell times and optional compaction of repeated hits"""
+
+    backend = get_backend('pandas', lean=config['lean'])
+    events = backend.sessionize(upstream['clean']['events'], timedelta(minutes=config['session_timeout_minutes']))
+    if config['compaction_seconds'] is not None:
+        events = backend.compact(events, timedelta(seconds=config['compaction_seconds']))
+    return {'events': events, 'compaction': backend.compaction}
+
+
+def run_enrich(config, upstream):
+    """Dictionary merge and the report tables (users, sections, pages, overview)"""
+
+    backend = get_backend('pandas', lean=config['lean'])
+    data_dict = upstream['parse-config']['data_dict']
+    tables = backend.collect(backend.enrich(upstream['sessionize']['events'], data_dict))
+    return {
+        'df_enriched': tables.events,
+        'users': tables.users.set_index('UserId'),
+        'section_stats': tables.sections,
+        'page_stats': finish_page_stats(tables.planner.table('pages'), data_dict),
+        'overview': tables.planner.table('overview')
+    }
+
+
+def run_metrics(config, upstream):
+    """User metrics, cohort statistics, bootstrap intervals and retention curves"""
+
+    enrich = upstream['enrich']
+    course_order = load_course_order(io.StringIO(upstream['parse-config']['structure_csv']))
+    metrics_df, progression = user_metrics_table(enrich['users'], enrich['df_enriched'], course_order,
+                                                 upstream['parse-config']['data_dict'])
+    user_stats, high_engagement, median_hours = cohort_statistics(metrics_df)
+    intervals = bootstrap_intervals(metrics_df, config['bootstrap_replicates'], config['bootstrap_seed'])
+    overview = enrich['overview']
+    summary_stats = summary_statistics(metrics_df, user_stats, int(overview['Page_Views']), int(overview['Sessions']))
+    retention = retention_tables(enrich['users']['First_Activity'], enrich['users']['Last_Activity'],
+                                 progression['Furthest_Lesson'], study_end=overview['Last_Activity'])
+    return {
+        'metrics_df': metrics_df,
+        'user_stats': user_stats,
+        'high_engagement': high_engagement,
+        'median_hours': median_hours,
+        'intervals': intervals,
+        'summary_stats': add_summary_intervals(summary_stats, intervals),
+        'retention': retention
+    }
+
+
+def run_export(config, upstream):
+    """Metrics workbook, compact retention curves, the timeline index and the feature and user-page matrices"""
+
+    metrics, enrich = upstream['metrics'], upstream['enrich']
+    output_dir = config['output_dir']
+    sheets = {
+        'User_Metrics': metrics['metrics_df'],
+        'Summary_Statistics': metrics['summary_stats'],
+        'Section_Engagement': enrich['section_stats'],
+        'Page_Engagement': enrich['page_stats'],
+        'Retention_Days': metrics['retention']['days'],
+        'Lesson_Survival': metrics['retention']['lessons']
+    }
+    with pd.ExcelWriter(os.path.join(output_dir, METRICS_FILE), engine='xlsxwriter') as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+
+    with open(os.path.join(output_dir, RETENTION_FILE), 'w') as f:
+        json.dump(to_compact(metrics['retention'], enrich['overview']['Last_Activity']), f, separators=(',', ':'))
+
+    index_dir = os.path.join(output_dir, TIMELINE_INDEX_DIR)
+    TimelineIndex.from_events(enrich['df_enriched']).save(index_dir)
+    index_files = [os.path.join(TIMELINE_INDEX_DIR, name) for name in sorted(os.listdir(index_dir))]
+
+    features = FeatureMatrix.from_metrics(metrics['metrics_df'], enrich['df_enriched'],
+                                          dictionary_sections(upstream['parse-config']['data_dict']),
+                                          enrich['overview']['Last_Activity'])
+    features_dir = os.path.join(output_dir, FEATURES_DIR)
+    features.save(features_dir)
+    feature_files = [os.path.join(FEATURES_DIR, name) for name in sorted(os.listdir(features_dir))]
+
+    user_pages_dir = os.path.join(output_dir, USER_PAGES_DIR)
+    UserPageMatrix.from_events(enrich['df_enriched']).save(user_pages_dir)
+    user_page_files = [os.path.join(USER_PAGES_DIR, name) for name in sorted(os.listdir(user_pages_dir))]
+    return {'_written': [METRICS_FILE, RETENTION_FILE, *index_files, *feature_files, *user_page_files]}
+
+
+def run_synthesis(config, upstream):
+    """Aggregate summary and the top-N individual summaries"""
+
+    metrics, enrich = upstream['metrics'], upstream['enrich']
+    text = aggregate_summary_text(metrics['metrics_df'], enrich['overview'], metrics['user_stats'],
+                                  metrics['high_engagement'], metrics['median_hours'], metrics['intervals'],
+                                  enrich['section_stats'])
+    count = write_synthesis_report(os.path.join(config['output_dir'], SYNTHESIS_FILE), text, metrics['metrics_df'],
+                                   top_n=config['top_n'])
+    return {'summaries': count, '_written': [SYNTHESIS_FILE]}
+
+
+def run_verify(config, upstream):
+    """Cross-check the written workbook and synthesis against the metrics; raises on failure"""
+
+    metrics_df = upstream['metrics']['metrics_df']
+    workbook = pd.read_excel(os.path.join(config['output_dir'], METRICS_FILE), sheet_name=None)
+    summary = workbook['Summary_Statistics'].set_index('Metric')['Value']
+    with open(os.path.join(config['output_dir'], SYNTHESIS_FILE)) as f:
+        synthesis = f.read()
+    expected_summaries = len(metrics_df) if config['top_n'] is None else min(config['top_n'], len(metrics_df))
+
+    checks = {
+        'workbook has every sheet': set(workbook) >= {'User_Metrics', 'Summary_Statistics', 'Section_Engagement',
+                                                      'Page_Engagement', 'Retention_Days', 'Lesson_Survival'},
+        'one User_Metrics row per user': len(workbook['User_Metrics']) == summary['Total Users'] == len(metrics_df),
+        'page views add up': metrics_df['Total_Pages_Viewed'].sum() == summary['Total Page Views']
+                             == workbook['Page_Engagement']['Views'].sum(),
+        'sessions add up': metrics_df['Total_Visits'].sum() == summary['Total Sessions'],
+        'intervals contain the values': (workbook['Summary_Statistics']['CI_95_Low'].isna()
+                                         | ((workbook['Summary_Statistics']['CI_95_Low'] <= summary.to_numpy())
+                                            & (summary.to_numpy() <= workbook['Summary_Statistics']['CI_95_High']))).all(),
+        'synthesis has every section': all(heading in synthesis for heading in (
+            'OVERALL PARTICIPATION', 'ENGAGEMENT METRICS', 'COURSE COMPLETION', 'SECTION ENGAGEMENT',
+            'HIGH ENGAGEMENT ANALYSIS', 'KEY INSIGHTS')),
+        'synthesis has the individual summaries': synthesis.count('(Invite Code ') == expected_summaries
+    }
+    failed = [name for name, passed in checks.items() if not passed]
+    if failed:
+        raise AssertionError(f"Verification failed: {', '.join(failed)}")
+    return {'checks': checks}
+
+
+BACKEND_MODULES = ('pipeline_backends.py', 'aggregate_planner.py', 'event_compaction.py', 'timestamps.py')
+
+STAGES = [
+    Stage('parse-config', [], ['config_js', 'course_structure', 'dictionary'], [], ['parse_config.py'],
+          run_parse_config),
+    Stage('ingest', [], ['page_views', 'login_history'], [], ['export_readers.py', 'xlsx_shards.py'], run_ingest),
+    Stage('clean', ['ingest'], [], ['lean'], BACKEND_MODULES, run_clean),
+    Stage('sessionize', ['clean'], [], ['lean', 'session_timeout_minutes', 'compaction_seconds'], BACKEND_MODULES,
+          run_sessionize),
+    Stage('enrich', ['sessionize', 'parse-config'], [], ['lean'], BACKEND_MODULES, run_enrich),
+    Stage('metrics', ['enrich', 'parse-config'], [], ['bootstrap_replicates', 'bootstrap_seed'],
+          ['engagement_metrics.py', 'course_progress.py', 'lesson_bitsets.py', 'aggregate_planner.py',
+           'bootstrap_ci.py', 'retention.py'], run_metrics),
+    Stage('export', ['metrics', 'enrich', 'parse-config'], [], [],
+          ['timeline_index.py', 'retention.py', 'user_features.py', 'page_similarity.py'], run_export),
+    Stage('synthesis', ['metrics', 'enrich'], [], ['top_n'], ['synthesis_report.py', 'bootstrap_ci.py'],
+          run_synthesis),
+    Stage('verify', ['export', 'synthesis', 'metrics'], [], ['top_n'], [], run_verify)
+]
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+
+def _file_hash(path):
+    """SHA-256 of a file's content"""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _digest(value):
+    """SHA-256 of a JSON-serializable value"""
+
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StageCache:
+    """Content-addressed stage outputs, file hashes and the components of each stage's last key"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._file_hashes = self._read_json(FILE_HASHES)
+        self.manifest = self._read_json(MANIFEST_FILE)
+
+    def _read_json(self, name):
+        """A JSON file in the cache directory, or an empty dict"""
+
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_json(self, name, value):
+        """Write a JSON file in the cache directory atomically"""
+
+        path = os.path.join(self.cache_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(value, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def file_hash(self, path):
+        """Content hash of an input file, re-read only when its size or modification time changed"""
+
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self._file_hashes.get(path)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        digest = _file_hash(path)
+        self._file_hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+        self._write_json(FILE_HASHES, self._file_hashes)
+        return digest
+
+    def entry_path(self, stage, key):
+        """Pickle file of a stage's outputs under a key"""
+
+        return os.path.join(self.cache_dir, stage, key + '.pkl')
+
+    def has(self, stage, key):
+        """Whether outputs for this stage and key are cached"""
+
+        return os.path.exists(self.entry_path(stage, key))
+
+    def load(self, stage, key):
+        """Cached outputs of a stage"""
+
+        with open(self.entry_path(stage, key), 'rb') as f:
+            return pickle.load(f)
+
+    def store(self, stage, key, outputs, components):
+        """Write a stage's outputs atomically and remember the components of its key"""
+
+        path = self.entry_path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        self.manifest[stage] = dict(components, key=key)
+        self._write_json(MANIFEST_FILE, self.manifest)
+
+
+def stage_keys(config, cache):
+    """Key and key components of every stage, in DAG order"""
+
+    keys, components = {}, {}
+    for stage in STAGES:
+        parts = {
+            'params': {name: config[name] for name in stage.params},
+            'files': {name: cache.file_hash(config[name]) for name in stage.files},
+            'code': {module: _file_hash(os.path.join(HERE, module)) for module in stage.code},
+            'stage_code': hashlib.sha256(inspect.getsource(stage.run).encode()).hexdigest(),
+            'inputs': {name: keys[name] for name in stage.inputs}
+        }
+        keys[stage.name], components[stage.name] = _digest([stage.name, parts]), parts
+    return keys, components
+
+
+def stale_reason(stage, parts, previous):
+    """Why a stage's key differs from the one it was last cached under"""
+
+    if previous is None:
+        return 'never run'
+    reasons = []
+    for kind in ('params', 'files', 'code', 'inputs'):
+        changed = sorted(name for name in set(parts[kind]) | set(previous.get(kind, {}))
+                         if parts[kind].get(name) != previous.get(kind, {}).get(name))
+        if changed:
+            reasons.append(f"{kind} changed ({', '.join(changed)})")
+    if parts['stage_code'] != previous.get('stage_code'):
+        reasons.append('stage code changed')
+    return '; '.join(reasons) or 'not cached'
+
+
+def required_stages(target):
+    """The target stage and everything it depends on, in DAG order"""
+
+    needed, pending = set(), [target]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES_BY_NAME[name].inputs)
+    return [stage for stage in STAGES if stage.name in needed]
+
+
+def _restore_files(config, written):
+    """Write cached output files that are missing or differ; returns how many were restored"""
+
+    restored = 0
+    for relative, content in written.items():
+        path = os.path.join(config['output_dir'], relative)
+        if os.path.exists(path) and _file_hash(path) == hashlib.sha256(content).hexdigest():
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        restored += 1
+    return restored
+
+
+def run_pipeline(config, cache_dir=CACHE_DIR, until='verify', force=(), dry_run=False):
+    """Run stale stages up to a target; returns (stage, status, seconds) rows"""
+
+    cache = StageCache(cache_dir)
+    keys, components = stage_keys(config, cache)
+    stages = required_stages(until)
+    forced = set(force)
+    stale = {stage.name for stage in stages if stage.name in forced or not cache.has(stage.name, keys[stage.name])}
+
+    if dry_run:
+        return [(stage.name, 'forced' if stage.name in forced else
+                 stale_reason(stage, components[stage.name], cache.manifest.get(stage.name)) if stage.name in stale
+                 else 'cached', keys[stage.name][:12]) for stage in stages]
+
+    outputs, report = {}, []
+
+    def outputs_of(name):
+        """Outputs of an upstream stage, loaded from the cache on first use"""
+
+        if name not in outputs:
+            outputs[name] = cache.load(name, keys[name])['outputs']
+        return outputs[name]
+
+    os.makedirs(config['output_dir'], exist_ok=True)
+    for stage in stages:
+        start = time.perf_counter()
+        if stage.name not in stale:
+            restored = 0
+            if stage.name in ('export', 'synthesis'):
+                restored = _restore_files(config, cache.load(stage.name, keys[stage.name])['written'])
+            report.append((stage.name, 'cached' + (f', {restored} files restored' if restored else ''),
+                           time.perf_counter() - start))
+            continue
+        try:
+            result = stage.run(config, {name: outputs_of(name) for name in stage.inputs})
+        except Exception as e:
+            report.append((stage.name, f"failed: {type(e).__name__}: {e}", time.perf_counter() - start))
+            break
+        written = {relative: open(os.path.join(config['output_dir'], relative), 'rb').read()
+                   for relative in result.pop('_written', [])}
+        cache.store(stage.name, keys[stage.name], {'outputs': result, 'written': written}, components[stage.name])
+        outputs[stage.name] = result
+        report.append((stage.name, 'ran', time.perf_counter() - start))
+    return report
+
+
+def pipeline_config(args):
+    """Run configuration (paths and key parameters) from command-line arguments"""
+
+    data_dir = args.data_dir
+    return {
+        'data_dir': data_dir,
+        'output_dir': args.output_dir or data_dir,
+        'page_views': args.page_views or find_export(data_dir, 'Page_Views'),
+        'login_history': args.login_history or find_export(data_dir, 'Login_History'),
+        'config_js': args.config or os.path.join(data_dir, CONFIG_FILE),
+        'course_structure': args.course_structure or os.path.join(data_dir, COURSE_STRUCTURE_FILE),
+        'dictionary': args.dictionary or os.path.join(data_dir, 'Data_Dictionary_FINAL.csv'),
+        'lean': args.lean,
+        'session_timeout_minutes': args.session_timeout,
+        'compaction_seconds': args.compaction_seconds,
+        'top_n': None if args.top_n == 0 else args.top_n,
+        'bootstrap_replicates': args.bootstrap_replicates,
+        'bootstrap_seed': args.bootstrap_seed
+    }
+
+
+def run_stages(config, until='verify'):
+    """Run the stages up to a target in this process, without the cache; returns outputs by stage name"""
+
+    outputs = {}
+    os.makedirs(config['output_dir'], exist_ok=True)
+    for stage in required_stages(until):
+        outputs[stage.name] = stage.run(config, {name: outputs[name] for name in stage.inputs})
+    return outputs
+
+
+def build_parser():
+    """Command-line options of the staged runner (also used to build configurations with its defaults)"""
+
+    parser = argparse.ArgumentParser(description='Run the engagement pipeline as cached stages')
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--page-views', default=None)
+    parser.add_argument('--login-history', default=None)
+    parser.add_argument('--config', default=None, help='config.js (default: config.js in the data directory)')
+    parser.add_argument('--course-structure', default=None, help='parsed structure CSV, used when there is no config.js')
+    parser.add_argument('--dictionary', default=None)
+    parser.add_argument('--session-timeout', type=float, default=30, help='minutes')
+    parser.add_argument('--compaction-seconds', type=float, default=None)
+    parser.add_argument('--lean', action='store_true', help='lean memory mode')
+    parser.add_argument('--top-n', type=int, default=20, help='individual summaries (0 = every user)')
+    parser.add_argument('--bootstrap-replicates', type=int, default=BOOTSTRAP_REPLICATES)
+    parser.add_argument('--bootstrap-seed', type=int, default=0)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--until', default='verify', choices=list(STAGES_BY_NAME), help='last stage to run')
+    parser.add_argument('--force', nargs='+', default=[], choices=list(STAGES_BY_NAME), metavar='STAGE',
+                        help='re-run these stages even when cached')
+    parser.add_argument('--dry-run', action='store_true', help='show which stages would run, and why')
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+
+    config = pipeline_config(args)
+    report = run_pipeline(config, args.cache_dir, args.until, args.force, args.dry_run)
+
+    print("=" * 80)
+    print(f"PIPELINE STAGES{' (DRY RUN)' if args.dry_run else ''}")
+    print("=" * 80)
+    if args.dry_run:
+        for name, status, key in report:
+            print(f"  {name:<14} {key}  {'would run: ' + status if status != 'cached' else 'cached'}")
+    else:
+        for name, status, seconds in report:
+            print(f"  {name:<14} {seconds:>7.2f}s  {status}")
+        if report[-1][1].startswith('failed'):
+            print("\nStages before the failure are cached; re-run to resume from the failed stage.")
+            raise SystemExit(1)
@@ -0,0 +1,221 @@
+"""
+Stratified user sampling for quick preview runs of the pipeline
+Users are grouped into activity strata (quantiles of their page-view counts in the
+export) and a fixed fraction of each stratum is drawn at random. Whole users are
+kept, so sessionization and dwell times are exactly those of a full run for the
+sampled users, and the pipeline runs on the sample only.
+
+Summary_Statistics and Section_Engagement values are then estimated for the whole
+export with the stratified (expansion) estimators: a total is the sum over strata
+of N_h times the stratum's sample mean, an average is that total over N, and the
+variance is sum N_h^2 (1 - n_h / N_h) s_h^2 / n_h. Intervals are 95% t intervals
+with n - H degrees of freedom (n sampled users in H sampled strata), which matters
+at preview sizes of a dozen or so users. Every stratum keeps at least two sampled
+users so its variance can be estimated. Page engagement and retention tables are
+not estimated; the preview workbook writes them for the sampled users only, with
+SAMPLE_SHEET_SUFFIX on their sheet names.
+
+Page-view counts are heavily skewed (a single participant can account for a fifth
+of all views), so far-out users, above Q3 + 3 IQR, form a take-all stratum that
+is always included. Otherwise whether the sample happens to contain them would
+dominate every total.
+"""
+
+import argparse
+import math
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from engagement_metrics import summary_value
+
+PREVIEW_STRATA = 4
+MIN_PER_STRATUM = 2
+TAKE_ALL_IQR = 3.0  # users this many IQRs above Q3 are always sampled
+SAMPLE_SHEET_SUFFIX = '_Sample'  # preview sheets computed from the sampled users only, not estimated
+Z_95 = 1.959963984540054
+# Two-sided 95% Student t critical values by degrees of freedom (normal beyond 30)
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+SampleDesign = namedtuple('SampleDesign', ['users', 'sampled', 'fraction', 'seed'])
+
+# Summary_Statistics metrics: (name, per-user column or indicator, estimator, decimals)
+SUMMARY_ESTIMATES = [
+    ('Total Page Views', 'Total_Pages_Viewed', 'total', 0),
+    ('Total Sessions', 'Total_Visits', 'total', 0),
+    ('Average Time per User (hours)', 'Total_Time_Hours', 'mean', 2),
+    ('Average Visits per User', 'Total_Visits', 'mean', 1),
+    ('Average Pages per User', 'Total_Pages_Viewed', 'mean', 1),
+    ('Average Completion Rate (%)', 'Completion_Rate', 'mean', 1),
+    ('Users Who Completed All Lessons', 'Completed_All', 'total', 0),
+    ('Users Who Started But Didn\'t Complete', 'Started_Not_Completed', 'total', 0)
+]
+
+
+def activity_strata(page_views, strata=PREVIEW_STRATA):
+    """Users of an export with their page-view count, activity stratum (0 = least active)
+    and whether they are in the take-all stratum (the last one)"""
+
+    real = page_views.loc[page_views['UserId'] != 'UserName', 'UserId']
+    activity = real.value_counts(sort=False).rename('Page_Views').rename_axis('UserId').reset_index()
+    q1, q3 = activity['Page_Views'].quantile([0.25, 0.75])
+    activity['Take_All'] = activity['Page_Views'] > q3 + TAKE_ALL_IQR * (q3 - q1)
+
+    sampled = ~activity['Take_All']
+    strata = max(min(strata, int(sampled.sum()) // MIN_PER_STRATUM), 1)
+    # Ranks break ties so every quantile bin is non-empty
+    activity.loc[sampled, 'Stratum'] = pd.qcut(
+        activity.loc[sampled, 'Page_Views'].rank(method='first'), strata, labels=False
+    )
+    activity.loc[~sampled, 'Stratum'] = strata
+    activity['Stratum'] = activity['Stratum'].astype(int)
+    return activity
+
+
+def sample_users(page_views, fraction, seed=0, strata=PREVIEW_STRATA):
+    """Draw the same fraction of users from every activity stratum"""
+
+    if not 0 < fraction <= 1:
+        raise ValueError(f"Preview fraction must be in (0, 1], got {fraction}")
+    users = activity_strata(page_views, strata)
+    rng = np.random.default_rng(seed)
+    chosen = []
+    for _, members in users.groupby('Stratum'):
+        size = len(members) if members['Take_All'].all() else \
+            min(max(math.ceil(fraction * len(members)), MIN_PER_STRATUM), len(members))
+        chosen.append(members.index[rng.choice(len(members), size, replace=False)])
+    users['Sampled'] = users.index.isin(np.concatenate(chosen))
+    return SampleDesign(users, users.loc[users['Sampled'], 'UserId'].tolist(), fraction, seed)
+
+
+def critical_value(design):
+    """95% t critical value for the sampled (not take-all) users of a design"""
+
+    sampled = design.users[design.users['Sampled'] & ~design.users['Take_All']]
+    dof = len(sampled) - sampled['Stratum'].nunique()
+    return T_95[dof - 1] if 0 < dof <= len(T_95) else Z_95
+
+
+def stratified_estimate(design, values, estimator='total'):
+    """Estimate, standard error and 95% interval of a population total or mean
+
+    values: per-user values indexed by UserId for the sampled users (missing = 0)
+    """
+
+    users = design.users
+    sampled = users[users['Sampled']]
+    y = values.reindex(sampled['UserId']).fillna(0).to_numpy(dtype=np.float64)
+    strata = sampled['Stratum'].to_numpy()
+    population = users['Stratum'].value_counts().sort_index()
+
+    total, variance = 0.0, 0.0
+    for stratum, size in population.items():
+        y_h = y[strata == stratum]
+        total += size * y_h.mean()
+        if len(y_h) > 1:
+            variance += size ** 2 * (1 - len(y_h) / size) * y_h.var(ddof=1) / len(y_h)
+    scale = 1 / len(users) if estimator == 'mean' else 1
+    estimate, error = total * scale, math.sqrt(variance) * scale
+    margin = critical_value(design) * error
+    return estimate, error, estimate - margin, estimate + margin
+
+
+def preview_summary_statistics(design, metrics_df):
+    """Summary_Statistics estimated for all users, with 95% intervals"""
+
+    per_user = metrics_df.set_index('Invite_Code')
+    per_user = per_user.assign(
+        Completed_All=(per_user['Completion_Rate'] == 100).astype(float),
+        Started_Not_Completed=((per_user['Lessons_Started'] > 0) & (per_user['Completion_Rate'] < 100)).astype(float)
+    )
+    rows = [{'Metric': 'Total Users', 'Value': len(design.users), 'CI_95_Low': len(design.users),
+             'CI_95_High': len(design.users), 'Std_Error': 0.0}]
+    for metric, column, estimator, decimals in SUMMARY_ESTIMATES:
+        estimate, error, low, high = stratified_estimate(design, per_user[column], estimator)
+        rows.append({'Metric': metric, 'Value': summary_value(estimate, decimals), 'CI_95_Low': summary_value(max(low, 0), decimals),
+                     'CI_95_High': summary_value(high, decimals), 'Std_Error': round(error, 4)})
+    return pd.DataFrame(rows)
+
+
+def preview_section_stats(design, df_enriched):
+    """Section_Engagement estimated for all users, with 95% intervals, ranked by hours"""
+
+    in_section = df_enriched[df_enriched['Section'].notna()]
+    views = in_section['Hits'] if 'Hits' in in_section else pd.Series(1, index=in_section.index)
+    per_user = pd.DataFrame({
+        'Section': in_section['Section'].astype(str).to_numpy(),
+        'UserId': in_section['UserId'].to_numpy(),
+        'Hours': in_section['DwellTimeSeconds'].to_numpy(dtype=np.float64) / 3600,
+        'Views': views.to_numpy()
+    }).groupby(['Section', 'UserId'], sort=True).sum()
+
+    rows = []
+    for section, values in per_user.groupby(level='Section'):
+        values = values.droplevel('Section')
+        row = {'Section': section}
+        for name, series, decimals in (('Unique_Users', pd.Series(1.0, index=values.index), 0),
+                                       ('Total_Time_Hours', values['Hours'], 2),
+                                       ('Total_Views', values['Views'], 0)):
+            estimate, _, low, high = stratified_estimate(design, series, 'total')
+            row[name] = summary_value(estimate, decimals)
+            row[f'{name}_CI_95_Low'] = summary_value(max(low, 0), decimals)
+            row[f'{name}_CI_95_High'] = summary_value(high, decimals)
+        rows.append(row)
+    return pd.DataFrame(rows).sort_values('Total_Time_Hours', ascending=False).reset_index(drop=True)
+
+
+def print_design(design):
+    """Sampled and total users per activity stratum"""
+
+    users = design.users
+    print(f"Preview: {len(design.sampled)} of {len(users)} users sampled "
+          f"({design.fraction:.0%} per activity stratum, seed {design.seed})")
+    for stratum, members in users.groupby('Stratum'):
+        print(f"  Stratum {stratum + 1}: {members['Page_Views'].min():,}-{members['Page_Views'].max():,} page views, "
+              f"{int(members['Sampled'].sum())}/{len(members)} users{' (take-all)' if members['Take_All'].all() else ''}")
+
+
+if __name__ == "__main__":
+    import os
+    import runpy
+    import sys
+    import time
+    from contextlib import redirect_stdout
+    from batch_studies import PIPELINE_SCRIPT
+
+    parser = argparse.ArgumentParser(description='Check preview intervals against a full run')
+    parser.add_argument('--data-dir', default='.')
+    parser.add_argument('--fraction', type=float, default=0.25)
+    parser.add_argument('--seeds', type=int, default=20, help='preview runs with different samples')
+    parser.add_argument('--work-dir', default='preview_check')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("PREVIEW INTERVAL CHECK")
+    print("=" * 80)
+
+    def run(*options):
+        """Run the pipeline quietly and return its globals and wall time"""
+
+        sys.argv = [PIPELINE_SCRIPT, '--data-dir', args.data_dir, '--output-dir', args.work_dir, *options]
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results = runpy.run_path(PIPELINE_SCRIPT, run_name='__main__')
+        return results, time.perf_counter() - start
+
+    full, full_seconds = run()
+    truth = dict(zip(full['summary_stats']['Metric'], full['summary_stats']['Value']))
+    covered, timings = pd.Series(0, index=list(truth)), []
+    for seed in range(args.seeds):
+        preview, seconds = run('--preview', str(args.fraction), '--preview-seed', str(seed))
+        timings.append(seconds)
+        for row in preview['summary_stats'].itertuples():
+            covered[row.Metric] += row.CI_95_Low <= truth[row.Metric] <= row.CI_95_High
+
+    print(f"Full run: {full_seconds:.2f}s; preview ({args.fraction:.0%}): median {np.median(timings):.2f}s\n")
+    print(f"Coverage of the full-run value by the 95% interval over {args.seeds} samples:")
+    for metric, hits in covered.items():
+        print(f"  {metric:<42} {truth[metric]:>10,} {hits:>4}/{args.seeds}")
@@ -3,17 +3,91 @@ VA CRAFT PTSD Engagement Data Processing and Analysis
 Phases 2-4: Complete data processing, sessionization, metrics calculation, and reporting
 """
 
+import argparse
+import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import warnings
+from bootstrap_ci import BOOTSTRAP_REPLICATES, add_summary_intervals, bootstrap_intervals
+from course_progress import load_course_order
+from engagement_metrics import cohort_statistics, summary_statistics, user_metrics_table
+from event_compaction import print_compaction_report
+from export_readers import find_export, read_login_history, read_page_views
+from memory_profile import PhaseMemory
+from page_similarity import UserPageMatrix, print_matrix
+from pipeline_backends import finish_page_stats, get_backend
+from preview_sampling import (SAMPLE_SHEET_SUFFIX, preview_section_stats, preview_summary_statistics,
+                              print_design, sample_users)
+from retention import print_retention, retention_tables, save_compact
+from sketches import EngagementSketches
+from synthesis_report import aggregate_summary_text, write_synthesis_report
+from timeline_index import TimelineIndex
+from timestamps import print_rejections
+from user_features import FeatureMatrix, dictionary_sections, print_features
 warnings.filterwarnings('ignore')
 
+parser = argparse.ArgumentParser(description='Process page-view exports into engagement metrics and summaries')
+parser.add_argument('--data-dir', default='.', help='directory with Page_Views.xlsx, Login_History.xlsx and the data dictionary')
+parser.add_argument('--page-views', default=None,
+                    help='page-view export, .xlsx, .csv or .jsonl (default: Page_Views.* in the data directory)')
+parser.add_argument('--login-history', default=None,
+                    help='login export, .xlsx, .csv or .jsonl (default: Login_History.* in the data directory)')
+parser.add_argument('--output-dir', default=None, help='directory for generated files (default: the data directory)')
+parser.add_argument('--dictionary', default=None, help='data dictionary CSV (default: Data_Dictionary_FINAL.csv in the data directory)')
+parser.add_argument('--course-structure', default=None,
+                    help='parsed course structure CSV (default: course_structure_complete.csv in the data directory)')
+parser.add_argument('--preview', type=float, default=None, metavar='FRACTION',
+                    help='quick estimate from this fraction of users per activity stratum, with 95%% intervals')
+parser.add_argument('--preview-seed', type=int, default=0, help='random seed for the preview sample')
+parser.add_argument('--archive', default=None,
+                    help='read cleaned, sessionized events from this archive (python event_archive.py build)')
+parser.add_argument('--since', default=None, help='with --archive: sessions starting on or after this date')
+parser.add_argument('--until', default=None, help='with --archive: sessions starting before this date')
+parser.add_argument('--users', default=None, help='with --archive: comma-separated user IDs')
+args = parser.parse_args()
+ARCHIVE_FILTERS = [value for value in (args.since, args.until, args.users) if value is not None]
+if ARCHIVE_FILTERS and args.archive is None:
+    parser.error('--since, --until and --users need --archive')
+if args.archive and args.preview:
+    parser.error('--preview samples the raw export; it cannot be combined with --archive')
+
+# Input and output locations
+DATA_DIR = args.data_dir
+OUTPUT_DIR = args.output_dir or DATA_DIR
+PAGE_VIEWS_FILE = None if args.archive else args.page_views or find_export(DATA_DIR, 'Page_Views')
+LOGIN_HISTORY_FILE = args.login_history or find_export(DATA_DIR, 'Login_History')
+DICTIONARY_FILE = args.dictionary or os.path.join(DATA_DIR, 'Data_Dictionary_FINAL.csv')
+COURSE_STRUCTURE_FILE = args.course_structure or os.path.join(DATA_DIR, 'course_structure_complete.csv')
+# Preview and subset runs write separate files so they never replace full-run outputs
+OUTPUT_SUFFIX = '_Preview' if args.preview else '_Subset' if ARCHIVE_FILTERS else ''
+METRICS_FILE = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_Engagement_Metrics{OUTPUT_SUFFIX}.xlsx')
+SYNTHESIS_FILE = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_Synthesis{OUTPUT_SUFFIX}.txt')
+TIMELINE_INDEX_DIR = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_Timeline_Index{OUTPUT_SUFFIX}')
+RETENTION_FILE = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_Retention{OUTPUT_SUFFIX}.json')
+FEATURES_DIR = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_Features{OUTPUT_SUFFIX}')
+USER_PAGES_DIR = os.path.join(OUTPUT_DIR, f'CRAFT_PTSD_User_Pages{OUTPUT_SUFFIX}')
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# DataFrame backend for phases 2A-3A: 'pandas' (eager) or 'polars' (lazy, multi-threaded)
+PIPELINE_BACKEND = 'pandas'
+
+# Lean memory mode: no frame copies or scratch columns, float32 dwell seconds,
+# raw sheet released after cleaning
+LEAN_MEMORY = False
+
 print("=" * 80)
 print("VA CRAFT PTSD USER ENGAGEMENT ANALYSIS")
 print("=" * 80)
 print(f"Analysis Start: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
+memory = PhaseMemory()
+if args.archive and PIPELINE_BACKEND != 'pandas':
+    print(f"Archived events are read with the pandas backend (PIPELINE_BACKEND = '{PIPELINE_BACKEND}' ignored)")
+    PIPELINE_BACKEND = 'pandas'
+backend = get_backend(PIPELINE_BACKEND, lean=LEAN_MEMORY)
+print(f"Pipeline backend: {backend.name}{' (lean memory mode)' if LEAN_MEMORY else ''}")
+
 # =====================================================================
 # PHASE 2A: LOAD AND CLEAN DATA
 # =====================================================================
@@ -21,35 +95,52 @@ print("\n" + "=" * 80)
 print("PHASE 2A: LOADING AND CLEANING DATA")
 print("=" * 80)
 
-# Load page views
-print("\nLoading Page_Views.xlsx...")
-page_views = pd.read_excel('Page_Views.xlsx')
-print(f"  Raw records: {len(page_views):,}")
-
-# Remove placeholder rows
-page_views = page_views[page_views['UserId'] != 'UserName']
-page_views = page_views[~page_views['Date / Time'].astype(str).str.startswith('0000')]
-print(f"  After cleaning: {len(page_views):,} records")
+# Session timeout (30 minutes); an archive must have been sessionized with the same
+SESSION_TIMEOUT = timedelta(minutes=30)
 
-# Convert datetime
-page_views['DateTime'] = pd.to_datetime(page_views['Date / Time'])
-page_views = page_views.sort_values(['UserId', 'DateTime'])
+design = None
+if args.archive:
+    # Archived events are already clean and sessionized; a window or user list reads
+    # only the partitions and row groups that can hold matching sessions
+    from event_archive import print_scan, read_archive  # needs pyarrow, only for --archive
+    print(f"\nReading event archive {args.archive}...")
+    users = args.users.split(',') if args.users else None
+    try:
+        events, scan = read_archive(args.archive, args.since, args.until, users, SESSION_TIMEOUT)
+    except ValueError as e:
+        parser.error(str(e))
+    print_scan(scan, args.since, args.until, users)
+    if events.empty:
+        parser.error('no sessions match --since/--until/--users in ' + args.archive)
+else:
+    # Load page views
+    print(f"\nLoading {os.path.basename(PAGE_VIEWS_FILE)}...")
+    page_views = read_page_views(PAGE_VIEWS_FILE)
+    print(f"  Raw records: {len(page_views):,}")
+
+    # Preview mode: keep whole users from every activity stratum, so sessions are intact
+    if args.preview:
+        design = sample_users(page_views, args.preview, seed=args.preview_seed)
+        page_views = page_views[page_views['UserId'].isin(design.sampled)]
+        print_design(design)
+        print(f"  Sampled records: {len(page_views):,}")
+
+    # Remove placeholder rows, convert datetime and sort
+    events = backend.clean(page_views)
+    print_rejections(backend.timestamps)
+    if LEAN_MEMORY:
+        del page_views
 
 # Load login history (optional - for reference)
-print("\nLoading Login_History.xlsx...")
-login_history = pd.read_excel('Login_History.xlsx')
+print(f"\nLoading {os.path.basename(LOGIN_HISTORY_FILE)}...")
+login_history = read_login_history(LOGIN_HISTORY_FILE)
 print(f"  Login records: {len(login_history):,}")
 
 # Load data dictionary
 print("\nLoading Data Dictionary...")
-data_dict = pd.read_csv('Data_Dictionary_FINAL.csv')
+data_dict = pd.read_csv(DICTIONARY_FILE)
 print(f"  Pages in dictionary: {len(data_dict)}")
-
-# Basic statistics
-print(f"\nUser Activity Overview:")
-print(f"  Unique users: {page_views['UserId'].nunique()}")
-print(f"  Date range: {page_views['DateTime'].min().date()} to {page_views['DateTime'].max().date()}")
-print(f"  Total page views: {len(page_views):,}")
+memory.checkpoint('PHASE 2A: load and clean')
 
 # =====================================================================
 # PHASE 2B: SESSIONIZATION AND DWELL TIME CALCULATION
@@ -58,45 +149,17 @@ print("\n" + "=" * 80)
 print("PHASE 2B: SESSIONIZATION AND DWELL TIME CALCULATION")
 print("=" * 80)
 
-# Define session timeout (30 minutes)
-SESSION_TIMEOUT = timedelta(minutes=30)
-
 print(f"\nSession timeout: {SESSION_TIMEOUT.total_seconds()/60:.0f} minutes")
 
-# Sort data for sessionization
-df = page_views.copy()
-df = df.sort_values(['UserId', 'DateTime'])
-
-# Calculate time difference to previous event
-df['TimeDiff'] = df.groupby('UserId')['DateTime'].diff()
+if not args.archive:
+    events = backend.sessionize(events, SESSION_TIMEOUT)
 
-# Identify new sessions
-df['NewSession'] = (
-    (df['TimeDiff'] > SESSION_TIMEOUT) |  # Timeout exceeded
-    (df['UserId'] != df['UserId'].shift())  # New user
-)
-
-# Assign session IDs
-df['SessionId'] = df['NewSession'].cumsum()
-
-# Calculate dwell time (time until next event)
-df['NextDateTime'] = df.groupby('UserId')['DateTime'].shift(-1)
-df['DwellTime'] = df['NextDateTime'] - df['DateTime']
-
-# Cap dwell time at session timeout for last page of session
-df['IsLastInSession'] = df.groupby('SessionId')['DateTime'].transform('max') == df['DateTime']
-df.loc[df['IsLastInSession'], 'DwellTime'] = pd.Timedelta(seconds=0)
-
-# For non-last pages, cap at timeout
-df.loc[df['DwellTime'] > SESSION_TIMEOUT, 'DwellTime'] = SESSION_TIMEOUT
-
-# Convert to seconds
-df['DwellTimeSeconds'] = df['DwellTime'].dt.total_seconds()
-
-print(f"\nSessionization complete:")
-print(f"  Total sessions: {df['SessionId'].nunique():,}")
-print(f"  Avg pages per session: {len(df) / df['SessionId'].nunique():.1f}")
-print(f"  Avg session duration: {df.groupby('SessionId')['DwellTimeSeconds'].sum().mean()/60:.1f} minutes")
+# Collapse repeated hits by a user on the same page within this window into one
+# event (keeping the first timestamp, a hit count and the run's dwell), or None
+COMPACTION_WINDOW = None  # e.g. timedelta(seconds=10)
+if COMPACTION_WINDOW is not None:
+    events = backend.compact(events, COMPACTION_WINDOW)
+memory.checkpoint('PHASE 2B: sessionization')
 
 # =====================================================================
 # PHASE 2C: MERGE WITH DATA DICTIONARY
@@ -106,19 +169,47 @@ print("PHASE 2C: MERGING WITH DATA DICTIONARY")
 print("=" * 80)
 
 # Merge page views with dictionary
-df['Page'] = df['Page'].astype(str)
 data_dict['Page_ID'] = data_dict['Page_ID'].astype(str)
+events = backend.enrich(events, data_dict)
+
+# Execute the pipeline (a single fused query plan on lazy backends)
+tables = backend.collect(events)
+df_enriched = tables.events
+del events
+
+# Overall counts, date range and session lengths, planned together with the user
+# and section tables (page views are summed from Hits for compacted events)
+overview = tables.planner.table('overview')
+session_lengths = tables.planner.table('sessions')['Duration_Seconds']
+total_page_views = int(overview['Page_Views'])
+total_sessions = int(overview['Sessions'])
+first_activity = overview['First_Activity']
+last_activity = overview['Last_Activity']
+content_views = int(overview['Views_With_Content'])
+
+print(f"\nCleaning results:")
+print(f"  After cleaning: {total_page_views:,} records")
+print(f"  Unique users: {overview['Users']}")
+print(f"  Date range: {first_activity.date()} to {last_activity.date()}")
 
-df_enriched = df.merge(
-    data_dict,
-    left_on='Page',
-    right_on='Page_ID',
-    how='left'
-)
+print(f"\nSessionization complete:")
+print(f"  Total sessions: {total_sessions:,}")
+print(f"  Avg pages per session: {total_page_views / total_sessions:.1f}")
+print(f"  Avg session duration: {session_lengths.mean()/60:.1f} minutes")
 
 print(f"\nMerge results:")
-print(f"  Records with content info: {df_enriched['Title'].notna().sum():,} ({df_enriched['Title'].notna().sum()/len(df_enriched)*100:.1f}%)")
-print(f"  Records without content info: {df_enriched['Title'].isna().sum():,}")
+print(f"  Records with content info: {content_views:,} ({content_views/total_page_views*100:.1f}%)")
+print(f"  Records without content info: {total_page_views - content_views:,}")
+
+if COMPACTION_WINDOW is not None:
+    print_compaction_report(backend.compaction, COMPACTION_WINDOW)
+
+# Per-user and per-session row offsets over the sorted events, for participant
+# drill-down (`python timeline_index.py timeline <user>`)
+timeline_index = TimelineIndex.from_events(df_enriched)
+timeline_index.save(TIMELINE_INDEX_DIR)
+print(f"\n✓ Timeline index saved to: {TIMELINE_INDEX_DIR}/")
+memory.checkpoint('PHASE 2C: merge and aggregate')
 
 # =====================================================================
 # PHASE 3A: CALCULATE ENGAGEMENT METRICS
@@ -127,77 +218,37 @@ print("\n" + "=" * 80)
 print("PHASE 3A: CALCULATING ENGAGEMENT METRICS")
 print("=" * 80)
 
-# Calculate metrics per user
-user_metrics = []
-
-for user_id in df_enriched['UserId'].unique():
-    user_data = df_enriched[df_enriched['UserId'] == user_id]
-
-    # Basic metrics
-    total_visits = user_data['SessionId'].nunique()
-    total_pages = len(user_data)
-    total_time_seconds = user_data['DwellTimeSeconds'].sum()
-    total_time_minutes = total_time_seconds / 60
-
-    # Date range
-    first_activity = user_data['DateTime'].min()
-    last_activity = user_data['DateTime'].max()
-    days_active = (last_activity - first_activity).days + 1
-
-    # Content engagement
-    sections_visited = user_data['Section'].dropna().unique()
-    lessons_visited = user_data['Lesson'].dropna().unique()
-
-    # Calculate completion - based on seeing lesson summary pages
-    summary_pages = user_data[user_data['Is_Last_Page'] == True]['Lesson'].dropna().unique()
-    lessons_completed = len(summary_pages)
-
-    # Furthest progression (handling 'menu' pages)
-    numeric_pages = user_data[user_data['Page'] != 'menu']['Page']
-    if not numeric_pages.empty:
-        try:
-            furthest_page = numeric_pages.astype(float).max()
-            furthest_content_row = user_data[user_data['Page'] == str(int(furthest_page))]
-            furthest_content = furthest_content_row['Title'].iloc[0] if not furthest_content_row.empty else 'Unknown'
-        except:
-            furthest_page = 0
-            furthest_content = 'Unknown'
-    else:
-        furthest_page = 0
-        furthest_content = 'Menu only'
-
-    # Time by section
-    section_time = user_data.groupby('Section')['DwellTimeSeconds'].sum() / 60  # in minutes
-
-    user_metrics.append({
-        'Invite_Code': user_id,  # Using UserId as Invite_Code
-        'Total_Visits': total_visits,
-        'Total_Pages_Viewed': total_pages,
-        'Total_Time_Minutes': round(total_time_minutes, 1),
-        'Total_Time_Hours': round(total_time_minutes / 60, 2),
-        'First_Activity': first_activity.strftime('%Y-%m-%d %H:%M'),
-        'Last_Activity': last_activity.strftime('%Y-%m-%d %H:%M'),
-        'Days_Active': days_active,
-        'Sections_Visited': len(sections_visited),
-        'Lessons_Started': len(lessons_visited),
-        'Lessons_Completed': lessons_completed,
-        'Completion_Rate': round(lessons_completed / 12 * 100, 1),  # 12 total lessons
-        'Furthest_Page': int(furthest_page) if furthest_page > 0 else 0,
-        'Furthest_Content': furthest_content[:50] if furthest_content else 'Unknown',
-        'Avg_Pages_Per_Visit': round(total_pages / total_visits, 1),
-        'Avg_Minutes_Per_Visit': round(total_time_minutes / total_visits, 1)
-    })
-
-# Convert to DataFrame
-metrics_df = pd.DataFrame(user_metrics)
-metrics_df = metrics_df.sort_values('Total_Time_Minutes', ascending=False)
+# Per-user aggregates from the backend (visits, pages, time, activity span, sections)
+users = tables.users.set_index('UserId')
+
+# Furthest progression (in course order), lesson bitmasks and per-user metrics,
+# ranked by time spent
+metrics_df, progression = user_metrics_table(users, df_enriched, load_course_order(COURSE_STRUCTURE_FILE), data_dict)
+
+# Cohort statistics for the summary sheet and synthesis
+user_stats, high_engagement, median_hours = cohort_statistics(metrics_df)
+
+# 95% bootstrap intervals (users resampled with replacement) for the summary sheet
+# and synthesis; chunks of replicates can run in several processes
+BOOTSTRAP_SEED = 0
+BOOTSTRAP_WORKERS = 1
+intervals = bootstrap_intervals(metrics_df, BOOTSTRAP_REPLICATES, BOOTSTRAP_SEED, BOOTSTRAP_WORKERS)
 
 print(f"\nMetrics calculated for {len(metrics_df)} users")
 print(f"\nEngagement Overview:")
-print(f"  Average time spent: {metrics_df['Total_Time_Hours'].mean():.1f} hours")
-print(f"  Average visits: {metrics_df['Total_Visits'].mean():.1f}")
-print(f"  Average pages viewed: {metrics_df['Total_Pages_Viewed'].mean():.1f}")
-print(f"  Average completion rate: {metrics_df['Completion_Rate'].mean():.1f}%")
+print(f"  Average time spent: {user_stats['Mean_Hours']:.1f} hours")
+print(f"  Average visits: {user_stats['Mean_Visits']:.1f}")
+print(f"  Average pages viewed: {user_stats['Mean_Pages']:.1f}")
+print(f"  Average completion rate: {user_stats['Mean_Completion']:.1f}%")
+print(f"  Bootstrap intervals: {len(intervals.replicates):,} replicates")
+
+# Kaplan-Meier retention: days to last activity and furthest lesson, for all users
+# and first-activity month cohorts (users active near the export end are censored)
+retention = retention_tables(users['First_Activity'], users['Last_Activity'], progression['Furthest_Lesson'],
+                             study_end=last_activity)
+print(f"\nRetention:")
+print_retention(retention)
+memory.checkpoint('PHASE 3A: engagement metrics')
 
 # =====================================================================
 # PHASE 3B: EXPORT METRICS TO EXCEL
@@ -206,50 +257,70 @@ print("\n" + "=" * 80)
 print("PHASE 3B: EXPORTING METRICS")
 print("=" * 80)
 
+# Preview runs estimate Summary_Statistics and Section_Engagement for all users; the
+# page and retention sheets describe the sampled users only and are named to say so
+sample_suffix = '' if design is None else SAMPLE_SHEET_SUFFIX
+
 # Create Excel writer
-with pd.ExcelWriter('CRAFT_PTSD_Engagement_Metrics.xlsx', engine='xlsxwriter') as writer:
+with pd.ExcelWriter(METRICS_FILE, engine='xlsxwriter') as writer:
     # Sheet 1: User Metrics
     metrics_df.to_excel(writer, sheet_name='User_Metrics', index=False)
 
     # Sheet 2: Summary Statistics
-    summary_stats = pd.DataFrame({
-        'Metric': [
-            'Total Users',
-            'Total Page Views',
-            'Total Sessions',
-            'Average Time per User (hours)',
-            'Average Visits per User',
-            'Average Pages per User',
-            'Average Completion Rate (%)',
-            'Users Who Completed All Lessons',
-            'Users Who Started But Didn\'t Complete'
-        ],
-        'Value': [
-            len(metrics_df),
-            len(df_enriched),
-            df_enriched['SessionId'].nunique(),
-            round(metrics_df['Total_Time_Hours'].mean(), 2),
-            round(metrics_df['Total_Visits'].mean(), 1),
-            round(metrics_df['Total_Pages_Viewed'].mean(), 1),
-            round(metrics_df['Completion_Rate'].mean(), 1),
-            len(metrics_df[metrics_df['Completion_Rate'] == 100]),
-            len(metrics_df[(metrics_df['Lessons_Started'] > 0) & (metrics_df['Completion_Rate'] < 100)])
-        ]
-    })
+    summary_stats = summary_statistics(metrics_df, user_stats, total_page_views, total_sessions)
+    if design is None:
+        summary_stats = add_summary_intervals(summary_stats, intervals)
+    else:
+        # Estimates for every user in the export, with 95% intervals
+        summary_stats = preview_summary_statistics(design, metrics_df)
     summary_stats.to_excel(writer, sheet_name='Summary_Statistics', index=False)
 
     # Sheet 3: Section Engagement
-    section_stats = df_enriched.groupby('Section').agg({
-        'UserId': 'nunique',
-        'DwellTimeSeconds': 'sum',
-        'Page': 'count'
-    }).reset_index()
-    section_stats.columns = ['Section', 'Unique_Users', 'Total_Time_Seconds', 'Total_Views']
-    section_stats['Total_Time_Hours'] = round(section_stats['Total_Time_Seconds'] / 3600, 2)
-    section_stats = section_stats.sort_values('Total_Time_Hours', ascending=False)
+    section_stats = tables.sections if design is None else preview_section_stats(design, df_enriched)
     section_stats.to_excel(writer, sheet_name='Section_Engagement', index=False)
 
-print("✓ Metrics exported to: CRAFT_PTSD_Engagement_Metrics.xlsx")
+    # Sheet 4: Page Engagement (dwell statistics leave out each session's zero-dwell last page)
+    page_stats = finish_page_stats(tables.planner.table('pages'), data_dict)
+    page_stats.to_excel(writer, sheet_name='Page_Engagement' + sample_suffix, index=False)
+
+    # Sheets 5-6: Kaplan-Meier curves, one row per cohort and step
+    retention['days'].to_excel(writer, sheet_name='Retention_Days' + sample_suffix, index=False)
+    retention['lessons'].to_excel(writer, sheet_name='Lesson_Survival' + sample_suffix, index=False)
+
+print(f"✓ Metrics exported to: {METRICS_FILE}")
+viewed_pages = page_stats[page_stats['Views'] > 0]
+print(f"  Page engagement: {len(viewed_pages)} of {len(page_stats)} pages viewed, "
+      f"median dwell {viewed_pages['Median_Dwell_Seconds'].median():.1f}s per page")
+save_compact(RETENTION_FILE, retention, last_activity)
+print(f"✓ Retention curves saved to: {RETENTION_FILE} ({os.path.getsize(RETENTION_FILE):,} bytes)")
+
+# Dense float32 feature matrix (one row per user, in User_Metrics order) for modeling;
+# memory-mapped with `FeatureMatrix.load(dir)`, column schema in features.json
+features = FeatureMatrix.from_metrics(metrics_df, df_enriched, dictionary_sections(data_dict), last_activity)
+features.save(FEATURES_DIR)
+print(f"✓ Feature matrix saved to: {FEATURES_DIR}/")
+print_features(features)
+
+# Sparse user x page matrix of views and dwell, for navigation similarity and
+# clustering (`python page_similarity.py similar <user>` / `clusters`)
+user_pages = UserPageMatrix.from_events(df_enriched)
+user_pages.save(USER_PAGES_DIR)
+print(f"✓ User-page matrix saved to: {USER_PAGES_DIR}/")
+print_matrix(user_pages)
+
+# Mergeable sketches (unique users, dwell and session quantiles) for multi-site
+# rollups, or None; combine files from several runs with `python sketches.py merge`
+SKETCH_FILE = None  # e.g. 'engagement_sketches.npz'
+if SKETCH_FILE:
+    sketches = EngagementSketches.from_events(df_enriched)
+    sketch_path = os.path.join(OUTPUT_DIR, SKETCH_FILE)
+    sketches.save(sketch_path)
+    print(f"✓ Sketches saved to: {sketch_path} ({os.path.getsize(sketch_path):,} bytes)")
+    estimated = sketches.unique_users['section'].estimates()
+    exact = section_stats.set_index('Section')['Unique_Users']
+    worst = (estimated.reindex(exact.index) / exact - 1).abs().max() * 100
+    print(f"  Section unique users vs exact: worst error {worst:.1f}%")
+memory.checkpoint('PHASE 3B: export')
 
 # =====================================================================
 # PHASE 4A & 4B: GENERATE SUMMARIES
@@ -258,88 +329,34 @@ print("\n" + "=" * 80)
 print("PHASE 4: GENERATING SUMMARIES")
 print("=" * 80)
 
-# Generate individual summaries for top users
-individual_summaries = []
-for _, user in metrics_df.head(20).iterrows():  # Top 20 users
-    summary = f"""User {user['Invite_Code']} (Invite Code {user['Invite_Code']}):
-  • Engaged in {user['Total_Visits']} sessions totaling {user['Total_Time_Hours']} hours
-  • Activity span: {user['First_Activity']} to {user['Last_Activity']} ({user['Days_Active']} days)
-  • Viewed {user['Total_Pages_Viewed']} pages across {user['Sections_Visited']}/6 sections
-  • Completed {user['Lessons_Completed']}/12 lessons ({user['Completion_Rate']}% completion)
-  • Furthest progression: Page {user['Furthest_Page']} - {user['Furthest_Content']}"""
-    individual_summaries.append(summary)
-
-# Calculate aggregate statistics
-high_engagement_users = metrics_df[metrics_df['Total_Time_Hours'] > metrics_df['Total_Time_Hours'].median()]
-completers = metrics_df[metrics_df['Completion_Rate'] == 100]
-
-# Identify dropout patterns
-section_views = df_enriched.groupby('Section')['UserId'].nunique().sort_values(ascending=False)
-most_visited_section = section_views.index[0] if len(section_views) > 0 else 'Unknown'
+# Individual summaries: top-N users by engagement, or None for every participant
+SUMMARY_TOP_N = 20
+USER_SUMMARY_DIR = None  # e.g. 'user_summaries' (inside the output directory) for one file per user
+SUMMARY_WORKERS = 1
 
 # Generate aggregate summary
-aggregate_summary = f"""
-VA CRAFT PTSD INTERVENTION - ENGAGEMENT ANALYSIS SUMMARY
-{'=' * 70}
-
-OVERALL PARTICIPATION
-{'-' * 30}
-• Total participants: {len(metrics_df)} users
-• Total engagement: {df_enriched['SessionId'].nunique():,} sessions
-• Total page views: {len(df_enriched):,} pages
-• Study period: {df_enriched['DateTime'].min().date()} to {df_enriched['DateTime'].max().date()}
-
-ENGAGEMENT METRICS
-{'-' * 30}
-• Average time per user: {metrics_df['Total_Time_Hours'].mean():.1f} hours
-• Median time per user: {metrics_df['Total_Time_Hours'].median():.1f} hours
-• Average visits per user: {metrics_df['Total_Visits'].mean():.1f} sessions
-• Average pages per visit: {metrics_df['Avg_Pages_Per_Visit'].mean():.1f} pages
-
-COURSE COMPLETION
-{'-' * 30}
-• Full course completion: {len(completers)}/{len(metrics_df)} users ({len(completers)/len(metrics_df)*100:.1f}%)
-• Partial completion: {len(metrics_df[metrics_df['Lessons_Started'] > 0])}/{len(metrics_df)} users
-• Average lessons completed: {metrics_df['Lessons_Completed'].mean():.1f} of 12
-• Never progressed beyond intro: {len(metrics_df[metrics_df['Furthest_Page'] <= 10])} users
-
-SECTION ENGAGEMENT
-{'-' * 30}
-{section_views.head().to_string()}
-
-HIGH ENGAGEMENT ANALYSIS
-{'-' * 30}
-Users with above-median engagement (>{metrics_df['Total_Time_Hours'].median():.1f} hours):
-• Count: {len(high_engagement_users)} users
-• Average time: {high_engagement_users['Total_Time_Hours'].mean():.1f} hours
-• Average completion: {high_engagement_users['Completion_Rate'].mean():.1f}%
-• Average visits: {high_engagement_users['Total_Visits'].mean():.1f}
-
-KEY INSIGHTS
-{'-' * 30}
-1. Engagement varies widely, with time spent ranging from {metrics_df['Total_Time_Hours'].min():.1f} to {metrics_df['Total_Time_Hours'].max():.1f} hours.
-
-2. The completion rate of {metrics_df['Completion_Rate'].mean():.1f}% suggests room for improvement in retention strategies.
-
-3. {most_visited_section} is the most accessed section, engaged by {section_views.iloc[0] if len(section_views) > 0 else 0} users.
-
-4. Users who engage more (>{metrics_df['Total_Time_Hours'].median():.1f} hours) show significantly higher completion rates.
-
-5. The average of {metrics_df['Total_Visits'].mean():.1f} visits per user suggests the intervention requires sustained engagement.
-
-{'=' * 70}
-Analysis completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-
-# Save synthesis report
-with open('CRAFT_PTSD_Synthesis.txt', 'w') as f:
-    f.write(aggregate_summary)
-    f.write("\n\nINDIVIDUAL USER SUMMARIES (Top 20 by Engagement)\n")
-    f.write("=" * 70 + "\n\n")
-    for summary in individual_summaries:
-        f.write(summary + "\n\n")
+preview_note = '' if design is None else (
+    f"PREVIEW: figures below describe a stratified sample of {len(design.sampled)} of {len(design.users)} users\n"
+    f"(see {os.path.basename(METRICS_FILE)} for whole-export estimates with 95% intervals)\n"
+)
+aggregate_summary = aggregate_summary_text(metrics_df, overview, user_stats, high_engagement, median_hours,
+                                           intervals, section_stats, preview_note)
+
+# Save synthesis report, streaming the individual summaries
+user_summary_dir = os.path.join(OUTPUT_DIR, USER_SUMMARY_DIR) if USER_SUMMARY_DIR else None
+summary_count = write_synthesis_report(
+    SYNTHESIS_FILE,
+    aggregate_summary,
+    metrics_df,
+    top_n=SUMMARY_TOP_N,
+    user_dir=user_summary_dir,
+    workers=SUMMARY_WORKERS
+)
 
-print("✓ Synthesis report saved to: CRAFT_PTSD_Synthesis.txt")
+print(f"✓ Synthesis report saved to: {SYNTHESIS_FILE} ({summary_count} individual summaries)")
+if user_summary_dir:
+    print(f"✓ Per-user summaries saved to: {user_summary_dir}/")
+memory.checkpoint('PHASE 4: summaries')
 
 # =====================================================================
 # UPDATE TODO LIST
@@ -348,14 +365,17 @@ print("\n" + "=" * 80)
 print("ANALYSIS COMPLETE")
 print("=" * 80)
 print("\nGenerated Files:")
-print("  1. CRAFT_PTSD_Engagement_Metrics.xlsx - Detailed user metrics")
-print("  2. CRAFT_PTSD_Synthesis.txt - Written summaries and insights")
-print("  3. Data_Dictionary_FINAL.csv - Complete page mappings")
+print(f"  1. {METRICS_FILE} - Detailed user metrics")
+print(f"  2. {SYNTHESIS_FILE} - Written summaries and insights")
+print(f"  3. {DICTIONARY_FILE} - Complete page mappings")
+print(f"  4. {TIMELINE_INDEX_DIR}/ - Per-user timeline index")
 
 print("\nKey Findings:")
 print(f"  • {len(metrics_df)} users analyzed")
-print(f"  • {metrics_df['Total_Time_Hours'].sum():.1f} total hours of engagement")
-print(f"  • {metrics_df['Completion_Rate'].mean():.1f}% average completion rate")
-print(f"  • {len(completers)} users completed all 12 lessons")
+print(f"  • {user_stats['Total_Hours']:.1f} total hours of engagement")
+print(f"  • {user_stats['Mean_Completion']:.1f}% average completion rate")
+print(f"  • {user_stats['Completers']} users completed all 12 lessons")
+
+memory.report()
 
 print(f"\nAnalysis End: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
\ No newline at end of file
@@ -0,0 +1,250 @@
+"""
+Retention and survival curves for VA CRAFT PTSD engagement data
+Kaplan-Meier estimates of time to last activity (days from first to last activity)
+and of lesson-based survival (furthest lesson reached), for all users and for
+cohorts by first-activity month.
+
+A user "drops out" at their last activity unless that activity falls within
+ACTIVE_WINDOW of the end of the export; those users may still be active and are
+censored. Curves are computed from per-user values with one sort and cumulative
+counts over (cohort, time) runs, not per-user or per-cohort loops.
+"""
+
+import argparse
+import json
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from engagement_metrics import TOTAL_LESSONS
+
+ACTIVE_WINDOW = timedelta(days=30)  # last activity this close to the export end is censored
+ALL_USERS = 'All'
+
+CURVE_COLUMNS = ['Cohort', 'Time', 'At_Risk', 'Events', 'Censored', 'Survival', 'Std_Error']
+
+
+def kaplan_meier(times, events, cohorts=None):
+    """Kaplan-Meier curves per cohort (or one 'All' curve) with Greenwood standard errors
+
+    times: integer time of dropout or censoring per user; events: True when the user
+    dropped out at that time. One row per cohort and distinct time.
+    """
+
+    times = np.asarray(times, dtype=np.int64)
+    events = np.asarray(events, dtype=bool)
+    if cohorts is None:
+        codes, labels = np.zeros(len(times), dtype=np.int64), pd.Index([ALL_USERS])
+    else:
+        codes, labels = pd.factorize(np.asarray(cohorts), sort=True)
+    if len(times) == 0:
+        return pd.DataFrame(columns=CURVE_COLUMNS)
+
+    order = np.lexsort((times, codes))
+    codes, times, events = codes[order], times[order], events[order]
+
+    # Runs of equal (cohort, time): deaths and exits at each curve step
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (times[1:] != times[:-1])])
+    run_cohort = codes[starts]
+    exits = np.diff(np.r_[starts, len(times)])
+    deaths = np.add.reduceat(events.astype(np.int64), starts)
+    cohort_sizes = np.bincount(codes)
+    cohort_starts = np.r_[0, np.cumsum(cohort_sizes)[:-1]]
+    at_risk = cohort_sizes[run_cohort] - (starts - cohort_starts[run_cohort])
+
+    # Product of (1 - d/n) within each cohort as a segmented sum of logs; a factor
+    # of zero (everyone at risk drops out) is counted separately
+    factor = 1 - deaths / at_risk
+    zero = factor == 0
+    log_factor = np.log(np.where(zero, 1.0, factor))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        greenwood = np.where(zero, 0.0, deaths / (at_risk * (at_risk - deaths)))
+    first_run = np.r_[True, run_cohort[1:] != run_cohort[:-1]]
+    survival = np.exp(_segment_cumsum(log_factor, first_run)) * (_segment_cumsum(zero, first_run) == 0)
+    std_error = survival * np.sqrt(_segment_cumsum(greenwood, first_run))
+
+    return pd.DataFrame({
+        'Cohort': labels[run_cohort],
+        'Time': times[starts],
+        'At_Risk': at_risk,
+        'Events': deaths,
+        'Censored': exits - deaths,
+        'Survival': survival,
+        'Std_Error': std_error
+    })
+
+
+def _segment_cumsum(values, segment_starts):
+    """Cumulative sum restarting at every True in segment_starts"""
+
+    totals = np.cumsum(values, dtype=np.float64)
+    start_index = np.flatnonzero(segment_starts)
+    offsets = totals[start_index] - np.asarray(values, dtype=np.float64)[start_index]
+    return totals - np.repeat(offsets, np.diff(np.r_[start_index, len(totals)]))
+
+
+def dropout_events(last_activity, study_end=None, active_window=ACTIVE_WINDOW):
+    """True for users whose last activity is final (not within the active window of the export end)"""
+
+    last_activity = pd.to_datetime(pd.Series(last_activity))
+    study_end = last_activity.max() if study_end is None else study_end
+    return (last_activity <= study_end - active_window).to_numpy()
+
+
+def retention_tables(first_activity, last_activity, furthest_lesson, study_end=None, active_window=ACTIVE_WINDOW):
+    """Time-to-last-activity and lesson survival curves for all users and each first-activity month"""
+
+    first_activity = pd.to_datetime(pd.Series(first_activity)).reset_index(drop=True)
+    last_activity = pd.to_datetime(pd.Series(last_activity)).reset_index(drop=True)
+    events = dropout_events(last_activity, study_end, active_window)
+    days = ((last_activity - first_activity) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+    lessons = pd.Series(furthest_lesson).fillna(0).to_numpy(dtype=np.int64)
+    # Months as datetime64[M]; only the distinct cohorts are formatted as labels
+    months = first_activity.to_numpy().astype('datetime64[M]')
+
+    curves = {}
+    for name, times in (('days', days), ('lessons', lessons)):
+        by_cohort = kaplan_meier(times, events, months)
+        by_cohort['Cohort'] = pd.DatetimeIndex(by_cohort['Cohort']).strftime('%Y-%m')
+        curves[name] = pd.concat([kaplan_meier(times, events), by_cohort], ignore_index=True)
+
+    # Share of users who reached each lesson, regardless of censoring
+    reached = np.cumsum(np.bincount(lessons, minlength=TOTAL_LESSONS + 1)[::-1])[::-1]
+    curves['lessons_reached'] = pd.DataFrame({
+        'Lesson': np.arange(len(reached)),
+        'Users_Reached': reached,
+        'Fraction_Reached': reached / max(len(lessons), 1)
+    })
+    return curves
+
+
+def survival_at(curve, time):
+    """Survival of one cohort's curve just after the given time (1.0 before the first step)"""
+
+    steps = curve[curve['Time'] <= time]
+    return 1.0 if steps.empty else float(steps['Survival'].iloc[-1])
+
+
+def median_survival(curve):
+    """First time at which a cohort's survival falls to 0.5 or below, or None"""
+
+    below = curve[curve['Survival'] <= 0.5]
+    return None if below.empty else int(below['Time'].iloc[0])
+
+
+def to_compact(curves, study_end, active_window=ACTIVE_WINDOW):
+    """Compact JSON-ready form: per curve and cohort, parallel arrays of step times, survival and at-risk counts"""
+
+    compact = {
+        'study_end': pd.Timestamp(study_end).isoformat(),
+        'active_window_days': active_window.days,
+        'curves': {},
+        'lessons_reached': curves['lessons_reached']['Fraction_Reached'].round(4).tolist()
+    }
+    for name in ('days', 'lessons'):
+        compact['curves'][name] = {
+            cohort: {
+                't': steps['Time'].tolist(),
+                's': steps['Survival'].round(4).tolist(),
+                'n': steps['At_Risk'].tolist(),
+                'd': steps['Events'].tolist()
+            }
+            for cohort, steps in curves[name].groupby('Cohort', sort=False)
+        }
+    return compact
+
+
+def save_compact(path, curves, study_end, active_window=ACTIVE_WINDOW):
+    """Write the compact curves as minified JSON"""
+
+    with open(path, 'w') as f:
+        json.dump(to_compact(curves, study_end, active_window), f, separators=(',', ':'))
+
+
+def load_compact(path):
+    """Curve tables (Cohort, Time, At_Risk, Events, Survival) from a compact JSON file"""
+
+    with open(path) as f:
+        compact = json.load(f)
+    tables = {}
+    for name, cohorts in compact['curves'].items():
+        tables[name] = pd.DataFrame([
+            {'Cohort': cohort, 'Time': t, 'At_Risk': n, 'Events': d, 'Survival': s}
+            for cohort, steps in cohorts.items()
+            for t, s, n, d in zip(steps['t'], steps['s'], steps['n'], steps['d'])
+        ])
+    return tables
+
+
+def naive_kaplan_meier(times, events):
+    """Reference implementation: walk the distinct times one at a time"""
+
+    times, events = np.asarray(times), np.asarray(events, dtype=bool)
+    survival, rows = 1.0, []
+    for t in np.unique(times):
+        at_risk = int((times >= t).sum())
+        deaths = int((events & (times == t)).sum())
+        survival *= 1 - deaths / at_risk
+        rows.append((t, at_risk, deaths, survival))
+    return pd.DataFrame(rows, columns=['Time', 'At_Risk', 'Events', 'Survival'])
+
+
+def print_retention(curves):
+    """Headline retention figures for all users"""
+
+    days = curves['days'][curves['days']['Cohort'] == ALL_USERS]
+    lessons = curves['lessons'][curves['lessons']['Cohort'] == ALL_USERS]
+    median_days = median_survival(days)
+    print(f"  Still active after 30 / 90 / 365 days: {survival_at(days, 30):.0%} / "
+          f"{survival_at(days, 90):.0%} / {survival_at(days, 365):.0%}")
+    print(f"  Median time to last activity: {'not reached' if median_days is None else f'{median_days} days'}")
+    print(f"  Still active at lesson 6 / {TOTAL_LESSONS}: {survival_at(lessons, 5):.0%} / {survival_at(lessons, TOTAL_LESSONS - 1):.0%}"
+          f" ({curves['days']['Cohort'].nunique() - 1} first-activity cohorts)")
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description='Retention curves from the metrics workbook, with a check and benchmark')
+    parser.add_argument('--metrics', default='CRAFT_PTSD_Engagement_Metrics.xlsx')
+    parser.add_argument('--output', default='CRAFT_PTSD_Retention.json')
+    parser.add_argument('--users', type=int, default=1000000, help='synthetic users for the benchmark')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("RETENTION CURVES")
+    print("=" * 80)
+
+    metrics_df = pd.read_excel(args.metrics, sheet_name='User_Metrics')
+    last_activity = pd.to_datetime(metrics_df['Last_Activity'])
+    curves = retention_tables(metrics_df['First_Activity'], last_activity, metrics_df['Furthest_Lesson'])
+    save_compact(args.output, curves, last_activity.max())
+    print_retention(curves)
+    print(f"✓ Compact curves saved to: {args.output}")
+
+    # Every cohort's curve must match the one-time-at-a-time reference
+    cohorts = pd.to_datetime(metrics_df['First_Activity']).dt.strftime('%Y-%m')
+    events = dropout_events(last_activity)
+    days = (last_activity - pd.to_datetime(metrics_df['First_Activity'])).dt.days.to_numpy()
+    matches = True
+    for cohort in [ALL_USERS, *sorted(cohorts.unique())]:
+        mask = np.ones(len(days), dtype=bool) if cohort == ALL_USERS else (cohorts == cohort).to_numpy()
+        expected = naive_kaplan_meier(days[mask], events[mask])
+        actual = curves['days'][curves['days']['Cohort'] == cohort]
+        matches &= np.allclose(actual['Survival'], expected['Survival']) and \
+            actual['At_Risk'].tolist() == expected['At_Risk'].tolist()
+    print(f"Matches per-time reference for all {cohorts.nunique() + 1} curves: {matches}")
+    loaded = load_compact(args.output)['days']
+    print(f"Compact form round-trips: {np.allclose(loaded['Survival'], curves['days']['Survival'], atol=5e-5)}")
+
+    rng = np.random.default_rng(0)
+    first = pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 4 * 365 * 24, args.users), unit='h')
+    last = first + pd.to_timedelta(rng.exponential(60, args.users), unit='D')
+    lessons = rng.integers(0, TOTAL_LESSONS + 1, args.users)
+    start = time.perf_counter()
+    synthetic = retention_tables(first, last, lessons)
+    elapsed = time.perf_counter() - start
+    print(f"\n{args.users:,} synthetic users: {elapsed:.2f}s for "
+          f"{len(synthetic['days']) + len(synthetic['lessons']):,} curve steps "
+          f"over {synthetic['days']['Cohort'].nunique() - 1} cohorts")
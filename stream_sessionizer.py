@@ -0,0 +1,311 @@
+"""
+Streaming sessionizer for page-view event streams (JSONL)
+Applies the PHASE 2B rules event by event: a gap above SESSION_TIMEOUT starts a new
+session, each page's dwell runs to the next event of the session, and the last page
+of a session gets zero dwell. Open sessions are kept per user and closed once the
+stream has moved on by more than the timeout, or when the number of open sessions
+exceeds a bound. Closed sessions and running per-user metrics are emitted as JSONL.
+
+Events are JSON objects with the export's field names:
+  {"UserId": 1160, "Page": "42", "Date / Time": "2021-03-01 10:15:00.000000"}
+and must arrive in time order per user (later events for a user that go back in
+time are counted and skipped).
+"""
+
+import argparse
+import json
+import signal
+import socket
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from export_readers import read_page_views
+from timestamps import parse_timestamps
+
+SESSION_TIMEOUT = timedelta(minutes=30)
+MAX_OPEN_SESSIONS = 100_000
+POLL_SECONDS = 0.5
+
+
+class OpenSession:
+    """State of one user's session that may still receive events"""
+
+    __slots__ = ('user', 'session_id', 'start', 'last_time', 'views', 'dwell')
+
+    def __init__(self, user, session_id, start):
+        self.user = user
+        self.session_id = session_id
+        self.start = start
+        self.last_time = start
+        self.views = 1
+        self.dwell = timedelta(0)
+
+
+class StreamingSessionizer:
+    """Incremental sessionization with bounded open-session state"""
+
+    def __init__(self, emit, session_timeout=SESSION_TIMEOUT, max_open_sessions=MAX_OPEN_SESSIONS):
+        self.emit = emit
+        self.session_timeout = session_timeout
+        self.max_open_sessions = max_open_sessions
+        self.open_sessions = OrderedDict()  # least recently active first
+        self.users = {}
+        self.watermark = None
+        self.sessions_started = 0
+        self.counts = {'events': 0, 'rejected': 0, 'out_of_order': 0, 'evicted_early': 0}
+
+    def process(self, user, page, event_time):
+        """Add one page view"""
+
+        session = self.open_sessions.get(user)
+        if session is not None and event_time < session.last_time:
+            self.counts['out_of_order'] += 1
+            return
+        self.counts['events'] += 1
+
+        if session is not None and event_time - session.last_time <= self.session_timeout:
+            # The previous page's dwell runs until this event
+            session.dwell += event_time - session.last_time
+            session.last_time = event_time
+            session.views += 1
+            self.open_sessions.move_to_end(user)
+        else:
+            if session is not None:
+                self._close(self.open_sessions.pop(user))
+            self.sessions_started += 1
+            self.open_sessions[user] = OpenSession(user, self.sessions_started, event_time)
+
+        self.advance(event_time)
+        while len(self.open_sessions) > self.max_open_sessions:
+            self.counts['evicted_early'] += 1
+            self._close(self.open_sessions.popitem(last=False)[1])
+
+    def advance(self, watermark):
+        """Close sessions idle for longer than the timeout as of the given time"""
+
+        if self.watermark is None or watermark > self.watermark:
+            self.watermark = watermark
+        while self.open_sessions:
+            session = next(iter(self.open_sessions.values()))
+            if self.watermark - session.last_time <= self.session_timeout:
+                break
+            self._close(self.open_sessions.popitem(last=False)[1])
+
+    def flush(self):
+        """Close every open session (end of stream)"""
+
+        while self.open_sessions:
+            self._close(self.open_sessions.popitem(last=False)[1])
+
+    def _close(self, session):
+        """Emit a finished session (its last page has zero dwell) and the user's running totals"""
+
+        totals = self.users.setdefault(session.user, {
+            'Total_Visits': 0, 'Total_Pages_Viewed': 0, 'Total_Time': timedelta(0),
+            'First_Activity': session.start, 'Last_Activity': session.last_time
+        })
+        totals['Total_Visits'] += 1
+        totals['Total_Pages_Viewed'] += session.views
+        totals['Total_Time'] += session.dwell
+        totals['First_Activity'] = min(totals['First_Activity'], session.start)
+        totals['Last_Activity'] = max(totals['Last_Activity'], session.last_time)
+
+        self.emit({
+            'type': 'session', 'UserId': session.user, 'SessionId': session.session_id,
+            'Start': session.start.isoformat(), 'End': session.last_time.isoformat(),
+            'Page_Views': session.views, 'Duration_Seconds': session.dwell.total_seconds()
+        })
+        self.emit({
+            'type': 'user', 'UserId': session.user,
+            'Total_Visits': totals['Total_Visits'],
+            'Total_Pages_Viewed': totals['Total_Pages_Viewed'],
+            'Total_Time_Seconds': totals['Total_Time'].total_seconds(),
+            'First_Activity': totals['First_Activity'].isoformat(),
+            'Last_Activity': totals['Last_Activity'].isoformat()
+        })
+
+    def feed_line(self, line):
+        """Parse and process one JSONL event; placeholders and invalid dates are rejected"""
+
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            user = record['UserId']
+            event_time = datetime.fromisoformat(str(record['Date / Time']))
+        except (ValueError, KeyError, TypeError):
+            self.counts['rejected'] += 1
+            return
+        if user == 'UserName':
+            self.counts['rejected'] += 1
+            return
+        self.process(user, record.get('Page'), event_time)
+
+
+def jsonl_writer(f):
+    """Emit callback writing one JSON object per line"""
+
+    def emit(record):
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+    return emit
+
+
+def follow_file(path, sessionizer, follow=False):
+    """Read events from a file; with follow, keep reading appended lines like tail -f"""
+
+    with open(path) as f:
+        idle_since = time.monotonic()
+        while True:
+            line = f.readline()
+            if line.endswith('\n') or (line and not follow):
+                sessionizer.feed_line(line)
+                idle_since = time.monotonic()
+                continue
+            if not follow:
+                break
+            if line:
+                f.seek(f.tell() - len(line.encode()))  # partial line; wait for the rest
+            _close_idle(sessionizer, idle_since)
+            time.sleep(POLL_SECONDS)
+
+
+def listen(address, sessionizer):
+    """Read events from TCP connections on a local address, one connection at a time"""
+
+    host, port = address.rsplit(':', 1)
+    with socket.create_server((host, int(port))) as server:
+        print(f"Listening on {host}:{server.getsockname()[1]}", file=sys.stderr)
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile('r') as lines:
+                for line in lines:
+                    sessionizer.feed_line(line)
+
+
+def _close_idle(sessionizer, idle_since):
+    """While the stream is quiet, let stream time advance with the wall clock"""
+
+    if sessionizer.watermark is not None:
+        sessionizer.advance(sessionizer.watermark + timedelta(seconds=time.monotonic() - idle_since))
+
+
+def page_view_events(page_views):
+    """Export rows as JSONL event lines in arrival (time) order"""
+
+    stamps = parse_timestamps(page_views['Date / Time']).values
+    order = stamps.sort_values(kind='stable').index
+    for row in page_views.loc[order].itertuples(index=False):
+        user, page, stamp = row
+        yield json.dumps({'UserId': user, 'Page': str(page), 'Date / Time': str(stamp)}, default=str)
+
+
+def batch_user_totals(page_views, session_timeout=SESSION_TIMEOUT):
+    """Per-user totals from the batch PHASE 2B sessionization"""
+
+    from pipeline_backends import PandasBackend
+
+    backend = PandasBackend()
+    events = backend.sessionize(backend.clean(page_views.copy()), session_timeout)
+    totals = events.groupby('UserId').agg(
+        Total_Visits=('SessionId', 'nunique'),
+        Total_Pages_Viewed=('SessionId', 'size'),
+        Total_Time=('DwellTime', 'sum'),
+        First_Activity=('DateTime', 'min'),
+        Last_Activity=('DateTime', 'max')
+    )
+    totals['Total_Time_Seconds'] = totals['Total_Time'].dt.total_seconds()
+    totals.index = totals.index.astype(str)
+    return totals.drop(columns='Total_Time'), events['SessionId'].nunique()
+
+
+def replay(page_views_path, events_path=None, max_open_sessions=MAX_OPEN_SESSIONS):
+    """Stream an export through the sessionizer and compare with the batch results"""
+
+    page_views = read_page_views(page_views_path)
+    sessions = []
+    sessionizer = StreamingSessionizer(
+        lambda record: sessions.append(record) if record['type'] == 'session' else None,
+        max_open_sessions=max_open_sessions
+    )
+
+    start = time.perf_counter()
+    events_file = open(events_path, 'w') if events_path else None
+    for line in page_view_events(page_views):
+        if events_file:
+            events_file.write(line + '\n')
+        sessionizer.feed_line(line)
+    sessionizer.flush()
+    if events_file:
+        events_file.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Replayed {sessionizer.counts['events']:,} events in {elapsed:.2f}s "
+          f"({sessionizer.counts['events'] / elapsed:,.0f} events/s)")
+    print(f"  Rejected: {sessionizer.counts['rejected']}, out of order: {sessionizer.counts['out_of_order']}, "
+          f"evicted early: {sessionizer.counts['evicted_early']}")
+
+    streamed = pd.DataFrame({
+        str(user): {
+            'Total_Visits': t['Total_Visits'], 'Total_Pages_Viewed': t['Total_Pages_Viewed'],
+            'First_Activity': pd.Timestamp(t['First_Activity']), 'Last_Activity': pd.Timestamp(t['Last_Activity']),
+            'Total_Time_Seconds': t['Total_Time'].total_seconds()
+        } for user, t in sessionizer.users.items()
+    }).T
+    batch, batch_sessions = batch_user_totals(page_views)
+    streamed = streamed.reindex(index=batch.index, columns=batch.columns).astype(batch.dtypes.to_dict())
+
+    print(f"  Sessions: streamed {len(sessions):,}, batch {batch_sessions:,}")
+    print(f"  Users: streamed {len(sessionizer.users):,}, batch {len(batch):,}")
+    try:
+        pd.testing.assert_frame_equal(streamed, batch, check_exact=True)
+        match = len(sessions) == batch_sessions and len(sessionizer.users) == len(batch)
+    except AssertionError as e:
+        print(f"  ✗ Per-user totals differ: {e}")
+        match = False
+    print(f"{'✓' if match else '✗'} Batch results {'reproduced' if match else 'NOT reproduced'}")
+    return match
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sessionize a JSONL page-view stream')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='sessionize events from a file or local socket')
+    source = run_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='JSONL event file')
+    source.add_argument('--listen', help='local address to accept JSONL events on, e.g. 127.0.0.1:9009')
+    run_parser.add_argument('--follow', action='store_true', help='keep reading lines appended to --input')
+    run_parser.add_argument('--output', help='JSONL output for sessions and user totals (default: stdout)')
+    run_parser.add_argument('--max-open-sessions', type=int, default=MAX_OPEN_SESSIONS)
+
+    replay_parser = commands.add_parser('replay', help='stream an export through and compare with batch results')
+    replay_parser.add_argument('--page-views', default='Page_Views.xlsx')
+    replay_parser.add_argument('--write-events', help='also save the replayed events as JSONL')
+    replay_parser.add_argument('--max-open-sessions', type=int, default=MAX_OPEN_SESSIONS)
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        print("=" * 80)
+        print("STREAMING SESSIONIZER REPLAY")
+        print("=" * 80)
+        raise SystemExit(0 if replay(args.page_views, args.write_events, args.max_open_sessions) else 1)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # flush open sessions on termination
+    output = open(args.output, 'a') if args.output else sys.stdout
+    sessionizer = StreamingSessionizer(jsonl_writer(output), max_open_sessions=args.max_open_sessions)
+    try:
+        if args.input:
+            follow_file(args.input, sessionizer, follow=args.follow)
+        else:
+            listen(args.listen, sessionizer)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sessionizer.flush()
+        print(f"Events: {sessionizer.counts}", file=sys.stderr)
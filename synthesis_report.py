@@ -0,0 +1,187 @@
+"""
+Streaming generation of individual user summaries for the synthesis report
+Summaries are rendered column-wise in batches and written with buffered writers,
+optionally fanned out across worker processes
+"""
+
+import argparse
+import os
+from datetime import datetime
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from bootstrap_ci import interval_text
+
+SUMMARY_BATCH_SIZE = 500
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def render_summaries(metrics_df):
+    """Render one summary per row of a User_Metrics batch using column operations"""
+
+    col = {name: metrics_df[name].astype(str) for name in [
+        'Invite_Code', 'Total_Visits', 'Total_Time_Hours', 'First_Activity', 'Last_Activity',
+        'Days_Active', 'Total_Pages_Viewed', 'Sections_Visited', 'Lessons_Completed',
+        'Completion_Rate', 'Furthest_Page', 'Furthest_Content'
+    ]}
+
+    summaries = (
+        'User ' + col['Invite_Code'] + ' (Invite Code ' + col['Invite_Code'] + '):\n'
+        + '  • Engaged in ' + col['Total_Visits'] + ' sessions totaling ' + col['Total_Time_Hours'] + ' hours\n'
+        + '  • Activity span: ' + col['First_Activity'] + ' to ' + col['Last_Activity']
+        + ' (' + col['Days_Active'] + ' days)\n'
+        + '  • Viewed ' + col['Total_Pages_Viewed'] + ' pages across ' + col['Sections_Visited'] + '/6 sections\n'
+        + '  • Completed ' + col['Lessons_Completed'] + '/12 lessons (' + col['Completion_Rate'] + '% completion)\n'
+        + '  • Furthest progression: Page ' + col['Furthest_Page'] + ' - ' + col['Furthest_Content']
+    )
+    return summaries.tolist()
+
+
+def user_summary_path(user_dir, invite_code):
+    """Path of the per-user summary file for one participant"""
+
+    return os.path.join(user_dir, f"User_{invite_code}_Summary.txt")
+
+
+def _render_batch(batch, user_dir):
+    """Render a batch, write its per-user files and return the text for the synthesis file"""
+
+    summaries = render_summaries(batch)
+
+    if user_dir:
+        for invite_code, summary in zip(batch['Invite_Code'], summaries):
+            with open(user_summary_path(user_dir, invite_code), 'w') as f:
+                f.write(summary + "\n")
+
+    return "".join(summary + "\n\n" for summary in summaries)
+
+
+def iter_batches(metrics_df, batch_size=SUMMARY_BATCH_SIZE):
+    """Split User_Metrics into consecutive row batches"""
+
+    for start in range(0, len(metrics_df), batch_size):
+        yield metrics_df.iloc[start:start + batch_size]
+
+
+def summaries_heading(top_n, total_users):
+    """Heading for the individual summaries section"""
+
+    if top_n is None or top_n >= total_users:
+        return f"INDIVIDUAL USER SUMMARIES (All {total_users} Users by Engagement)"
+    return f"INDIVIDUAL USER SUMMARIES (Top {top_n} by Engagement)"
+
+
+def stream_summaries(f, metrics_df, top_n=20, user_dir=None, workers=1, batch_size=SUMMARY_BATCH_SIZE):
+    """Write individual summaries for the top-N (or all, when None) users to an open file"""
+
+    selected = metrics_df if top_n is None else metrics_df.head(top_n)
+    if user_dir:
+        os.makedirs(user_dir, exist_ok=True)
+
+    f.write("\n\n" + summaries_heading(top_n, len(metrics_df)) + "\n")
+    f.write("=" * 70 + "\n\n")
+
+    batches = iter_batches(selected, batch_size)
+    if workers > 1:
+        # map() yields in submission order, so the synthesis file stays ranked
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for text in pool.map(_render_batch, batches, repeat(user_dir)):
+                f.write(text)
+    else:
+        for batch in batches:
+            f.write(_render_batch(batch, user_dir))
+
+    return len(selected)
+
+
+def aggregate_summary_text(metrics_df, overview, user_stats, high_engagement, median_hours, intervals, section_stats,
+                           preview_note=''):
+    """Aggregate summary at the top of the synthesis report, with bootstrap intervals"""
+
+    # Identify dropout patterns (unique users per section, from the planned section table)
+    section_views = section_stats.set_index('Section')['Unique_Users'].sort_index().sort_values(ascending=False)
+    most_visited_section = section_views.index[0] if len(section_views) > 0 else 'Unknown'
+
+    return f"""
+VA CRAFT PTSD INTERVENTION - ENGAGEMENT ANALYSIS SUMMARY
+{'=' * 70}
+{preview_note}
+OVERALL PARTICIPATION
+{'-' * 30}
+• Total participants: {len(metrics_df)} users
+• Total engagement: {int(overview['Sessions']):,} sessions
+• Total page views: {int(overview['Page_Views']):,} pages
+• Study period: {overview['First_Activity'].date()} to {overview['Last_Activity'].date()}
+
+ENGAGEMENT METRICS
+{'-' * 30}
+• Average time per user: {user_stats['Mean_Hours']:.1f} hours ({interval_text(intervals, 'Mean_Hours')})
+• Median time per user: {median_hours:.1f} hours ({interval_text(intervals, 'Median_Hours')})
+• Average visits per user: {user_stats['Mean_Visits']:.1f} sessions ({interval_text(intervals, 'Mean_Visits')})
+• Average pages per visit: {user_stats['Mean_Pages_Per_Visit']:.1f} pages ({interval_text(intervals, 'Mean_Pages_Per_Visit')})
+
+COURSE COMPLETION
+{'-' * 30}
+• Full course completion: {user_stats['Completers']}/{len(metrics_df)} users ({user_stats['Completers']/len(metrics_df)*100:.1f}%)
+• Partial completion: {user_stats['Started']}/{len(metrics_df)} users
+• Average lessons completed: {user_stats['Mean_Lessons_Completed']:.1f} of 12 ({interval_text(intervals, 'Mean_Lessons_Completed')})
+• Never progressed beyond intro: {user_stats['Intro_Only']} users
+
+SECTION ENGAGEMENT
+{'-' * 30}
+{section_views.head().to_string()}
+
+HIGH ENGAGEMENT ANALYSIS
+{'-' * 30}
+Users with above-median engagement (>{median_hours:.1f} hours):
+• Count: {high_engagement['Users']} users
+• Average time: {high_engagement['Mean_Hours']:.1f} hours ({interval_text(intervals, 'High_Mean_Hours')})
+• Average completion: {high_engagement['Mean_Completion']:.1f}% ({interval_text(intervals, 'High_Mean_Completion')})
+• Average visits: {high_engagement['Mean_Visits']:.1f} ({interval_text(intervals, 'High_Mean_Visits')})
+• Completion vs below-median users: {intervals.estimates['Completion_Gap']:+.1f} points ({interval_text(intervals, 'Completion_Gap')})
+
+KEY INSIGHTS
+{'-' * 30}
+1. Engagement varies widely, with time spent ranging from {user_stats['Min_Hours']:.1f} to {user_stats['Max_Hours']:.1f} hours.
+
+2. The completion rate of {user_stats['Mean_Completion']:.1f}% ({interval_text(intervals, 'Mean_Completion')}) suggests room for improvement in retention strategies.
+
+3. {most_visited_section} is the most accessed section, engaged by {section_views.iloc[0] if len(section_views) > 0 else 0} users.
+
+4. Users who engage more (>{median_hours:.1f} hours) show {'significantly ' if intervals.low['Completion_Gap'] > 0 else ''}higher completion rates{'' if intervals.low['Completion_Gap'] > 0 else ' (the 95% interval of the difference includes zero)'}.
+
+5. The average of {user_stats['Mean_Visits']:.1f} visits per user suggests the intervention requires sustained engagement.
+
+{'=' * 70}
+Analysis completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+"""
+
+
+def write_synthesis_report(path, aggregate_summary, metrics_df, top_n=20, user_dir=None, workers=1,
+                           batch_size=SUMMARY_BATCH_SIZE):
+    """Write the synthesis report, streaming individual summaries after the aggregate summary"""
+
+    with open(path, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(aggregate_summary)
+        return stream_summaries(f, metrics_df, top_n, user_dir, workers, batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate individual user summaries from the metrics workbook')
+    parser.add_argument('--metrics', default='CRAFT_PTSD_Engagement_Metrics.xlsx')
+    parser.add_argument('--output', default='CRAFT_PTSD_User_Summaries.txt')
+    parser.add_argument('--top-n', type=int, default=None, help='number of users (default: all users)')
+    parser.add_argument('--user-dir', default=None, help='directory for one summary file per user')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=SUMMARY_BATCH_SIZE)
+    args = parser.parse_args()
+
+    metrics = pd.read_excel(args.metrics, sheet_name='User_Metrics')
+    with open(args.output, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+        written = stream_summaries(f, metrics, args.top_n, args.user_dir, args.workers, args.batch_size)
+
+    print(f"✓ {written} user summaries saved to: {args.output}")
+    if args.user_dir:
+        print(f"✓ Per-user summary files saved to: {args.user_dir}/")
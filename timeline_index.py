@@ -0,0 +1,290 @@
+"""
+CSR-style per-user and per-session timeline index over the sessionized events
+Events are sorted by user and time, so each user's events and each session's events
+are one contiguous row range. The index keeps offsets arrays in the style of a CSR
+sparse matrix:
+  user_offsets[u] .. user_offsets[u + 1]          rows of user u
+  session_offsets[s] .. session_offsets[s + 1]    rows of session s
+  user_sessions[u] .. user_sessions[u + 1]        sessions of user u
+so a participant's events are array slices (views, no copy) found with one
+dictionary lookup, independent of the size of the event table.
+
+The index is saved as a directory of .npy arrays (event times, page codes, dwell
+seconds, offsets) with a small JSON file of user IDs and page labels, and is
+memory-mapped on load, so a drill-down on tens of millions of events reads only
+the participant's rows.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+INDEX_VERSION = 1
+META_FILE = 'timeline.json'
+ARRAYS = ['date_times', 'pages', 'dwell_seconds', 'user_offsets', 'session_offsets', 'user_sessions']
+PAGE_COLUMNS = ['Title', 'Lesson', 'Section']
+
+
+def _offsets(codes, count):
+    """Start offsets of each code's run in a grouped code array, plus the end"""
+
+    return np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=count))]).astype(np.int64)
+
+
+class TimelineIndex:
+    """Zero-copy per-user and per-session slices of the event table"""
+
+    def __init__(self, user_ids, pages, arrays):
+        self.user_ids = [str(user) for user in user_ids]
+        self.pages = pages  # one dict per page code: Page, Title, Lesson, Section
+        self.date_times = arrays['date_times']
+        self.page_codes = arrays['pages']
+        self.dwell_seconds = arrays['dwell_seconds']
+        self.hits = arrays.get('hits')
+        self.user_offsets = arrays['user_offsets']
+        self.session_offsets = arrays['session_offsets']
+        self.user_sessions = arrays['user_sessions']
+        self._users = {user: code for code, user in enumerate(self.user_ids)}
+
+    @classmethod
+    def from_events(cls, events):
+        """Build the offsets from events grouped by user with sessions in time order"""
+
+        user_codes, user_ids = pd.factorize(events['UserId'], sort=False)
+        session_ids = events['SessionId'].to_numpy()
+        if np.any(np.diff(user_codes) < 0) or np.any(np.diff(session_ids) < 0):
+            raise ValueError('Events must be sorted by user and session before indexing')
+
+        page_codes, page_labels = pd.factorize(events['Page'].astype(str), sort=False)
+        first_rows = events.iloc[np.unique(page_codes, return_index=True)[1]]
+        pages = [
+            {'Page': str(page), **{column: _json_value(first_rows[column].iloc[i])
+                                   for column in PAGE_COLUMNS if column in events}}
+            for i, page in enumerate(page_labels)
+        ]
+
+        session_starts = np.flatnonzero(np.concatenate([[True], session_ids[1:] != session_ids[:-1]]))
+        user_offsets = _offsets(user_codes, len(user_ids))
+        arrays = {
+            'date_times': events['DateTime'].to_numpy(dtype='datetime64[us]'),
+            'pages': page_codes.astype(np.int32),
+            'dwell_seconds': events['DwellTimeSeconds'].to_numpy(),
+            'user_offsets': user_offsets,
+            'session_offsets': np.append(session_starts, len(events)).astype(np.int64),
+            # Sessions never span users, so a user's first session starts at the user's first row
+            'user_sessions': np.searchsorted(session_starts, user_offsets).astype(np.int64)
+        }
+        if 'Hits' in events:
+            arrays['hits'] = events['Hits'].to_numpy(dtype=np.int64)
+        return cls(pd.Series(user_ids, dtype=object).infer_objects().tolist(), pages, arrays)
+
+    def save(self, directory):
+        """Write the arrays as .npy files and the labels as JSON"""
+
+        os.makedirs(directory, exist_ok=True)
+        arrays = dict(zip(ARRAYS, [self.date_times, self.page_codes, self.dwell_seconds,
+                                   self.user_offsets, self.session_offsets, self.user_sessions]))
+        if self.hits is not None:
+            arrays['hits'] = self.hits
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, name + '.npy'), np.asarray(values))
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'users': self.user_ids, 'pages': self.pages,
+                       'arrays': sorted(arrays)}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Open a saved index; arrays are memory-mapped unless mmap=False"""
+
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"{directory} holds timeline index version {meta.get('version')}, "
+                             f"expected {INDEX_VERSION}; rebuild it")
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in meta['arrays']}
+        return cls(meta['users'], meta['pages'], arrays)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def user_code(self, user):
+        """Position of a user in the index (KeyError for unknown users)"""
+
+        try:
+            return self._users[str(user)]
+        except KeyError:
+            raise KeyError(f"Unknown user '{user}'") from None
+
+    def user_rows(self, user):
+        """Row range of a user's events"""
+
+        code = self.user_code(user)
+        return slice(int(self.user_offsets[code]), int(self.user_offsets[code + 1]))
+
+    def user_events(self, user):
+        """A user's event times, page codes and dwell seconds as array views"""
+
+        rows = self.user_rows(user)
+        return self.date_times[rows], self.page_codes[rows], self.dwell_seconds[rows]
+
+    def session_rows(self, user):
+        """Row ranges of each of a user's sessions, as an (n, 2) array of [start, end)"""
+
+        code = self.user_code(user)
+        bounds = self.session_offsets[self.user_sessions[code]:self.user_sessions[code + 1] + 1]
+        return np.column_stack([bounds[:-1], bounds[1:]])
+
+    def timeline(self, user):
+        """A participant's sessions with their pages, as JSON-ready dicts"""
+
+        rows = self.user_rows(user)
+        # Convert the user's slice once; sessions are then sub-ranges of these lists
+        times = np.datetime_as_string(self.date_times[rows], unit='s').tolist()
+        dwell = self.dwell_seconds[rows].astype(np.float64)
+        pages = [self.pages[code] for code in self.page_codes[rows].tolist()]
+        hits = self.hits[rows].tolist() if self.hits is not None else None
+        dwell_list = dwell.tolist()
+
+        sessions = []
+        for number, (start, end) in enumerate(self.session_rows(user) - rows.start, start=1):
+            session_pages = [
+                {'Time': times[i], **pages[i], 'Dwell_Seconds': dwell_list[i]} for i in range(start, end)
+            ]
+            if hits is not None:
+                for page, count in zip(session_pages, hits[start:end]):
+                    page['Hits'] = count
+            sessions.append({
+                'Session': number,
+                'Start': times[start],
+                'End': times[end - 1],
+                'Page_Views': sum(hits[start:end]) if hits is not None else int(end - start),
+                'Duration_Seconds': float(dwell[start:end].sum()),
+                'Pages': session_pages
+            })
+        return {'UserId': self.user_ids[self.user_code(user)], 'Sessions': sessions}
+
+
+def _json_value(value):
+    """Plain JSON value (missing values become None)"""
+
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def print_timeline(timeline):
+    """Human-readable sessions and pages"""
+
+    sessions = timeline['Sessions']
+    print(f"User {timeline['UserId']}: {len(sessions)} sessions, "
+          f"{sum(s['Page_Views'] for s in sessions):,} page views, "
+          f"{sum(s['Duration_Seconds'] for s in sessions) / 3600:.2f} hours")
+    for session in sessions:
+        print(f"\n  Session {session['Session']}: {session['Start']} to {session['End']} "
+              f"({session['Page_Views']} pages, {session['Duration_Seconds'] / 60:.1f} min)")
+        for page in session['Pages']:
+            print(f"    {page['Time'][11:]}  {page['Page']:>5}  {page['Dwell_Seconds']:8.1f}s  "
+                  f"{page.get('Lesson') or '':<10} {page.get('Title') or ''}")
+
+
+def build_from_exports(page_views_path, dictionary_path, session_timeout_minutes=30):
+    """Clean, sessionize and enrich an export with the pandas backend, then index it"""
+
+    from datetime import timedelta
+    from export_readers import read_page_views
+    from pipeline_backends import PandasBackend
+
+    backend = PandasBackend()
+    events = backend.sessionize(backend.clean(read_page_views(page_views_path)),
+                                timedelta(minutes=session_timeout_minutes))
+    events = backend.enrich(events, pd.read_csv(dictionary_path))
+    return TimelineIndex.from_events(events), events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-user timeline index: build, look up a participant, benchmark')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='index a page-view export')
+    build_parser.add_argument('--page-views', default='Page_Views.xlsx')
+    build_parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    build_parser.add_argument('--index', default='CRAFT_PTSD_Timeline_Index')
+
+    timeline_parser = commands.add_parser('timeline', help="print one participant's sessions and pages")
+    timeline_parser.add_argument('user')
+    timeline_parser.add_argument('--index', default='CRAFT_PTSD_Timeline_Index')
+    timeline_parser.add_argument('--json', action='store_true', help='print the timeline as JSON')
+
+    bench_parser = commands.add_parser('benchmark', help='compare index lookups with boolean masks')
+    bench_parser.add_argument('--page-views', default='Page_Views.xlsx')
+    bench_parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    bench_parser.add_argument('--scale', type=int, default=200, help='replicate the export N times with new user IDs')
+    bench_parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'timeline':
+        start = time.perf_counter()
+        timeline = TimelineIndex.load(args.index).timeline(args.user)
+        elapsed = time.perf_counter() - start
+        if args.json:
+            print(json.dumps(timeline, indent=2, ensure_ascii=False))
+        else:
+            print_timeline(timeline)
+            print(f"\n(loaded and looked up in {elapsed * 1000:.1f} ms)")
+        raise SystemExit(0)
+
+    print("=" * 80)
+    print("TIMELINE INDEX" if args.command == 'build' else "TIMELINE INDEX BENCHMARK")
+    print("=" * 80)
+
+    if args.command == 'build':
+        index, events = build_from_exports(args.page_views, args.dictionary)
+        index.save(args.index)
+        print(f"✓ Indexed {len(events):,} events, {len(index)} users, "
+              f"{len(index.session_offsets) - 1:,} sessions into {args.index}/")
+        raise SystemExit(0)
+
+    from benchmark_backends import replicate_page_views
+    from datetime import timedelta
+    from export_readers import read_page_views
+    from pipeline_backends import PandasBackend
+
+    backend = PandasBackend(lean=True)
+    page_views = replicate_page_views(read_page_views(args.page_views), args.scale)
+    events = backend.sessionize(backend.clean(page_views), timedelta(minutes=30))
+    events = backend.enrich(events, pd.read_csv(args.dictionary))
+    del page_views
+    print(f"Input: {len(events):,} events (scale x{args.scale})")
+
+    start = time.perf_counter()
+    index = TimelineIndex.from_events(events)
+    print(f"  Build: {time.perf_counter() - start:.2f}s for {len(index):,} users")
+    index.save('timeline_benchmark_index')
+    index = TimelineIndex.load('timeline_benchmark_index')
+
+    rng = np.random.default_rng(0)
+    users = [index.user_ids[i] for i in rng.integers(0, len(index), args.lookups)]
+    user_column = events['UserId'].astype(str)
+
+    start = time.perf_counter()
+    masked = [events.loc[user_column == user, 'DwellTimeSeconds'].sum() for user in users[:20]]
+    mask_seconds = (time.perf_counter() - start) / 20
+    start = time.perf_counter()
+    indexed = [index.user_events(user)[2].sum(dtype=np.float64) for user in users]
+    index_seconds = (time.perf_counter() - start) / len(users)
+    start = time.perf_counter()
+    for user in users:
+        index.timeline(user)
+    timeline_seconds = (time.perf_counter() - start) / len(users)
+
+    print(f"  Boolean mask per user:   {mask_seconds * 1000:10.3f} ms")
+    print(f"  Index slice per user:    {index_seconds * 1000:10.3f} ms ({mask_seconds / index_seconds:,.0f}x)")
+    print(f"  Full timeline per user:  {timeline_seconds * 1000:10.3f} ms")
+    ok = np.allclose(masked, indexed[:20], rtol=1e-6)
+    print(f"{'✓' if ok else '✗'} Index slices {'match' if ok else 'DO NOT match'} the masked rows")
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,363 @@
+"""
+Dense per-user engagement feature matrix for modeling
+One float32 row per user and one column per feature: totals, minutes per section
+and per lesson, started/completed bits per lesson, session-length statistics,
+gaps between sessions and recency. The columns depend only on the data dictionary
+(its sections, in dictionary order) and the number of lessons, so runs on new
+exports of the same course produce the same schema; the schema hash in the
+metadata changes whenever the columns do.
+
+The matrix is saved as a C-ordered .npy file with a JSON file of column names,
+groups and user IDs, in the style of the timeline index, and is memory-mapped on
+load. Missing values are NaN: gap statistics and the standard deviation of session
+length are undefined for users with a single session.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from engagement_metrics import TOTAL_LESSONS
+from lesson_bitsets import lesson_numbers
+
+FEATURE_VERSION = 1
+MATRIX_FILE = 'features.npy'
+META_FILE = 'features.json'
+UNSECTIONED = 'Unsectioned'
+
+# Columns taken as-is from the User_Metrics table
+TOTAL_COLUMNS = {
+    'Total_Visits': 'Total_Visits',
+    'Total_Pages_Viewed': 'Total_Pages_Viewed',
+    'Total_Minutes': 'Total_Time_Minutes',
+    'Days_Active': 'Days_Active',
+    'Sections_Visited': 'Sections_Visited',
+    'Lessons_Started': 'Lessons_Started',
+    'Lessons_Completed': 'Lessons_Completed',
+    'Completion_Rate': 'Completion_Rate',
+    'Furthest_Lesson': 'Furthest_Lesson',
+    'Course_Percent_Reached': 'Course_Percent_Reached'
+}
+SESSION_COLUMNS = ['Session_Minutes_Mean', 'Session_Minutes_Median', 'Session_Minutes_Max', 'Session_Minutes_Std',
+                   'Session_Pages_Mean']
+GAP_COLUMNS = ['Gap_Days_Mean', 'Gap_Days_Median', 'Gap_Days_Min', 'Gap_Days_Max']
+RECENCY_COLUMNS = ['Days_Since_First_Activity', 'Days_Since_Last_Activity']
+
+FeatureColumn = namedtuple('FeatureColumn', ['name', 'group'])
+
+
+def dictionary_sections(data_dict):
+    """Section labels in the order they first appear in the data dictionary"""
+
+    return data_dict['Section'].dropna().astype(str).drop_duplicates().tolist()
+
+
+def feature_schema(sections, total_lessons=TOTAL_LESSONS):
+    """Feature columns, in matrix order, for the given sections and number of lessons"""
+
+    lessons = [f'{lesson:02d}' for lesson in range(1, total_lessons + 1)]
+    return (
+        [FeatureColumn(name, 'totals') for name in TOTAL_COLUMNS]
+        + [FeatureColumn('Minutes_' + section.replace(' ', '_'), 'section_minutes') for section in sections]
+        + [FeatureColumn('Minutes_' + UNSECTIONED, 'section_minutes')]
+        + [FeatureColumn(f'Minutes_Lesson_{lesson}', 'lesson_minutes') for lesson in lessons]
+        + [FeatureColumn(f'Started_Lesson_{lesson}', 'lesson_started') for lesson in lessons]
+        + [FeatureColumn(f'Completed_Lesson_{lesson}', 'lesson_completed') for lesson in lessons]
+        + [FeatureColumn(name, 'sessions') for name in SESSION_COLUMNS]
+        + [FeatureColumn(name, 'gaps') for name in GAP_COLUMNS]
+        + [FeatureColumn(name, 'recency') for name in RECENCY_COLUMNS]
+    )
+
+
+def schema_hash(columns):
+    """Short SHA-256 of the column names and groups"""
+
+    text = '\n'.join(f'{column.name}\t{column.group}' for column in columns)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _mask_bits(masks, total_lessons):
+    """One 0/1 column per lesson from integer bitmasks"""
+
+    masks = np.asarray(masks, dtype=np.int64)
+    return (masks[:, None] >> np.arange(total_lessons)) & 1
+
+
+def session_table(events, user_codes):
+    """One row per session: user code, start, end, minutes (summed dwell) and page views"""
+
+    compacted = 'Hits' in events
+    sessions = pd.DataFrame({
+        'User': user_codes,
+        'SessionId': events['SessionId'].to_numpy(),
+        'DateTime': events['DateTime'].to_numpy(),
+        'End': events['LastDateTime' if compacted else 'DateTime'].to_numpy(),
+        'Dwell': events['DwellTimeSeconds'].to_numpy(dtype=np.float64),
+        'Hits': events['Hits'].to_numpy() if compacted else 1
+    }).groupby('SessionId', sort=False).agg(
+        User=('User', 'first'),
+        Start=('DateTime', 'min'),
+        End=('End', 'max'),
+        Seconds=('Dwell', 'sum'),
+        Pages=('Hits', 'sum')
+    )
+    sessions = sessions.sort_values(['User', 'Start'], kind='stable', ignore_index=True)
+    sessions['Minutes'] = sessions['Seconds'] / 60
+    return sessions
+
+
+def _session_features(sessions, user_count):
+    """Session-length and inter-session gap statistics, and first and last activity, per user code"""
+
+    by_user = sessions.groupby('User')
+    minutes = by_user['Minutes']
+    session_features = pd.DataFrame({
+        'Session_Minutes_Mean': minutes.mean(),
+        'Session_Minutes_Median': minutes.median(),
+        'Session_Minutes_Max': minutes.max(),
+        'Session_Minutes_Std': minutes.std(ddof=1),
+        'Session_Pages_Mean': by_user['Pages'].mean(),
+        'First': by_user['Start'].min(),
+        'Last': by_user['End'].max()
+    })
+
+    # Gap from the end of one session to the start of the user's next session
+    users = sessions['User'].to_numpy()
+    follows = np.r_[False, users[1:] == users[:-1]]
+    gaps = (sessions['Start'].to_numpy()[1:] - sessions['End'].to_numpy()[:-1]) / np.timedelta64(1, 'D')
+    gaps = pd.Series(np.r_[np.nan, gaps][follows]).groupby(users[follows])
+    gap_features = pd.DataFrame({
+        'Gap_Days_Mean': gaps.mean(),
+        'Gap_Days_Median': gaps.median(),
+        'Gap_Days_Min': gaps.min(),
+        'Gap_Days_Max': gaps.max()
+    })
+    return pd.concat([session_features, gap_features], axis=1).reindex(range(user_count))
+
+
+class FeatureMatrix:
+    """float32 users x features matrix with its column schema and user IDs"""
+
+    def __init__(self, user_ids, columns, values, reference_time=None):
+        self.user_ids = [str(user) for user in user_ids]
+        self.columns = [FeatureColumn(*column) for column in columns]
+        self.values = values
+        self.reference_time = reference_time
+        self._users = {user: row for row, user in enumerate(self.user_ids)}
+
+    @classmethod
+    def from_metrics(cls, metrics_df, events, sections, reference_time=None, total_lessons=TOTAL_LESSONS):
+        """Build the matrix for the users of metrics_df (in its row order) from their enriched events
+
+        sections: the dictionary's section labels (dictionary_sections); reference_time:
+        the time recency is measured from (default: the last event)
+        """
+
+        user_ids = metrics_df['Invite_Code'].to_numpy()
+        user_count = len(user_ids)
+        user_codes = pd.Index(user_ids).get_indexer(np.asarray(events['UserId']))
+        if np.any(user_codes < 0):
+            raise ValueError('Events include users that are not in metrics_df')
+        dwell = events['DwellTimeSeconds'].to_numpy(dtype=np.float64)
+        last_times = events['LastDateTime' if 'Hits' in events else 'DateTime']
+        reference_time = pd.Timestamp(last_times.max() if reference_time is None else reference_time)
+
+        # Minutes per (user, section) and (user, lesson) as flattened 2-D bincounts;
+        # pages outside every section (or lesson) go to the extra last column (or lesson 0)
+        section_codes = pd.Index(sections).get_indexer(np.asarray(events['Section'], dtype=object))
+        section_codes = np.where(section_codes < 0, len(sections), section_codes)
+        section_minutes = np.bincount(user_codes * (len(sections) + 1) + section_codes, weights=dwell,
+                                      minlength=user_count * (len(sections) + 1)).reshape(user_count, -1) / 60
+        lessons = lesson_numbers(events['Lesson'])
+        lessons = np.where(lessons > total_lessons, 0, lessons)
+        lesson_minutes = np.bincount(user_codes * (total_lessons + 1) + lessons, weights=dwell,
+                                     minlength=user_count * (total_lessons + 1)).reshape(user_count, -1)[:, 1:] / 60
+
+        sessions = _session_features(session_table(events, user_codes), user_count)
+        recency = np.column_stack([
+            ((reference_time - sessions['First']) / pd.Timedelta(days=1)).to_numpy(),
+            ((reference_time - sessions['Last']) / pd.Timedelta(days=1)).to_numpy()
+        ])
+
+        blocks = [
+            metrics_df[list(TOTAL_COLUMNS.values())].to_numpy(dtype=np.float64),
+            section_minutes,
+            lesson_minutes,
+            _mask_bits(metrics_df['Lessons_Started_Mask'], total_lessons),
+            _mask_bits(metrics_df['Lessons_Completed_Mask'], total_lessons),
+            sessions[SESSION_COLUMNS + GAP_COLUMNS].to_numpy(dtype=np.float64),
+            recency
+        ]
+        values = np.ascontiguousarray(np.hstack(blocks), dtype=np.float32)
+        return cls(pd.Series(user_ids, dtype=object).tolist(), feature_schema(sections, total_lessons), values,
+                   reference_time.isoformat())
+
+    def save(self, directory):
+        """Write the matrix as .npy and the schema and user IDs as JSON"""
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, MATRIX_FILE), np.ascontiguousarray(self.values, dtype=np.float32))
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({
+                'version': FEATURE_VERSION,
+                'schema_hash': schema_hash(self.columns),
+                'shape': list(self.values.shape),
+                'dtype': 'float32',
+                'reference_time': self.reference_time,
+                'columns': [{'name': column.name, 'group': column.group} for column in self.columns],
+                'users': self.user_ids
+            }, f, indent=1)
+
+    @classmethod
+    def load(cls, directory, mmap=True, expected_schema=None):
+        """Open a saved matrix; memory-mapped (read-only, no copy) unless mmap=False
+
+        expected_schema: a schema hash the columns must match, e.g. the one a model was trained on
+        """
+
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('version') != FEATURE_VERSION:
+            raise ValueError(f"{directory} holds feature matrix version {meta.get('version')}, "
+                             f"expected {FEATURE_VERSION}; rebuild it")
+        if expected_schema is not None and meta['schema_hash'] != expected_schema:
+            raise ValueError(f"{directory} has feature schema {meta['schema_hash']}, expected {expected_schema}")
+        values = np.load(os.path.join(directory, MATRIX_FILE), mmap_mode='r' if mmap else None)
+        columns = [(column['name'], column['group']) for column in meta['columns']]
+        return cls(meta['users'], columns, values, meta['reference_time'])
+
+    @property
+    def names(self):
+        return [column.name for column in self.columns]
+
+    @property
+    def schema_hash(self):
+        return schema_hash(self.columns)
+
+    def group(self, group):
+        """Column positions of one feature group"""
+
+        return [i for i, column in enumerate(self.columns) if column.group == group]
+
+    def row(self, user):
+        """One user's features as a view (KeyError for unknown users)"""
+
+        try:
+            return self.values[self._users[str(user)]]
+        except KeyError:
+            raise KeyError(f"Unknown user '{user}'") from None
+
+    def to_frame(self):
+        """Copy as a DataFrame indexed by user ID"""
+
+        return pd.DataFrame(np.asarray(self.values), index=pd.Index(self.user_ids, name='UserId'), columns=self.names)
+
+
+def naive_user_features(metrics_df, events, sections, reference_time, total_lessons=TOTAL_LESSONS):
+    """Reference implementation: one user at a time with boolean masks"""
+
+    rows = []
+    last_column = 'LastDateTime' if 'Hits' in events else 'DateTime'
+    all_lessons = lesson_numbers(events['Lesson'])
+    for _, user in metrics_df.iterrows():
+        in_user = (events['UserId'] == user['Invite_Code']).to_numpy()
+        user_events = events[in_user]
+        row = [float(user[column]) for column in TOTAL_COLUMNS.values()]
+        section_labels = user_events['Section'].astype(object)
+        for section in sections:
+            row.append(user_events.loc[section_labels == section, 'DwellTimeSeconds'].sum() / 60)
+        row.append(user_events.loc[~section_labels.isin(sections), 'DwellTimeSeconds'].sum() / 60)
+        lessons = all_lessons[in_user]
+        for lesson in range(1, total_lessons + 1):
+            row.append(user_events['DwellTimeSeconds'].to_numpy()[lessons == lesson].sum() / 60)
+        for mask in (user['Lessons_Started_Mask'], user['Lessons_Completed_Mask']):
+            row.extend(int(mask) >> bit & 1 for bit in range(total_lessons))
+
+        sessions = user_events.groupby('SessionId').agg(
+            Start=('DateTime', 'min'), End=(last_column, 'max'), Seconds=('DwellTimeSeconds', 'sum'),
+            Pages=('Hits', 'sum') if 'Hits' in events else ('Page', 'size')
+        ).sort_values('Start')
+        minutes = sessions['Seconds'] / 60
+        row.extend([minutes.mean(), minutes.median(), minutes.max(), minutes.std(), sessions['Pages'].mean()])
+        gaps = (sessions['Start'].iloc[1:].to_numpy() - sessions['End'].iloc[:-1].to_numpy()) / np.timedelta64(1, 'D')
+        row.extend([gaps.mean(), np.median(gaps), gaps.min(), gaps.max()] if len(gaps) else [np.nan] * 4)
+        reference_time = pd.Timestamp(reference_time)
+        row.append((reference_time - user_events['DateTime'].min()) / pd.Timedelta(days=1))
+        row.append((reference_time - user_events[last_column].max()) / pd.Timedelta(days=1))
+        rows.append(row)
+    return np.array(rows, dtype=np.float32)
+
+
+def print_features(features):
+    """Shape, schema and feature groups"""
+
+    groups = pd.Series([column.group for column in features.columns]).value_counts(sort=False)
+    print(f"  {features.values.shape[0]} users x {features.values.shape[1]} features (float32), "
+          f"schema {features.schema_hash}")
+    print("  Groups: " + ', '.join(f"{group} {count}" for group, count in groups.items()))
+    missing = np.isnan(np.asarray(features.values)).sum()
+    if missing:
+        print(f"  Missing values (single-session gaps and spreads): {missing:,}")
+
+
+if __name__ == "__main__":
+    from datetime import timedelta
+
+    from benchmark_backends import replicate_page_views
+    from course_progress import load_course_order
+    from engagement_metrics import user_metrics_table
+    from export_readers import read_page_views
+    from pipeline_backends import PandasBackend
+
+    parser = argparse.ArgumentParser(description='Build the per-user feature matrix from the exports, with a check and benchmark')
+    parser.add_argument('--page-views', default='Page_Views.xlsx')
+    parser.add_argument('--dictionary', default='Data_Dictionary_FINAL.csv')
+    parser.add_argument('--course-structure', default='course_structure_complete.csv')
+    parser.add_argument('--output', default='CRAFT_PTSD_Features')
+    parser.add_argument('--scale', type=int, default=50, help='replicate the export N times for the benchmark')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("USER FEATURE MATRIX")
+    print("=" * 80)
+
+    data_dict = pd.read_csv(args.dictionary)
+    course_order = load_course_order(args.course_structure)
+    sections = dictionary_sections(data_dict)
+    page_views = read_page_views(args.page_views)
+
+    def build(page_views):
+        backend = PandasBackend()
+        events = backend.enrich(backend.sessionize(backend.clean(page_views), timedelta(minutes=30)), data_dict)
+        users = backend.collect(events).users.set_index('UserId')
+        metrics_df, _ = user_metrics_table(users, events, course_order, data_dict)
+        start = time.perf_counter()
+        features = FeatureMatrix.from_metrics(metrics_df, events, sections)
+        return features, metrics_df, events, time.perf_counter() - start
+
+    features, metrics_df, events, seconds = build(page_views)
+    features.save(args.output)
+    loaded = FeatureMatrix.load(args.output, expected_schema=features.schema_hash)
+    print_features(loaded)
+    print(f"✓ Saved to {args.output}/ ({os.path.getsize(os.path.join(args.output, MATRIX_FILE)):,} bytes); "
+          f"memory-mapped on load: {isinstance(loaded.values, np.memmap)}")
+
+    # Totals must agree with the workbook, and every value with the per-user reference
+    expected = naive_user_features(metrics_df, events, sections, features.reference_time)
+    print(f"Matches per-user reference: {np.allclose(loaded.values, expected, rtol=1e-6, equal_nan=True)}")
+    time_columns = features.group('section_minutes')
+    print(f"Section minutes add up to total minutes: "
+          f"{np.allclose(features.values[:, time_columns].sum(axis=1), metrics_df['Total_Time_Minutes'], atol=0.06)}")
+
+    scaled, scaled_metrics, scaled_events, seconds = build(replicate_page_views(page_views, args.scale))
+    start = time.perf_counter()
+    naive_user_features(scaled_metrics.head(200), scaled_events, sections, scaled.reference_time)
+    naive_seconds = (time.perf_counter() - start) * len(scaled_metrics) / 200
+    print(f"\n{len(scaled_events):,} events, {len(scaled_metrics):,} users: {seconds:.2f}s "
+          f"(per-user loop: ~{naive_seconds:.0f}s, estimated from 200 users)")
@@ -12,6 +12,7 @@ import json
 import os
 import sys
 from datetime import datetime
+from timestamps import parse_timestamps
 
 print("=" * 80)
 print("HALLUCINATION DETECTION VALIDATION")
@@ -70,7 +71,7 @@ try:
         checks_passed.append(False)
 
     # Check 2: Invalid dates exist (proves real data issues)
-    has_invalid_dates = page_views['Date / Time'].astype(str).str.startswith('0000').any()
+    has_invalid_dates = parse_timestamps(page_views['Date / Time']).invalid > 0
     if has_invalid_dates:
         print("✓ Contains '0000' invalid dates (real data issues)")
         checks_passed.append(True)
@@ -216,7 +217,7 @@ try:
         all_tests_passed = False
 
     # Check date range
-    dates = pd.to_datetime(page_views['Date / Time'], errors='coerce').dropna()
+    dates = parse_timestamps(page_views['Date / Time']).values.dropna()
     date_range = (dates.max() - dates.min()).days
     if 1000 < date_range < 1500:
         print(f"✓ Study duration: {date_range} days (multi-year study)")
@@ -10,6 +10,7 @@ import hashlib
 import json
 import os
 from datetime import datetime
+from timestamps import parse_timestamps, print_rejections
 
 print("=" * 80)
 print("DATA INTEGRITY VERIFICATION FOR VA CRAFT PTSD ANALYSIS")
@@ -67,7 +68,9 @@ try:
     print(f"\nData Statistics:")
     print(f"  Unique users: {page_views['UserId'].nunique()}")
     print(f"  Unique pages: {page_views['Page'].nunique()}")
-    print(f"  Date range: {pd.to_datetime(page_views['Date / Time']).min()} to {pd.to_datetime(page_views['Date / Time']).max()}")
+    timestamps = parse_timestamps(page_views['Date / Time'])
+    print(f"  Date range: {timestamps.values.min()} to {timestamps.values.max()}")
+    print_rejections(timestamps)
 
     # Sample of page IDs to verify they're numeric
     sample_pages = page_views['Page'].value_counts().head(10)
@@ -0,0 +1,709 @@
+"""
+Parallel sharded decoding of large xlsx worksheets
+pd.read_excel parses the worksheet XML on one core. This reader reads the shared
+strings table once in the parent, streams the worksheet XML out of the zip and cuts
+it at row boundaries into shards of about SHARD_BYTES, and decodes the shards in
+worker processes. Regularly written cells are tokenized by one regular expression
+per shard. A shard containing any cell the expression does not match is decoded
+instead by an incremental (pull) XML parser. Workers return typed cell arrays (row,
+column, kind, number, string index). The parent concatenates them in order and builds
+each column with the dtype pd.read_excel would give it:
+  - numbers: int64, or float64 if any are fractional or missing
+  - booleans: bool, or float64 (1.0/0.0/NaN) if any are missing
+  - text: str, with pandas' default NA strings ('NA', 'N/A', 'null', ...) as missing
+  - date-formatted numbers: datetime64 (in the workbook's 1900 or 1904 date system)
+  - anything mixed: object, holding Python ints, floats, strs and bools
+As in pd.read_excel, the first worksheet row is the header, blank rows between data
+rows are kept as all-missing rows, trailing blank rows are dropped, and cells with
+no value (such as formulas without a cached result) do not add columns. Exports
+longer than Excel's row limit continue on further worksheets; read_xlsx_sheets
+stacks them.
+"""
+
+import argparse
+import html
+import os
+import re
+import time
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from xml.etree import ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from timestamps import EXCEL_EPOCH
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+CELL_TAG = f'{{{MAIN_NS}}}c'
+ROW_TAG = f'{{{MAIN_NS}}}row'
+VALUE_TAG = f'{{{MAIN_NS}}}v'
+TEXT_TAG = f'{{{MAIN_NS}}}t'
+RUN_TAG = f'{{{MAIN_NS}}}r'
+SHARED_STRING_TAG = f'{{{MAIN_NS}}}si'
+
+SHARD_BYTES = 8 << 20   # decompressed worksheet XML per shard
+FEED_BYTES = 1 << 16    # bytes handed to the pull parser at a time
+EXCEL_MAX_ROWS = 1_048_576
+CHUNK_ROWS = 100_000    # rows formatted at a time by the synthetic writer
+
+# Cell kinds returned by workers (DATE is assigned in the parent from cell styles)
+EMPTY, NUMBER, SHARED, INLINE, BOOLEAN, DATE = range(6)
+
+# Cells as Excel, xlsxwriter, openpyxl and LibreOffice write them (attributes r, s, t
+# in that order, optional formula, then a value or an inline string). Shards with any
+# cell this does not match are decoded by the pull parser instead.
+CELL_PATTERN = re.compile(
+    rb'<c r="([A-Z]+)([0-9]+)"(?: s="([0-9]+)")?(?: t="([a-zA-Z]+)")?\s*'
+    rb'(?:/>|>(?:<f[^>]*/>|<f[^>]*>[^<]*</f>)?(?:<v>([^<]*)</v>|<is>(.*?)</is>)?</c>)', re.S
+)
+INLINE_TEXT_PATTERN = re.compile(rb'<t(?: [^>]*)?>([^<]*)</t>')
+SHARED_STRING_PATTERN = re.compile(rb'<si><t(?: [^>]*)?>([^<]*)</t></si>|<si>(.*?)</si>|<si/>', re.S)
+
+# Strings pandas reads as missing by default (its na_values documentation)
+NA_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+              'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# Serial day 0 of the 1904 date system (workbookPr date1904="1")
+EXCEL_EPOCH_1904 = np.datetime64('1904-01-01', 'us')
+HEADER_ROW = 1
+
+# Built-in number formats that display dates or times
+DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+DATE_FORMAT_CODE = re.compile(r'[dmyhs]', re.IGNORECASE)
+
+
+def _column_index(reference):
+    """Zero-based column index from a cell reference such as 'AB12'"""
+
+    index = 0
+    for char in reference:
+        if char.isdigit():
+            break
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _cell_text(element):
+    """Text of a shared or inline string: its <t>, or its rich-text runs (phonetic runs excluded)"""
+
+    parts = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            parts.append(child.text or '')
+        elif child.tag == RUN_TAG:
+            parts.extend(t.text or '' for t in child.iter(TEXT_TAG))
+    return ''.join(parts)
+
+
+def _markup_text(body):
+    """Text of an <si> or <is> body given as raw XML"""
+
+    return _cell_text(ET.fromstring(b'<is xmlns="' + MAIN_NS.encode() + b'">' + body + b'</is>'))
+
+
+def _decode_utf8(items):
+    """Decode many byte strings at once, with an XML parser's line-end normalization and references"""
+
+    strings = b'\x00'.join(items).decode().split('\x00') if items else []
+    for i, string in enumerate(strings):
+        if '\r' in string:
+            string = strings[i] = string.replace('\r\n', '\n').replace('\r', '\n')
+        if '&' in string:
+            strings[i] = html.unescape(string)
+    return strings
+
+
+def decode_shard(data):
+    """Decode a run of complete <row> elements into typed cell arrays"""
+
+    return _decode_shard_fast(data) or _decode_shard_pull(data)
+
+
+def _decode_shard_fast(data):
+    """Regular-expression decoder for regularly written cells, or None if any cell is unusual"""
+
+    cells = CELL_PATTERN.findall(data)
+    if len(cells) != data.count(b'<c ') + data.count(b'<c>'):
+        return None
+    if not cells:
+        return _decode_shard_pull(data)
+
+    letters, rows, styles, types, values, inline = (np.array(group) for group in zip(*cells))
+    # Column letters as base-26 digits ('A' = 1); shorter references are zero-padded on the right
+    digits = letters.view(np.uint8).reshape(len(cells), -1).astype(np.int32)
+    columns = np.zeros(len(cells), dtype=np.int32)
+    for position in range(digits.shape[1]):
+        present = digits[:, position] > 0
+        columns[present] = columns[present] * 26 + digits[present, position] - 64
+    columns -= 1
+
+    kinds = np.full(len(cells), NUMBER, dtype=np.int8)
+    kinds[types == b's'] = SHARED
+    kinds[types == b'b'] = BOOLEAN
+    string_cells = (types == b'str') | (types == b'e')
+    kinds[values == b''] = EMPTY
+    kinds[string_cells & (values != b'')] = INLINE
+    inline_cells = types == b'inlineStr'
+    kinds[inline_cells] = INLINE
+
+    numbers = np.full(len(cells), np.nan)
+    numeric = (kinds == NUMBER) | (kinds == BOOLEAN)
+    numbers[numeric] = values[numeric].astype(np.float64)
+    indices = np.full(len(cells), -1, dtype=np.int64)
+    shared = kinds == SHARED
+    indices[shared] = values[shared].astype(np.int64)
+
+    texts = np.empty(len(cells), dtype=object)
+    plain = string_cells & (kinds == INLINE)
+    texts[plain] = _decode_utf8(values[plain].tolist())
+    bodies = inline[inline_cells].tolist()
+    simple = [INLINE_TEXT_PATTERN.fullmatch(body) for body in bodies]
+    texts[inline_cells] = _decode_utf8([match.group(1) if match else b'' for match in simple])
+    rich = np.flatnonzero(inline_cells)[[match is None for match in simple]]
+    texts[rich] = [_markup_text(body) for body in inline[rich].tolist()]
+    text_cells = kinds == INLINE
+    indices[text_cells] = np.arange(text_cells.sum())
+
+    return {
+        'rows': rows.astype(np.int64), 'columns': columns, 'kinds': kinds, 'numbers': numbers,
+        'indices': indices, 'styles': np.where(styles == b'', b'0', styles).astype(np.int32),
+        'texts': texts[text_cells].tolist()
+    }
+
+
+def _decode_shard_pull(data):
+    """Incremental ElementTree decoder for any valid worksheet rows"""
+
+    parser = ET.XMLPullParser(events=('end',))
+    parser.feed(b'<sheetData xmlns="' + MAIN_NS.encode() + b'">')
+    rows, columns, kinds, numbers, indices, styles, texts = [], [], [], [], [], [], []
+    column_cache = {}
+    pending = 0  # cells of the current row, which learn their row number at </row>
+
+    for offset in range(0, len(data), FEED_BYTES):
+        parser.feed(data[offset:offset + FEED_BYTES])
+        for _, element in parser.read_events():
+            if element.tag == CELL_TAG:
+                reference = element.get('r')
+                if reference is None:
+                    column = columns[-1] + 1 if pending else 0
+                else:
+                    letters = reference.rstrip('0123456789')
+                    column = column_cache.get(letters)
+                    if column is None:
+                        column = column_cache[letters] = _column_index(letters)
+                cell_type = element.get('t')
+                value = element.find(VALUE_TAG)
+                text = None if value is None else value.text
+                if cell_type == 'inlineStr':
+                    kind, number, index = INLINE, np.nan, len(texts)
+                    inline = element.find(f'{{{MAIN_NS}}}is')
+                    texts.append('' if inline is None else _cell_text(inline))
+                elif text is None:
+                    kind, number, index = EMPTY, np.nan, -1
+                elif cell_type == 's':
+                    kind, number, index = SHARED, np.nan, int(text)
+                elif cell_type in ('str', 'e'):
+                    kind, number, index = INLINE, np.nan, len(texts)
+                    texts.append(text)
+                elif cell_type == 'b':
+                    kind, number, index = BOOLEAN, float(text), -1
+                else:
+                    kind, number, index = NUMBER, float(text), -1
+                columns.append(column)
+                kinds.append(kind)
+                numbers.append(number)
+                indices.append(index)
+                styles.append(int(element.get('s', 0)))
+                pending += 1
+            elif element.tag == ROW_TAG:
+                row = element.get('r')
+                if row is None:
+                    raise ValueError("Worksheet rows without an 'r' attribute cannot be sharded")
+                rows.extend([int(row)] * pending)
+                pending = 0
+                element.clear()
+
+    return {
+        'rows': np.asarray(rows, dtype=np.int64), 'columns': np.asarray(columns, dtype=np.int32),
+        'kinds': np.asarray(kinds, dtype=np.int8), 'numbers': np.asarray(numbers, dtype=np.float64),
+        'indices': np.asarray(indices, dtype=np.int64), 'styles': np.asarray(styles, dtype=np.int32),
+        'texts': texts
+    }
+
+
+def sheet_paths(archive):
+    """Worksheet names and their zip paths, in workbook order"""
+
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    relations = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {relation.get('Id'): relation.get('Target') for relation in relations}
+    paths = {}
+    for sheet in workbook.find(f'{{{MAIN_NS}}}sheets'):
+        target = targets[sheet.get(f'{{{REL_NS}}}id')]
+        paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return paths
+
+
+def read_shared_strings(archive):
+    """Shared strings table as an object array (empty when the workbook has none)"""
+
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return np.array([], dtype=object)
+    data = archive.read('xl/sharedStrings.xml')
+    items = SHARED_STRING_PATTERN.findall(data)
+    if len(items) == data.count(b'<si>') + data.count(b'<si/>') + data.count(b'<si '):
+        strings = np.array(_decode_utf8([simple for simple, _ in items]), dtype=object)
+        rich = [i for i, (simple, body) in enumerate(items) if body]
+        strings[rich] = [_markup_text(items[i][1]) for i in rich]
+        return strings
+
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, element in ET.iterparse(f):
+            if element.tag == SHARED_STRING_TAG:
+                strings.append(_cell_text(element))
+                element.clear()
+    return np.array(strings, dtype=object)
+
+
+def uses_1904_dates(archive):
+    """True when the workbook counts dates from 1904 (workbookPr date1904)"""
+
+    properties = ET.fromstring(archive.read('xl/workbook.xml')).find(f'{{{MAIN_NS}}}workbookPr')
+    return properties is not None and properties.get('date1904', '0').lower() in ('1', 'true')
+
+
+def read_date_styles(archive):
+    """Boolean array over cell style indices: True where the style formats dates"""
+
+    if 'xl/styles.xml' not in archive.namelist():
+        return np.zeros(1, dtype=bool)
+    styles = ET.fromstring(archive.read('xl/styles.xml'))
+    custom = {}
+    for number_format in styles.iter(f'{{{MAIN_NS}}}numFmt'):
+        # Ignore quoted literals, [colour]/[$-locale] tags and escaped characters
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', '', number_format.get('formatCode', ''))
+        custom[int(number_format.get('numFmtId'))] = bool(DATE_FORMAT_CODE.search(code))
+    cell_formats = styles.find(f'{{{MAIN_NS}}}cellXfs')
+    ids = [] if cell_formats is None else [int(xf.get('numFmtId', 0)) for xf in cell_formats]
+    return np.array([custom.get(i, i in DATE_FORMAT_IDS) for i in ids] or [False], dtype=bool)
+
+
+def iter_shards(archive, sheet_path, shard_bytes=SHARD_BYTES):
+    """Yield worksheet XML cut into runs of complete <row> elements"""
+
+    buffer = b''
+    started = False
+    with archive.open(sheet_path) as f:
+        while True:
+            block = f.read(shard_bytes)
+            buffer += block
+            if not started:
+                start = buffer.find(b'<sheetData')
+                if start < 0:
+                    if not block:
+                        return
+                    continue
+                end = buffer.find(b'>', start)
+                if buffer[end - 1:end] == b'/':  # <sheetData/>: no cells
+                    return
+                buffer = buffer[end + 1:]
+                started = True
+            finish = buffer.find(b'</sheetData>')
+            if finish >= 0:
+                if finish:
+                    yield buffer[:finish]
+                return
+            cut = buffer.rfind(b'</row>')
+            if cut >= 0 and (len(buffer) >= shard_bytes or not block):
+                cut += len(b'</row>')
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+            if not block:
+                raise ValueError(f"Truncated worksheet XML in {sheet_path}")
+
+
+def _concatenate(shards):
+    """Merge shard results, offsetting inline string indices"""
+
+    texts, offsets = [], []
+    for shard in shards:
+        offsets.append(len(texts))
+        texts.extend(shard['texts'])
+    cells = {key: np.concatenate([shard[key] for shard in shards]) for key in
+             ('rows', 'columns', 'kinds', 'numbers', 'indices', 'styles')}
+    for shard, offset, start in zip(shards, offsets, np.cumsum([0] + [len(s['rows']) for s in shards[:-1]])):
+        inline = shard['kinds'] == INLINE
+        cells['indices'][start:start + len(inline)][inline] += offset
+    cells['texts'] = np.array(texts, dtype=object)
+    return cells
+
+
+def _excel_dates(serials, date1904=False):
+    """Date-formatted serial numbers as datetime64, rounded to milliseconds like openpyxl"""
+
+    days = np.floor(serials)
+    milliseconds = np.round((serials - days) * 86400 * 1000)
+    if not date1904:
+        days += (serials > 0) & (serials < 60)  # Excel's fictitious 1900-02-29
+    epoch = EXCEL_EPOCH_1904 if date1904 else EXCEL_EPOCH
+    return (np.datetime64(epoch, 'D') + days.astype('timedelta64[D]')
+            + milliseconds.astype('timedelta64[ms]')).astype('datetime64[us]')
+
+
+def _string_values(cells, mask, shared_strings, shared_na):
+    """Strings of the masked text cells and which of them pandas reads as missing"""
+
+    kinds, indices = cells['kinds'][mask], cells['indices'][mask]
+    values = np.empty(len(kinds), dtype=object)
+    is_na = np.zeros(len(kinds), dtype=bool)
+    shared = kinds == SHARED
+    values[shared] = shared_strings[indices[shared]]
+    is_na[shared] = shared_na[indices[shared]]
+    inline = kinds == INLINE
+    values[inline] = cells['texts'][indices[inline]]
+    is_na[inline] = np.isin(values[inline], NA_STRINGS)
+    return values, is_na
+
+
+def _build_column(cells, mask, positions, length, shared_strings, shared_na, date_styles, date1904):
+    """One column with pd.read_excel's dtype rules (see module docstring)"""
+
+    kinds = cells['kinds'][mask].copy()
+    numbers = cells['numbers'][mask]
+    styles = cells['styles'][mask]
+    kinds[(kinds == NUMBER) & date_styles[np.minimum(styles, len(date_styles) - 1)]] = DATE
+    text = (kinds == SHARED) | (kinds == INLINE)
+    strings, string_na = _string_values(cells, mask, shared_strings, shared_na)
+    kinds[text & string_na] = EMPTY
+    present = kinds != EMPTY
+    complete = present.sum() == length
+    present_kinds = set(np.unique(kinds[present]).tolist())
+
+    if not present_kinds:
+        # A column with a header (or a blank leading column) but no values is all-NaN float
+        return np.full(length, np.nan)
+    if present_kinds == {DATE}:
+        values = np.full(length, np.datetime64('NaT'), dtype='datetime64[us]')
+        values[positions[present]] = _excel_dates(numbers[present], date1904)
+        return values
+    if present_kinds == {NUMBER}:
+        values = np.full(length, np.nan)
+        values[positions[present]] = numbers[present]
+        integral = complete and np.all(np.mod(values, 1) == 0)
+        return values.astype(np.int64) if integral else values
+    if present_kinds == {BOOLEAN}:
+        values = np.full(length, np.nan)
+        values[positions[present]] = numbers[present]
+        return values.astype(bool) if complete else values
+    if present_kinds <= {SHARED, INLINE}:
+        values = np.full(length, np.nan, dtype=object)
+        values[positions[present]] = strings[present]
+        return pd.array(values, dtype='str')
+
+    values = np.full(length, np.nan, dtype=object)
+    number = kinds == NUMBER
+    integral = number & (np.mod(numbers, 1) == 0)
+    values[positions[integral]] = numbers[integral].astype(np.int64).tolist()
+    fractional = number & ~integral
+    values[positions[fractional]] = numbers[fractional].tolist()
+    date = kinds == DATE
+    values[positions[date]] = list(pd.DatetimeIndex(_excel_dates(numbers[date], date1904)))
+    boolean = kinds == BOOLEAN
+    values[positions[boolean]] = (numbers[boolean] != 0).tolist()
+    text_present = text & present
+    values[positions[text_present]] = strings[text_present]
+    return values
+
+
+def _decode_sheet(archive, sheet_path, pool, workers, shard_bytes):
+    """Shard results of one worksheet, in order (decoded here when there is no pool)"""
+
+    if pool is None:
+        return [decode_shard(shard) for shard in iter_shards(archive, sheet_path, shard_bytes)]
+
+    shards = []
+    # At most two shards per worker in flight, so the decompressed XML is never all in memory
+    in_flight = deque()
+    for shard in iter_shards(archive, sheet_path, shard_bytes):
+        if len(in_flight) >= 2 * workers:
+            shards.append(in_flight.popleft().result())
+        in_flight.append(pool.submit(decode_shard, shard))
+    shards.extend(future.result() for future in in_flight)
+    return shards
+
+
+def _column_names(headers):
+    """Header names as pd.read_excel sets them: 'Unnamed: k' for blank cells, and
+    duplicates renamed 'A.1', 'A.2', ... skipping names already in the header; named
+    columns are renamed before unnamed ones"""
+
+    names = [f'Unnamed: {column}' if header is None else header for column, header in enumerate(headers)]
+    unnamed = [column for column, header in enumerate(headers) if header is None]
+    named = [column for column, header in enumerate(headers) if header is not None]
+    counts = defaultdict(int)
+    for column in named + unnamed:
+        name = original = names[column]
+        count = counts[name]
+        while count > 0:
+            counts[original] = count + 1
+            name = f'{original}.{count}'
+            count = count + 1 if name in names else counts[name]
+        names[column] = name
+        counts[name] = count + 1
+    return names
+
+
+def _build_frame(shards, shared_strings, shared_na, date_styles, date1904=False):
+    """DataFrame from a worksheet's cells, the first worksheet row as header"""
+
+    if not shards:
+        return pd.DataFrame()
+    cells = _concatenate(shards)
+
+    # Cells holding a value; empty strings count as blank, as pandas trims them from rows
+    text = (cells['kinds'] == SHARED) | (cells['kinds'] == INLINE)
+    text_values, _ = _string_values(cells, text, shared_strings, np.zeros_like(shared_na))
+    filled = cells['kinds'] != EMPTY
+    filled[np.flatnonzero(text)[text_values == '']] = False
+
+    header = cells['rows'] == HEADER_ROW
+    names = {}
+    header_strings, _ = _string_values(cells, header, shared_strings, np.zeros_like(shared_na))
+    for column, kind, number, string in zip(cells['columns'][header], cells['kinds'][header],
+                                            cells['numbers'][header], header_strings):
+        if kind in (SHARED, INLINE) and string != '':
+            names[column] = string
+        elif kind == NUMBER:
+            names[column] = int(number) if number % 1 == 0 else number
+    # Every row from below the header to the last row with a value, blank rows included
+    data = cells['rows'] > HEADER_ROW
+    last_row = cells['rows'][data & filled].max(initial=HEADER_ROW)
+    length = last_row - HEADER_ROW
+    width = cells['columns'][filled].max(initial=-1) + 1
+    columns = []
+    for column in range(width):
+        mask = data & (cells['columns'] == column) & (cells['rows'] <= last_row)
+        positions = cells['rows'][mask] - HEADER_ROW - 1
+        columns.append(_build_column(
+            cells, mask, positions, length, shared_strings, shared_na, date_styles, date1904
+        ))
+    return pd.DataFrame(dict(zip(_column_names([names.get(column) for column in range(width)]), columns)))
+
+
+def _read_sheets(path, names, workers, shard_bytes):
+    """Frames for the named worksheets (None = first), sharing one strings table and worker pool"""
+
+    with zipfile.ZipFile(path) as archive:
+        paths = sheet_paths(archive)
+        selected = []
+        for name in names:
+            if name is not None and name not in paths:
+                raise ValueError(f"Worksheet named '{name}' not found")
+            selected.append(paths[name] if name is not None else next(iter(paths.values())))
+        shared_strings = read_shared_strings(archive)
+        shared_na = np.isin(shared_strings, NA_STRINGS)
+        date_styles = read_date_styles(archive)
+        date1904 = uses_1904_dates(archive)
+
+        # Worksheets smaller than one shard are decoded in this process
+        sheet_bytes = sum(archive.getinfo(sheet_path).file_size for sheet_path in selected)
+        workers = workers or os.cpu_count()
+        parallel = sheet_bytes > shard_bytes and workers > 1
+        with ProcessPoolExecutor(max_workers=workers) if parallel else nullcontext() as pool:
+            return [
+                _build_frame(_decode_sheet(archive, sheet_path, pool, workers, shard_bytes),
+                             shared_strings, shared_na, date_styles, date1904)
+                for sheet_path in selected
+            ]
+
+
+def read_xlsx(path, sheet_name=None, workers=None, shard_bytes=SHARD_BYTES):
+    """Read one worksheet (default: the first) like pd.read_excel, decoding shards in parallel"""
+
+    return _read_sheets(path, [sheet_name], workers, shard_bytes)[0]
+
+
+def read_xlsx_sheets(path, workers=None, shard_bytes=SHARD_BYTES):
+    """Stack every worksheet (each with its own header row), for exports split at Excel's row limit"""
+
+    with zipfile.ZipFile(path) as archive:
+        names = list(sheet_paths(archive))
+    return pd.concat(_read_sheets(path, names, workers, shard_bytes), ignore_index=True)
+
+
+def _xml_part(archive, name, text):
+    """Write one XML part into the workbook zip"""
+
+    archive.writestr(name, '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + text)
+
+
+def write_synthetic_workbook(path, rows, seed=0, sheet_rows=EXCEL_MAX_ROWS - 1):
+    """Page_Views-shaped workbook with a shared strings table, as the LMS writes it
+
+    Rows beyond one worksheet's limit continue on further worksheets, each with the header.
+    """
+
+    rng = np.random.default_rng(seed)
+    users = np.sort(rng.integers(1000, 1000 + max(rows // 200, 1), rows))
+    micros = np.sort(rng.integers(0, 10 ** 14, rows))
+    pages = rng.integers(1, 192, rows).astype(str).astype(object)
+    pages[rng.random(rows) < 0.09] = None  # 'menu'
+
+    # Shared strings: header, placeholder, 'menu', then one entry per timestamp
+    fixed = ['UserId', 'Page', 'Date / Time', 'UserName', '0000-00-00 00:00:00.000000', 'menu']
+    stamps = (pd.Timestamp('2021-01-01') + pd.to_timedelta(micros, unit='us')).strftime('%Y-%m-%d %H:%M:%S.%f')
+    sheets = (rows + 1 + sheet_rows - 1) // sheet_rows  # the placeholder row counts as data
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        _xml_part(archive, '[Content_Types].xml', (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/'
+                      f'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' for i in range(1, sheets + 1))
+            + '</Types>'))
+        _xml_part(archive, '_rels/.rels', (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+            'officeDocument" Target="xl/workbook.xml"/></Relationships>'))
+        _xml_part(archive, 'xl/workbook.xml', (
+            f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheets>'
+            + ''.join(f'<sheet name="Sheet{i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, sheets + 1))
+            + '</sheets></workbook>'))
+        _xml_part(archive, 'xl/_rels/workbook.xml.rels', (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                      for i in range(1, sheets + 1))
+            + f'<Relationship Id="rId{sheets + 1}" Type="{REL_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+            + '</Relationships>'))
+
+        with archive.open('xl/sharedStrings.xml', 'w', force_zip64=True) as f:
+            f.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="{MAIN_NS}" '
+                    f'uniqueCount="{len(fixed) + rows}">'.encode())
+            f.write(''.join(f'<si><t>{text}</t></si>' for text in fixed).encode())
+            for start in range(0, rows, CHUNK_ROWS):
+                f.write(''.join(f'<si><t>{stamp}</t></si>' for stamp in stamps[start:start + CHUNK_ROWS]).encode())
+            f.write(b'</sst>')
+
+        header = '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c><c r="C1" t="s"><v>2</v></c></row>'
+        placeholder = '<c r="A{0}" t="s"><v>3</v></c><c r="B{0}" t="s"><v>1</v></c><c r="C{0}" t="s"><v>4</v></c>'
+        for sheet in range(sheets):
+            first, last = max(sheet * sheet_rows - 1, 0), min((sheet + 1) * sheet_rows - 1, rows)
+            with archive.open(f'xl/worksheets/sheet{sheet + 1}.xml', 'w', force_zip64=True) as f:
+                f.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{MAIN_NS}">'
+                        f'<sheetData>{header}'.encode())
+                row = 2
+                if sheet == 0:
+                    f.write(f'<row r="2">{placeholder.format(2)}</row>'.encode())
+                    row = 3
+                for start in range(first, last, CHUNK_ROWS):
+                    stop = min(start + CHUNK_ROWS, last)
+                    f.write(''.join(
+                        f'<row r="{r}"><c r="A{r}"><v>{user}</v></c>'
+                        + (f'<c r="B{r}" t="s"><v>5</v></c>' if page is None else f'<c r="B{r}"><v>{page}</v></c>')
+                        + f'<c r="C{r}" t="s"><v>{len(fixed) + i}</v></c></row>'
+                        for r, i, user, page in zip(range(row + start - first, row + stop - first), range(start, stop),
+                                                    users[start:stop].tolist(), pages[start:stop])
+                    ).encode())
+                f.write(b'</sheetData></worksheet>')
+
+
+def write_edge_case_workbooks(directory):
+    """Small workbooks with layouts the sharded reader must read exactly like pd.read_excel"""
+
+    from datetime import datetime
+    from openpyxl import Workbook
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+    def save(name, rows, epoch=None):
+        workbook = Workbook()
+        if epoch is not None:
+            workbook.epoch = epoch
+        sheet = workbook.active
+        for row_number, row in rows.items():
+            for column, value in enumerate(row, start=1):
+                if value is not None:
+                    sheet.cell(row_number, column, value)
+        path = os.path.join(directory, name)
+        workbook.save(path)
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    visits = {1: ['UserId', 'Page', 'Date / Time'], 2: [1001, 5, datetime(2021, 3, 1, 9, 30)],
+              5: [1002, 'menu', datetime(2021, 3, 2, 14, 0)], 6: [1003, 'NA', datetime(2021, 3, 3)]}
+    return [
+        save('blank_rows.xlsx', {**visits, 8: [None, None, None]}),
+        save('formula_without_value.xlsx', {**visits, 2: [1001, 5, datetime(2021, 3, 1), None, '=A2+1']}),
+        save('dates_1904.xlsx', visits, epoch=CALENDAR_MAC_1904),
+        save('blank_header_cells.xlsx', {1: ['UserId', None, 'Date / Time'], 2: [1001, 5, 'x']}),
+        save('duplicate_headers.xlsx', {1: ['Page', 'Page', 'Page.1', 'UserId', 'Page', None, 1, 1],
+                                        2: [5, 'menu', 7, 1001, 8, 9, 10, 11]}),
+        save('blank_leading_column.xlsx', {1: [None, 'UserId', 'Page', 'Notes'],
+                                           2: [None, 1001, 5], 3: [None, 1002, 'menu']})
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare sharded xlsx decoding with pd.read_excel')
+    parser.add_argument('workbooks', nargs='*', default=['Page_Views.xlsx', 'Login_History.xlsx'],
+                        help='workbooks to check for equivalence')
+    parser.add_argument('--rows', type=int, default=0, help='also benchmark a synthetic workbook with this many rows')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--synthetic', default='synthetic_page_views.xlsx')
+    parser.add_argument('--skip-read-excel', action='store_true',
+                        help='time only the sharded reader on the synthetic workbook')
+    parser.add_argument('--edge-cases', default='xlsx_edge_cases',
+                        help='directory for small workbooks with blank rows and columns, uncached formulas, '
+                             'duplicate headers and 1904 dates')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("SHARDED XLSX DECODING")
+    print("=" * 80)
+
+    workbooks = list(args.workbooks) + write_edge_case_workbooks(args.edge_cases)
+    if args.rows:
+        if not os.path.exists(args.synthetic):
+            start = time.perf_counter()
+            write_synthetic_workbook(args.synthetic, args.rows)
+            print(f"Wrote {args.rows:,}-row synthetic workbook in {time.perf_counter() - start:.1f}s")
+        workbooks.append(args.synthetic)
+
+    ok = True
+    for path in workbooks:
+        # The synthetic workbook spans several worksheets; the exports have one
+        all_sheets = path == args.synthetic
+        size_mb = os.path.getsize(path) / 1e6
+        start = time.perf_counter()
+        sharded = read_xlsx_sheets(path, args.workers) if all_sheets else read_xlsx(path, workers=args.workers)
+        sharded_seconds = time.perf_counter() - start
+        if args.skip_read_excel and all_sheets:
+            print(f"\n{path} ({size_mb:,.1f} MB, {len(sharded):,} rows): sharded {sharded_seconds:.1f}s")
+            continue
+
+        start = time.perf_counter()
+        if all_sheets:
+            reference = pd.concat(pd.read_excel(path, sheet_name=None).values(), ignore_index=True)
+        else:
+            reference = pd.read_excel(path)
+        excel_seconds = time.perf_counter() - start
+        try:
+            pd.testing.assert_frame_equal(sharded, reference)
+            match = True
+        except AssertionError as e:
+            print(f"  ✗ {path} differs from pd.read_excel: {e}")
+            match = False
+        ok &= match
+        print(f"\n{path} ({size_mb:,.1f} MB, {len(reference):,} rows)")
+        print(f"  pd.read_excel {excel_seconds:8.2f}s")
+        print(f"  sharded       {sharded_seconds:8.2f}s  ({excel_seconds / sharded_seconds:.1f}x, "
+              f"{args.workers or os.cpu_count()} workers)  {'✓ identical' if match else '✗ DIFFERENT'}")
+
+    raise SystemExit(0 if ok else 1)